@@ -6,32 +6,72 @@
 # --- Imports Necessários ---
 import streamlit as st
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, PoolError, pooling
 import pandas as pd
+import numpy as np
+import openpyxl
+import copy
+import csv
+import functools
 import hashlib
+import inspect
 import io
-from datetime import datetime
-
-# DICIONÁRIO PARA TRADUZIR MESES
-meses_pt_en = {
-    'janeiro': 'january', 'fevereiro': 'february', 'março': 'march',
-    'abril': 'april', 'maio': 'may', 'junho': 'june',
-    'julho': 'july', 'agosto': 'august', 'setembro': 'september',
-    'outubro': 'october', 'novembro': 'november', 'dezembro': 'december'
+import json
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import xlsxwriter
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+# --- DATAS DO MS PROJECT EM PORTUGUÊS ---
+# O MS Project exporta datas como texto no formato configurado no Windows
+# ("27 Fevereiro 2025 08:00", "seg 03/02/25", "27/02/25 08:00"...). A coluna inteira
+# é normalizada com operações vetorizadas do pandas (mês por extenso vira número,
+# dia da semana sai) e convertida com formatos explícitos, do mais ao menos comum.
+MESES_PT = {
+    'jan': '01', 'fev': '02', 'mar': '03', 'abr': '04', 'mai': '05', 'jun': '06',
+    'jul': '07', 'ago': '08', 'set': '09', 'out': '10', 'nov': '11', 'dez': '12'
 }
-
-def traduzir_data_pt_en(data_str):
-    """Recebe uma data em texto (ex: '27 Fevereiro 2025') e a traduz para inglês."""
-    if not isinstance(data_str, str):
-        return data_str  # Retorna o valor original se não for texto
-    
-    data_str_lower = data_str.lower()
-    for mes_pt, mes_en in meses_pt_en.items():
-        if mes_pt in data_str_lower:
-            # Substitui o mês em português pelo inglês e retorna
-            return data_str_lower.replace(mes_pt, mes_en)
-            
-    return data_str # Retorna o original se nenhum mês for encontrado
+PADRAO_MES_PT = re.compile(r'\b(' + '|'.join(MESES_PT) + r')[a-zà-ú]*\.?(?=\s|$)')
+PADRAO_DIA_SEMANA_PT = r'^(?:seg|ter|qua|qui|sex|s[aá]b|dom)[a-zà-ú-]*\.?,?\s+'
+FORMATOS_DATA_MS_PROJECT = [
+    '%d %m %Y %H:%M', '%d %m %Y', '%d %m %y %H:%M', '%d %m %y',
+    '%d/%m/%y %H:%M', '%d/%m/%y', '%d/%m/%Y %H:%M', '%d/%m/%Y',
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y-%m-%dt%H:%M:%S', # ISO do Excel e do XML (MSPDI), já em minúsculas
+]
+
+def converter_datas_ms_project(valores, cache=None):
+    """
+    Converte uma Series de datas do MS Project (texto em português ou datas já
+    convertidas pelo Excel) em datetime64; o que não for reconhecido vira NaT.
+    Cada valor distinto é convertido uma única vez: 'cache' (dict valor -> Timestamp)
+    pode ser compartilhado entre chamadas, já que um cronograma repete poucas datas.
+    """
+    cache = {} if cache is None else cache
+    unicos = pd.Series(pd.unique(valores.dropna()), dtype=object)
+    unicos = unicos[~unicos.isin(cache.keys())]
+    if not unicos.empty:
+        eh_texto = unicos.str.len().notna()
+        convertidas = pd.Series(pd.NaT, index=unicos.index, dtype='datetime64[ns]')
+        convertidas[~eh_texto] = pd.to_datetime(unicos[~eh_texto], errors='coerce')
+
+        textos = (
+            unicos[eh_texto].str.strip().str.lower()
+            .str.replace(PADRAO_DIA_SEMANA_PT, '', regex=True)
+            .str.replace(PADRAO_MES_PT, lambda m: MESES_PT[m.group(1)], regex=True)
+            .str.replace(r'\s+(?:de\s+)?', ' ', regex=True)
+        )
+        for formato in FORMATOS_DATA_MS_PROJECT:
+            pendentes = convertidas[eh_texto].isna()
+            if not pendentes.any():
+                break
+            indices = pendentes[pendentes].index
+            convertidas[indices] = pd.to_datetime(textos[indices], format=formato, errors='coerce')
+        cache.update(zip(unicos, convertidas))
+    return pd.to_datetime(valores.map(cache), errors='coerce')
 
 import os
 import tempfile
@@ -44,39 +84,509 @@ import tempfile
 # --- Configuração Inicial da Página ---
 st.set_page_config(layout="wide")
 
+#region Cache de Leitura com Invalidação por Tags
+
+# Cada leitura cacheada declara as TAGS de que depende: tuplas (tabela, escopo).
+# O escopo é o id que particiona a tabela para aquela leitura (obra_id para
+# estoque/movimentações/tarefas, id do material em 'materiais', kit_id em
+# 'kit_materiais'...) ou None quando a leitura depende da tabela inteira.
+# As escritas chamam invalidar_cache((tabela, escopo), ...) e só as entradas
+# afetadas saem do cache:
+#   - invalidar (t, x)    -> remove as leituras marcadas (t, x) e (t, None);
+#   - invalidar (t, None) -> remove todas as leituras marcadas com a tabela t.
+# Nunca use st.cache_data.clear() em escritas: isso apaga o cache de todas as obras.
+
+# Uma entrada do registro vive só enquanto a leitura pode estar no cache: o st.cache_data
+# guarda o resultado por 'ttl' a partir de uma chamada, então a entrada cuja última
+# chamada passou do ttl não tem mais o que invalidar e sai na varredura periódica.
+INTERVALO_LIMPEZA_REGISTRO_S = 60
+
+@st.cache_resource
+def _get_registro_tags():
+    """Registro do processo: tabela -> escopo -> {chave: (última chamada, ttl, função cacheada, args, kwargs)}."""
+    return {"lock": threading.Lock(), "tags": {}, "proxima_limpeza": 0.0}
+
+def _limpar_registro_tags(registro, agora):
+    """Remove as entradas expiradas (e os escopos/tabelas que ficarem vazios). Chamar com o lock."""
+    for tabela in list(registro["tags"]):
+        escopos = registro["tags"][tabela]
+        for escopo in list(escopos):
+            entradas = escopos[escopo]
+            for chave in [c for c, (instante, ttl, *_) in entradas.items() if agora - instante > ttl]:
+                del entradas[chave]
+            if not entradas:
+                del escopos[escopo]
+        if not escopos:
+            del registro["tags"][tabela]
+    registro["proxima_limpeza"] = agora + INTERVALO_LIMPEZA_REGISTRO_S
+
+def cache_leitura(ttl, tags):
+    """
+    Decorator para funções de LEITURA: aplica st.cache_data(ttl) e registra as tags
+    de cada chamada. 'tags' é uma lista fixa de (tabela, escopo) ou uma função que
+    recebe o dicionário de argumentos da chamada e devolve essa lista.
+    """
+    def decorador(func):
+        func_cache = st.cache_data(ttl=ttl)(func)
+        assinatura = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if callable(tags):
+                argumentos = assinatura.bind(*args, **kwargs)
+                argumentos.apply_defaults()
+                tags_chamada = tags(argumentos.arguments)
+            else:
+                tags_chamada = tags
+            # Só o hash dos argumentos vira chave; o repr completo não fica guardado
+            chave = (func.__qualname__, hashlib.sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest())
+            # Cópia dos argumentos: um filtro alterado depois no session_state não pode mudar
+            # qual entrada do cache será limpa na invalidação
+            args_registro, kwargs_registro = copy.deepcopy(args), copy.deepcopy(kwargs)
+            registro = _get_registro_tags()
+            with registro["lock"]:
+                agora = time.monotonic()
+                if agora >= registro["proxima_limpeza"]:
+                    _limpar_registro_tags(registro, agora)
+                for tabela, escopo in tags_chamada:
+                    entradas = registro["tags"].setdefault(tabela, {}).setdefault(escopo, {})
+                    entradas[chave] = (agora, ttl, func_cache, args_registro, kwargs_registro)
+            return func_cache(*args, **kwargs)
+
+        wrapper.clear = func_cache.clear
+        return wrapper
+    return decorador
+
+def invalidar_cache(*tags):
+    """Remove do cache apenas as leituras que dependem das tags (tabela, escopo) informadas."""
+    registro = _get_registro_tags()
+    para_limpar = {}
+    with registro["lock"]:
+        for tabela, escopo in tags:
+            escopos = registro["tags"].get(tabela, {})
+            alvos = list(escopos) if escopo is None else [escopo, None]
+            for alvo in alvos:
+                para_limpar.update(escopos.pop(alvo, {}))
+    for _, _, func_cache, args, kwargs in para_limpar.values():
+        func_cache.clear(*args, **kwargs)
+
+#endregion
+
+#region Comandos de Escrita (Idempotência)
+
+# Funções que ALTERAM o banco nunca usam st.cache_data: o cache devolveria um
+# "sucesso" antigo sem executar a escrita e ainda gastaria tempo gerando o hash
+# dos argumentos (inclusive DataFrames inteiros). Em vez disso elas usam
+# @comando_escrita, que aceita o argumento opcional 'chave_idempotencia'.
+# Repetições com a mesma chave (clique duplo, nova tentativa após timeout)
+# devolvem o resultado da primeira execução bem-sucedida sem escrever de novo;
+# chamadas simultâneas com a mesma chave esperam a primeira terminar.
+# Gere uma chave por intenção do usuário com nova_chave_idempotencia() e troque-a
+# depois do sucesso, ou use uma chave natural (ex.: f"estorno-{mov_id}").
+
+IDEMPOTENCIA_TTL_S = 3600 # Por quanto tempo um resultado fica disponível para repetições
+
+@st.cache_resource
+def _get_registro_comandos():
+    """
+    Registro do processo: (comando, chave) -> (instante, resultado) e, para as chaves em
+    execução, (comando, chave) -> [trava, nº de chamadas usando a trava]. A trava só sai
+    do registro quando a última chamada que a usa termina; assim quem chega depois sempre
+    espera na mesma trava de quem ainda está executando ou esperando.
+    """
+    return {"lock": threading.Lock(), "resultados": {}, "travas": {}}
+
+def nova_chave_idempotencia():
+    return uuid.uuid4().hex
+
+def _comando_bem_sucedido(resultado):
+    """Os comandos retornam (sucesso, mensagem) ou (sucessos, ...); None indica falha."""
+    if isinstance(resultado, tuple) and resultado:
+        return bool(resultado[0])
+    return False
+
+def comando_escrita(func):
+    """Decorator para funções de ESCRITA: sem cache e com deduplicação por chave_idempotencia."""
+    @functools.wraps(func)
+    def wrapper(*args, chave_idempotencia=None, **kwargs):
+        if chave_idempotencia is None:
+            return func(*args, **kwargs)
+
+        chave = (func.__name__, chave_idempotencia)
+        registro = _get_registro_comandos()
+        with registro["lock"]:
+            agora = time.monotonic()
+            expirados = [k for k, (instante, _) in registro["resultados"].items() if agora - instante > IDEMPOTENCIA_TTL_S]
+            for k in expirados:
+                del registro["resultados"][k]
+            uso = registro["travas"].setdefault(chave, [threading.Lock(), 0])
+            uso[1] += 1
+
+        try:
+            with uso[0]:
+                with registro["lock"]:
+                    if chave in registro["resultados"]:
+                        return registro["resultados"][chave][1]
+                resultado = func(*args, **kwargs)
+                if _comando_bem_sucedido(resultado):
+                    with registro["lock"]:
+                        registro["resultados"][chave] = (time.monotonic(), resultado)
+                return resultado
+        finally:
+            with registro["lock"]:
+                uso[1] -= 1
+                if uso[1] == 0:
+                    registro["travas"].pop(chave, None)
+    return wrapper
+
+#endregion
+
+#region Instrumentação de SQL
+
+# Quando st.secrets["instrumentacao"]["ativa"] for true, as conexões dos pools são
+# embrulhadas e cada execute/executemany (inclusive os feitos pelo pd.read_sql)
+# registra: fingerprint do comando, linhas, bytes aproximados e tempo de parede.
+# Os registros são agrupados por execução do script (rerun):
+#   - usuários listados em st.secrets["instrumentacao"]["admins"] veem um painel
+#     na barra lateral com os totais da execução;
+#   - se st.secrets["instrumentacao"]["log_jsonl"] apontar para um arquivo, cada
+#     comando é gravado nele como uma linha JSON para análise offline.
+# Desativada, as conexões são devolvidas sem embrulho (custo zero).
+
+def _config_instrumentacao():
+    return st.secrets.get("instrumentacao", {})
+
+def instrumentacao_ativa():
+    return bool(_config_instrumentacao().get("ativa", False))
+
+@st.cache_resource
+def _get_instrumentacao():
+    """Estado do processo: registros da execução de cada thread e trava do arquivo de log."""
+    return {"local": threading.local(), "lock_log": threading.Lock()}
+
+def fingerprint_sql(sql):
+    """Normaliza o comando: literais e parâmetros viram '?', listas IN viram '(?+)'."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", "?", sql)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?+)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+def _estimar_bytes(linhas):
+    total = 0
+    for linha in linhas:
+        valores = linha.values() if isinstance(linha, dict) else linha
+        for valor in valores:
+            total += len(valor) if isinstance(valor, (str, bytes, bytearray)) else 8
+    return total
+
+def _registros_execucao():
+    return getattr(_get_instrumentacao()["local"], "registros", None)
+
+class CursorInstrumentado:
+    """Cursor que mede cada comando; o restante é delegado ao cursor real."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._registro = None
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _medir(self, metodo, operacao, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return metodo(operacao, *args, **kwargs)
+        finally:
+            self._registro = {
+                "fingerprint": fingerprint_sql(operacao),
+                "linhas": max(self._cursor.rowcount, 0),
+                "bytes": 0,
+                "ms": (time.perf_counter() - inicio) * 1000,
+            }
+            registros = _registros_execucao()
+            if registros is not None:
+                registros.append(self._registro)
+
+    def execute(self, operacao, *args, **kwargs):
+        return self._medir(self._cursor.execute, operacao, *args, **kwargs)
+
+    def executemany(self, operacao, *args, **kwargs):
+        return self._medir(self._cursor.executemany, operacao, *args, **kwargs)
+
+    def _buscar(self, metodo, *args):
+        inicio = time.perf_counter()
+        resultado = metodo(*args)
+        if self._registro is not None:
+            linhas = resultado if isinstance(resultado, list) else ([] if resultado is None else [resultado])
+            self._registro["ms"] += (time.perf_counter() - inicio) * 1000
+            self._registro["linhas"] = max(self._registro["linhas"], self._cursor.rowcount, len(linhas))
+            self._registro["bytes"] += _estimar_bytes(linhas)
+        return resultado
+
+    def fetchone(self):
+        return self._buscar(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._buscar(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._buscar(self._cursor.fetchall)
+
+class ConexaoInstrumentada:
+    """Conexão do pool cujos cursores são instrumentados (inclusive os do pd.read_sql)."""
+
+    def __init__(self, conexao):
+        self._conexao = conexao
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    def cursor(self, *args, **kwargs):
+        return CursorInstrumentado(self._conexao.cursor(*args, **kwargs))
+
+def instrumentar_conexao(conexao):
+    return ConexaoInstrumentada(conexao) if instrumentacao_ativa() else conexao
+
+def iniciar_metricas_execucao():
+    """Abre a lista de registros da execução atual do script."""
+    local = _get_instrumentacao()["local"]
+    local.registros = [] if instrumentacao_ativa() else None
+    local.execucao_id = uuid.uuid4().hex[:12]
+
+def finalizar_metricas_execucao():
+    """Grava os registros da execução no arquivo JSONL (se configurado) e os descarta."""
+    instrumentacao = _get_instrumentacao()
+    local = instrumentacao["local"]
+    registros = getattr(local, "registros", None)
+    local.registros = None
+    caminho = _config_instrumentacao().get("log_jsonl")
+    if not registros or not caminho:
+        return
+    instante = datetime.now().isoformat(timespec="seconds")
+    usuario = st.session_state.get("usuario_nome")
+    pagina = st.session_state.get("menu_principal")
+    linhas = [
+        json.dumps({"ts": instante, "execucao": local.execucao_id, "usuario": usuario, "pagina": pagina, **registro}, ensure_ascii=False)
+        for registro in registros
+    ]
+    try:
+        with instrumentacao["lock_log"]:
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+            with open(caminho, "a", encoding="utf-8") as arquivo:
+                arquivo.write("\n".join(linhas) + "\n")
+    except OSError as e:
+        print(f"ERRO ao gravar log de SQL: {e}")
+
+def resumo_metricas_execucao():
+    """Agrupa os registros da execução atual por fingerprint."""
+    registros = _registros_execucao() or []
+    if not registros:
+        return pd.DataFrame(columns=["fingerprint", "execucoes", "ms", "linhas", "bytes"])
+    df = pd.DataFrame(registros)
+    return (
+        df.groupby("fingerprint", as_index=False)
+        .agg(execucoes=("ms", "size"), ms=("ms", "sum"), linhas=("linhas", "sum"), bytes=("bytes", "sum"))
+        .sort_values("ms", ascending=False)
+    )
+
+def usuario_admin():
+    """Administradores são os usuários listados em st.secrets["instrumentacao"]["admins"]."""
+    return st.session_state.get("usuario_nome") in _config_instrumentacao().get("admins", [])
+
+def render_painel_sql():
+    """Painel (apenas administradores) com os totais de SQL desta execução."""
+    if not instrumentacao_ativa():
+        return
+    if not usuario_admin():
+        return
+    resumo = resumo_metricas_execucao()
+    with st.sidebar.expander("🛠️ SQL desta execução"):
+        cols = st.columns(2)
+        cols[0].metric("Consultas", int(resumo["execucoes"].sum()))
+        cols[1].metric("Tempo (ms)", f"{resumo['ms'].sum():.0f}")
+        cols = st.columns(2)
+        cols[0].metric("Linhas", int(resumo["linhas"].sum()))
+        cols[1].metric("KB", f"{resumo['bytes'].sum() / 1024:.1f}")
+        st.dataframe(resumo, hide_index=True, use_container_width=True, column_config={"ms": st.column_config.NumberColumn(format="%.1f")})
+        st.caption("Pools de conexões")
+        try:
+            # Os pools são criados aqui se ainda não existirem; com o banco fora do ar isso falha
+            st.dataframe(pd.DataFrame({tipo: obter_estatisticas_pool(tipo) for tipo in ("leitura", "escrita")}), use_container_width=True)
+        except Error as e:
+            st.warning(f"Estatísticas dos pools indisponíveis: {e}")
+
+#endregion
+
 #region Funções de Conexão e Autenticação
 
-@st.cache_resource(ttl=600) # Cache dura 10 minutos ou até invalidar
-def _get_cached_connection():
-    """Cria a conexão física e a mantém em cache."""
-    return mysql.connector.connect(
-        host=st.secrets["db"]["host"],
-        user=st.secrets["db"]["user"],
-        password=st.secrets["db"]["password"],
-        database=st.secrets["db"]["database"],
-        port=st.secrets["db"]["port"]
+def _parametros_conexao():
+    """Lê os parâmetros de conexão do banco a partir do st.secrets."""
+    return {
+        "host": st.secrets["db"]["host"],
+        "user": st.secrets["db"]["user"],
+        "password": st.secrets["db"]["password"],
+        "database": st.secrets["db"]["database"],
+        "port": st.secrets["db"]["port"],
+    }
+
+# --- Pools de Conexões ---
+# Há dois pools por processo, guardados em st.cache_resource (por isso NUNCA use
+# st.cache_resource.clear(): isso descartaria os pools com as conexões emprestadas):
+#   - "escrita": conexões emprestadas por uma única operação (obter_conexao_para_transacao)
+#                e devolvidas com liberar_conexao() no finally.
+#   - "leitura": cada thread (execução do script de uma sessão) recebe a SUA conexão
+#                em conectar_mysql_leitura(), reaproveitada por todas as leituras daquela
+#                execução e devolvida por liberar_conexao_leitura() ao final do script.
+#                Funções de leitura NUNCA devem fechar essa conexão.
+# Pools separados evitam que uma execução segurando a conexão de leitura fique
+# esperando por uma conexão de escrita presa por outra execução.
+# Configuração opcional em st.secrets["db"]: pool_size (escrita, padrão 5),
+# pool_size_leitura (padrão 5), ambos no máx. 32, e pool_timeout (segundos de
+# espera por uma conexão livre, padrão 10).
+
+POOL_TAMANHO_PADRAO = 5
+POOL_TIMEOUT_PADRAO = 10
+_CHAVES_TAMANHO_POOL = {"escrita": "pool_size", "leitura": "pool_size_leitura"}
+
+@st.cache_resource
+def _get_pool_conexoes(tipo="escrita"):
+    """Cria o pool de conexões do processo ('escrita' ou 'leitura') e suas estatísticas."""
+    config_db = st.secrets["db"]
+    tamanho = int(config_db.get(_CHAVES_TAMANHO_POOL[tipo], POOL_TAMANHO_PADRAO))
+    tamanho = max(1, min(tamanho, pooling.CNX_POOL_MAXSIZE))
+    pool = pooling.MySQLConnectionPool(
+        pool_name=f"almoxarifado_{tipo}",
+        pool_size=tamanho,
+        pool_reset_session=True, # Encerra transações/variáveis de sessão ao devolver
+        # Leituras em autocommit enxergam sempre o último commit, sem snapshot preso
+        autocommit=(tipo == "leitura"),
+        **_parametros_conexao()
     )
+    return {
+        "pool": pool,
+        "tamanho": tamanho,
+        "timeout": float(config_db.get("pool_timeout", POOL_TIMEOUT_PADRAO)),
+        "lock": threading.Lock(),
+        "local": threading.local(), # Conexão de leitura de cada thread
+        "stats": {
+            "checkouts": 0,
+            "em_uso": 0,
+            "pico_em_uso": 0,
+            "esperas": 0,
+            "timeouts": 0,
+            "falhas_validacao": 0,
+            "tempo_espera_total_s": 0.0,
+        },
+    }
+
+def _atualizar_stats_pool(recurso, **incrementos):
+    with recurso["lock"]:
+        stats = recurso["stats"]
+        for chave, valor in incrementos.items():
+            stats[chave] += valor
+        stats["pico_em_uso"] = max(stats["pico_em_uso"], stats["em_uso"])
+
+def obter_conexao_do_pool(tipo="escrita"):
+    """
+    Retira uma conexão do pool, esperando até 'pool_timeout' segundos caso todas
+    estejam em uso. A validação de saúde é feita pelo próprio pool na retirada
+    (ping + reconexão automática se a conexão tiver caído).
+    Toda conexão obtida aqui DEVE ser devolvida com liberar_conexao().
+    """
+    recurso = _get_pool_conexoes(tipo)
+    pool = recurso["pool"]
+    inicio = time.monotonic()
+    limite = inicio + recurso["timeout"]
+    esperou = False
+    while True:
+        try:
+            conexao = pool.get_connection()
+            break
+        except PoolError:
+            # Pool esgotado: aguarda alguém devolver uma conexão
+            if time.monotonic() >= limite:
+                _atualizar_stats_pool(recurso, timeouts=1)
+                raise
+            esperou = True
+            time.sleep(0.05)
+        except Error:
+            # A conexão estava morta e a reconexão falhou
+            _atualizar_stats_pool(recurso, falhas_validacao=1)
+            raise
+    _atualizar_stats_pool(
+        recurso,
+        checkouts=1,
+        em_uso=1,
+        esperas=1 if esperou else 0,
+        tempo_espera_total_s=time.monotonic() - inicio,
+    )
+    return instrumentar_conexao(conexao)
+
+def liberar_conexao(conexao):
+    """Devolve ao pool de origem uma conexão obtida com obter_conexao_do_pool()."""
+    if conexao is None:
+        return
+    tipo = conexao.pool_name.removeprefix("almoxarifado_")
+    try:
+        conexao.close() # Em conexões do pool, close() devolve ao pool
+    except Error:
+        pass
+    finally:
+        _atualizar_stats_pool(_get_pool_conexoes(tipo), em_uso=-1)
+
+def obter_conexao_para_transacao():
+    """CONEXÃO PARA ESCRITA: Obtém uma conexão do pool (devolver com liberar_conexao)."""
+    try:
+        return obter_conexao_do_pool("escrita")
+    except Error as e:
+        print(f"ERRO ao obter conexão do pool: {e}")
+        return None
 
 def conectar_mysql_leitura():
     """
-    Tenta usar a conexão cacheada. Se ela caiu, recria.
+    CONEXÃO PARA LEITURA: retorna a conexão de leitura da thread atual, retirando-a
+    do pool na primeira leitura da execução. A execução do script é a dona da
+    conexão; quem chama NÃO deve fechá-la (ver liberar_conexao_leitura).
     """
     try:
-        cnx = _get_cached_connection()
-        # Verifica se está conectada de forma leve
-        if not cnx.is_connected():
-            st.cache_resource.clear()
-            cnx = _get_cached_connection()
-            
-        # REMOVIDO O PING FORÇADO AGRESSIVO QUE CAUSA LENTIDÃO
-        return cnx
-    except Error:
-        st.cache_resource.clear()
-        return _get_cached_connection()
+        local = _get_pool_conexoes("leitura")["local"]
+        conexao = getattr(local, "conexao", None)
+        if conexao is None:
+            conexao = obter_conexao_do_pool("leitura")
+            local.conexao = conexao
+    except Error as e:
+        print(f"ERRO ao obter conexão de leitura: {e}")
+        return None
+    return conexao
 
-@st.cache_data(ttl=600) # Cache de 10 minutos para a lista de obras
+def liberar_conexao_leitura():
+    """Devolve ao pool a conexão de leitura da thread atual (chamado ao fim do script)."""
+    try:
+        local = _get_pool_conexoes("leitura")["local"]
+    except Error:
+        return # O pool nem chegou a ser criado (banco fora do ar)
+    conexao = getattr(local, "conexao", None)
+    local.conexao = None
+    liberar_conexao(conexao)
+
+def obter_estatisticas_pool(tipo="escrita"):
+    """Retorna um retrato das estatísticas de um pool de conexões."""
+    recurso = _get_pool_conexoes(tipo)
+    with recurso["lock"]:
+        stats = dict(recurso["stats"])
+    stats["tamanho"] = recurso["tamanho"]
+    stats["livres"] = recurso["tamanho"] - stats["em_uso"]
+    return stats
+
+@cache_leitura(ttl=600, tags=lambda a: [("usuario_obras_acesso", a["usuario_id"]), ("obras", None)]) # Cache de 10 minutos para a lista de obras
 def buscar_obras_do_usuario_db(usuario_id):
-    # Usa a conexão CACHEADA (rápida), não a de transação
+    # Usa a conexão de leitura da execução atual, não a de transação
     conexao = conectar_mysql_leitura()
     if not conexao: return pd.DataFrame()
     
@@ -93,19 +603,6 @@ def buscar_obras_do_usuario_db(usuario_id):
         st.error(f"Erro ao carregar obras: {e}")
         return pd.DataFrame()
 
-# A função de escrita continua criando uma nova por segurança, 
-# mas como é usada menos vezes, não impacta tanto a navegação.
-def obter_conexao_para_transacao():
-    """CONEXÃO PARA ESCRITA: Obtém uma conexão nova (sem cache)."""
-    # Reutilizamos a lógica de criar conexão, mas sem passar pelo cache_resource direto
-    return mysql.connector.connect(
-        host=st.secrets["db"]["host"],
-        user=st.secrets["db"]["user"],
-        password=st.secrets["db"]["password"],
-        database=st.secrets["db"]["database"],
-        port=st.secrets["db"]["port"]
-    )
-
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -125,6 +622,7 @@ def login_user(username, password):
             st.error(f"Erro durante o login: {e}")
     return None
 
+@comando_escrita
 def registrar_usuario_db(nome, email, senha_hash):
     conexao = obter_conexao_para_transacao()
     if not conexao: return False, "Falha na conexão."
@@ -134,21 +632,20 @@ def registrar_usuario_db(nome, email, senha_hash):
         valores = (nome, email, senha_hash)
         cursor.execute(comando, valores)
         conexao.commit()
-        st.cache_resource.clear()
-        st.cache_data.clear() ##não sei se prejudica em algo
+        invalidar_cache(("usuarios", None))
         return True, "Usuário cadastrado com sucesso!"
     except Error as e:
         conexao.rollback()
         if e.errno == 1062: return False, "Erro: Nome de usuário ou e-mail já existe."
         return False, f"Erro ao registrar usuário: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
 #endregion
 
 #region Funções de Lógica de Negócio (Banco de Dados)
 
-@st.cache_data(ttl=3600)
+@cache_leitura(ttl=3600, tags=[("materiais", None)])
 def buscar_categorias_unicas():
     conexao = conectar_mysql_leitura()
     if not conexao: return []
@@ -157,7 +654,7 @@ def buscar_categorias_unicas():
         return df['categoria'].tolist()
     except Error: return []
 
-@st.cache_data(ttl=3600)
+@cache_leitura(ttl=3600, tags=[("materiais", None)])
 def buscar_unidades_unicas():
     conexao = conectar_mysql_leitura()
     if not conexao: return []
@@ -166,73 +663,184 @@ def buscar_unidades_unicas():
         return df['unidade'].tolist()
     except Error: return []
 
-@st.cache_data(ttl=300)
-def buscar_materiais_paginados(obra_id, filtros, pagina=1, itens_por_pagina=20, ver_todos=False):
-    """Busca materiais no banco com filtros e paginação, juntando com o estoque da obra específica para obter a quantidade correta."""
+# Chave de busca normalizada: sem acentos, minúscula e só com letras/dígitos separados
+# por um espaço ("Tubulação  PVC-50mm" -> "tubulacao pvc 50mm"). É gravada junto do texto
+# original em materiais.descricao_busca e planejamento_tarefas.nome_tarefa_busca (migracoes/003)
+# por toda escrita desses campos, e o termo digitado passa pela mesma função antes de
+# qualquer busca. Assim "cimento" acha "Ciménto" sem depender da collation do banco.
+def normalizar_busca(texto):
+    decomposto = unicodedata.normalize("NFKD", str(texto or ""))
+    sem_acentos = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", sem_acentos.lower()).strip()
+
+# Busca textual de materiais: índice FULLTEXT com parser ngram sobre (descricao_busca, codigo)
+# (migracoes/002 e 003). Cada palavra digitada vira uma frase obrigatória no BOOLEAN MODE; com
+# o ngram isso casa o trecho no início ou no meio das palavras ("cim" acha "Cimento").
+# Palavras menores que o ngram_token_size do servidor não existem no índice.
+NGRAM_TOKEN_SIZE = 2
+EXPRESSAO_BUSCA_MATERIAIS = "MATCH(m.descricao_busca, m.codigo) AGAINST (%s IN BOOLEAN MODE)"
+
+def _termo_busca_materiais(texto):
+    """Converte o texto digitado na consulta BOOLEAN MODE; vazio se nenhuma palavra couber no índice."""
+    palavras = normalizar_busca(texto).split()
+    return " ".join(f'+"{palavra}"' for palavra in palavras if len(palavra) >= NGRAM_TOKEN_SIZE)
+
+def _filtros_materiais_sql(filtros):
+    """Monta a cláusula WHERE (sobre o alias 'm' de materiais) e os valores dos filtros da lista."""
+    clausula = " WHERE 1=1"
+    valores = []
+    if filtros['nome']:
+        termo = _termo_busca_materiais(filtros['nome'])
+        if termo:
+            clausula += f" AND {EXPRESSAO_BUSCA_MATERIAIS}"
+            valores.append(termo)
+        else:
+            # Uma letra só: busca por prefixo, que usa o índice de descricao_busca
+            clausula += " AND m.descricao_busca LIKE %s"
+            valores.append(f"{normalizar_busca(filtros['nome'])}%")
+    if filtros['categoria'] != "Todas":
+        clausula += " AND m.categoria = %s"
+        valores.append(filtros['categoria'])
+    return clausula, valores
+
+@cache_leitura(ttl=300, tags=[("materiais", None)])
+def contar_materiais_filtrados(filtros):
+    """
+    Total de materiais que atendem aos filtros. Conta só a tabela materiais (o LEFT JOIN
+    com o estoque não muda o total) e fica em cache por filtro, valendo para todas as
+    obras e páginas: virar a página não recalcula a contagem.
+    """
+    conexao = conectar_mysql_leitura()
+    if not conexao: return 0
+    clausula, valores = _filtros_materiais_sql(filtros)
+    try:
+        cursor = conexao.cursor(dictionary=True)
+        cursor.execute(f"SELECT COUNT(*) AS total FROM materiais AS m {clausula}", tuple(valores))
+        return cursor.fetchone()['total']
+    except Error as e:
+        st.error(f"Erro ao contar materiais: {e}")
+        return 0
+
+@cache_leitura(ttl=300, tags=lambda a: [("materiais", None), ("estoque_obra", a["obra_id"])])
+def buscar_materiais_paginados(obra_id, filtros, apos=None, itens_por_pagina=20, ver_todos=False):
+    """
+    Busca uma página de materiais (com o estoque da obra) em ordem de (descricao, id).
+    A paginação é por chave (keyset): 'apos' é o par (descricao, id) do último item da
+    página anterior (None na primeira), então o banco vai direto ao ponto pelo índice
+    de descricao em vez de ler e descartar as linhas de um OFFSET. Custa o mesmo na
+    página 1 e na 500. Retorna (DataFrame, total de itens do filtro).
+    Com busca por texto, a ordem passa a ser (relevancia DESC, id) e 'apos' é o par
+    (relevancia, id); use cursor_apos_material() para montar o par a partir da linha.
+    """
     conexao = conectar_mysql_leitura()
     if not conexao: return pd.DataFrame(), 0
-    
-    # A base da query agora faz a junção (LEFT JOIN) entre materiais e o estoque da obra
-    query_base = """
+
+    clausula, valores_filtro = _filtros_materiais_sql(filtros)
+    termo = _termo_busca_materiais(filtros['nome']) if filtros['nome'] else ""
+    if termo:
+        return _buscar_materiais_por_relevancia(conexao, obra_id, filtros, termo, clausula, valores_filtro, apos, itens_por_pagina, ver_todos)
+    # COALESCE garante que, se não houver registro de estoque, a quantidade seja 0.
+    query = f"""
+    SELECT 
+        m.*, 
+        COALESCE(eo.quantidade, 0) AS estoque_atual 
     FROM 
         materiais AS m
     LEFT JOIN 
         estoque_obra AS eo ON m.id = eo.material_id AND eo.obra_id = %s
-    WHERE 1=1
+    {clausula}
     """
-    # O primeiro valor na lista de parâmetros agora é sempre o obra_id
-    valores = [obra_id]
+    valores = [obra_id] + valores_filtro
+
+    if not ver_todos:
+        if apos is not None:
+            # Equivale a (m.descricao, m.id) > apos, escrito de forma que o índice seja usado
+            query += " AND m.descricao >= %s AND (m.descricao > %s OR m.id > %s)"
+            valores.extend([apos[0], apos[0], apos[1]])
+        query += " ORDER BY m.descricao ASC, m.id ASC LIMIT %s"
+        valores.append(itens_por_pagina)
+    else:
+        query += " ORDER BY m.descricao ASC, m.id ASC"
 
-    # A lógica de filtros continua a mesma, mas aplicada à tabela 'm' (materiais)
-    if filtros['nome']:
-        query_base += " AND m.descricao LIKE %s"
-        valores.append(f"%{filtros['nome']}%")
-    if filtros['categoria'] != "Todas":
-        query_base += " AND m.categoria = %s"
-        valores.append(filtros['categoria'])
-        
     try:
         cursor = conexao.cursor(dictionary=True)
-        
-        # A query para contar o total de itens continua funcionando
-        cursor.execute(f"SELECT COUNT(m.id) as total {query_base}", tuple(valores))
-        total_itens = cursor.fetchone()['total']
-        
-        # A grande mudança está aqui: selecionamos todas as colunas de materiais (m.*)
-        # e a quantidade da tabela de estoque (eo.quantidade).
-        # COALESCE garante que, se não houver registro de estoque, a quantidade seja 0.
-        query_final = f"""
+        cursor.execute(query, tuple(valores))
+        df = pd.DataFrame(cursor.fetchall())
+        return df, contar_materiais_filtrados(filtros)
+    except Error as e:
+        st.error(f"Erro ao buscar materiais: {e}")
+        return pd.DataFrame(), 0
+
+def _buscar_materiais_por_relevancia(conexao, obra_id, filtros, termo, clausula, valores_filtro, apos, itens_por_pagina, ver_todos):
+    """Página da busca textual: o índice FULLTEXT seleciona os candidatos e a relevância ordena."""
+    query = f"""
+    SELECT * FROM (
         SELECT 
             m.*, 
-            COALESCE(eo.quantidade, 0) AS estoque_atual 
-        {query_base} 
-        ORDER BY m.descricao ASC
-        """
-        valores_finais = valores
-
-        # A lógica de paginação continua a mesma
-        if not ver_todos:
-            offset = (pagina - 1) * itens_por_pagina
-            query_final += " LIMIT %s OFFSET %s"
-            valores_finais.extend([itens_por_pagina, offset])
-        
-        cursor.execute(query_final, tuple(valores_finais))
-        return pd.DataFrame(cursor.fetchall()), total_itens
-        
+            COALESCE(eo.quantidade, 0) AS estoque_atual,
+            {EXPRESSAO_BUSCA_MATERIAIS} AS relevancia
+        FROM 
+            materiais AS m
+        LEFT JOIN 
+            estoque_obra AS eo ON m.id = eo.material_id AND eo.obra_id = %s
+        {clausula}
+    ) AS r
+    """
+    valores = [termo, obra_id] + valores_filtro
+    if not ver_todos and apos is not None:
+        query += " WHERE r.relevancia < %s OR (r.relevancia = %s AND r.id > %s)"
+        valores.extend([apos[0], apos[0], apos[1]])
+    query += " ORDER BY r.relevancia DESC, r.id ASC"
+    if not ver_todos:
+        query += " LIMIT %s"
+        valores.append(itens_por_pagina)
+    try:
+        cursor = conexao.cursor(dictionary=True)
+        cursor.execute(query, tuple(valores))
+        df = pd.DataFrame(cursor.fetchall())
+        return df, contar_materiais_filtrados(filtros)
     except Error as e:
         st.error(f"Erro ao buscar materiais: {e}")
         return pd.DataFrame(), 0
 
-@st.cache_data(ttl=300)
-def buscar_todos_codigos_materiais():
-    conexao = conectar_mysql_leitura()
-    if not conexao: return []
+def cursor_apos_material(linha):
+    """Par que buscar_materiais_paginados espera em 'apos' para continuar depois desta linha."""
+    chave = float(linha['relevancia']) if 'relevancia' in linha else linha['descricao']
+    return (chave, int(linha['id']))
+
+def buscar_codigos_existentes_db(codigos):
+    """
+    Quais dos 'codigos' já estão cadastrados. Só os códigos enviados trafegam:
+    eles entram na área de preparo da importação (materiais_importacao) e são cruzados
+    com materiais pelo índice único de codigo; a transação é desfeita no fim, então
+    nada fica gravado. Sem cache: usa a conexão de escrita e é uma checagem pontual
+    (a tela guarda o resultado por arquivo enviado em vez de repeti-la a cada rerun).
+    Retorna (conjunto de códigos existentes, None) ou (conjunto vazio, mensagem de erro).
+    """
+    if not codigos: return set(), None
+    conexao = obter_conexao_para_transacao()
+    if not conexao: return set(), "Falha na conexão ao verificar códigos já cadastrados."
+    lote = str(uuid.uuid4())
     try:
-        df = pd.read_sql("SELECT codigo FROM materiais", conexao)
-        return df['codigo'].tolist()
-    except Error: return []
+        cursor = conexao.cursor()
+        conexao.start_transaction()
+        linhas = [(lote, numero, codigo) for numero, codigo in enumerate(dict.fromkeys(codigos), start=1)]
+        for inicio in range(0, len(linhas), LOTE_INSERCAO_IMPORTACAO):
+            cursor.executemany("INSERT INTO materiais_importacao (lote, linha, codigo) VALUES (%s, %s, %s)", linhas[inicio:inicio + LOTE_INSERCAO_IMPORTACAO])
+        cursor.execute("""
+            SELECT i.codigo FROM materiais_importacao i JOIN materiais m ON m.codigo = i.codigo
+            WHERE i.lote = %s
+        """, (lote,))
+        existentes = {codigo for (codigo,) in cursor.fetchall()}
+        conexao.rollback()
+        return existentes, None
+    except Error as e:
+        conexao.rollback()
+        return set(), f"Erro ao verificar códigos já cadastrados: {e}"
+    finally:
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)            
+@cache_leitura(ttl=3600, tags=lambda a: [("materiais", a["material_id"])])
 def buscar_material_por_id(material_id):
     conexao = conectar_mysql_leitura()
     if not conexao: return None
@@ -242,7 +850,7 @@ def buscar_material_por_id(material_id):
         return cursor.fetchone()
     except Error: return None
 
-@st.cache_data(ttl=300)
+@cache_leitura(ttl=300, tags=[("materiais", None)])
 def buscar_materiais_para_selecao():
     conexao = conectar_mysql_leitura()
     if not conexao: return pd.DataFrame()
@@ -252,7 +860,7 @@ def buscar_materiais_para_selecao():
         return df
     except Error: return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+@cache_leitura(ttl=3600, tags=[("obras", None)])
 def buscar_outras_obras(obra_id_atual):
     conexao = conectar_mysql_leitura()
     if not conexao: return pd.DataFrame()
@@ -261,32 +869,61 @@ def buscar_outras_obras(obra_id_atual):
         return pd.read_sql(query, conexao, params=(obra_id_atual,))
     except Error: return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
-def buscar_historico_db(obra_id, limit=None, data_inicio=None, data_fim=None, tipos_transacao=None):
-    """Busca o histórico de movimentações com filtros avançados de forma robusta."""
-    # MUDANÇA CRÍTICA: Usa uma conexão nova para garantir a visão mais atual dos dados.
-    conexao = obter_conexao_para_transacao()
-    if not conexao: return pd.DataFrame()
-
-    query = "SELECT id, DATE_FORMAT(data, '%d/%m/%Y %H:%i') as data_formatada, tipo, descricao, quantidade, fornecedor, recebedor, observacoes FROM movimentacoes WHERE obra_id = %s AND estornado = FALSE"
+def _filtros_historico_sql(obra_id, data_inicio=None, data_fim=None, tipos_transacao=None, material_id=None):
+    """
+    Monta o WHERE do histórico de movimentações. As datas viram um intervalo semiaberto
+    [data_inicio 00:00, dia seguinte a data_fim 00:00) comparado direto com a coluna
+    'data' (nada de DATE(data)), para o banco usar o índice (obra_id, estornado, data),
+    ou (obra_id, material_id, data) quando o filtro é por material.
+    """
+    clausula = " WHERE obra_id = %s AND estornado = FALSE"
     params = [obra_id]
 
+    if material_id:
+        clausula += " AND material_id = %s"
+        params.append(material_id)
+
     if data_inicio:
-        query += " AND DATE(data) >= %s"
-        params.append(data_inicio)
+        clausula += " AND data >= %s"
+        params.append(datetime.combine(data_inicio, datetime.min.time()))
     if data_fim:
-        query += " AND DATE(data) <= %s"
-        params.append(data_fim)
+        clausula += " AND data < %s"
+        params.append(datetime.combine(data_fim, datetime.min.time()) + timedelta(days=1))
     if tipos_transacao:
-        if len(tipos_transacao) > 0:
-            query += f" AND tipo IN ({','.join(['%s'] * len(tipos_transacao))})"
-            params.extend(tipos_transacao)
-    
-    query += " ORDER BY data DESC"
-    
+        clausula += f" AND tipo IN ({','.join(['%s'] * len(tipos_transacao))})"
+        params.extend(tipos_transacao)
+    return clausula, params
+
+def montar_consulta_historico(obra_id, limit=None, data_inicio=None, data_fim=None, tipos_transacao=None, apos=None, material_id=None):
+    """
+    Monta (query, params) do histórico, do mais recente para o mais antigo. O índice
+    (obra_id, estornado, data) atende tanto o filtro quanto o ORDER BY data DESC.
+    'apos' é o par (data, id) da última linha já exibida: a consulta continua dali
+    (paginação por chave) sem ler as linhas anteriores.
+    """
+    clausula, params = _filtros_historico_sql(obra_id, data_inicio, data_fim, tipos_transacao, material_id)
+    query = f"SELECT id, data, DATE_FORMAT(data, '%d/%m/%Y %H:%i') as data_formatada, tipo, descricao, quantidade, fornecedor, recebedor, observacoes FROM movimentacoes{clausula}"
+
+    if apos is not None:
+        # Equivale a (data, id) < apos, escrito de forma que o índice seja usado
+        query += " AND data <= %s AND (data < %s OR id < %s)"
+        params.extend([apos[0], apos[0], apos[1]])
+
+    query += " ORDER BY data DESC, id DESC"
+
     if limit:
         query += " LIMIT %s"
         params.append(limit)
+    return query, params
+
+@cache_leitura(ttl=3600, tags=lambda a: [("movimentacoes", a["obra_id"])])
+def buscar_historico_db(obra_id, limit=None, data_inicio=None, data_fim=None, tipos_transacao=None):
+    """Busca o histórico de movimentações com filtros avançados de forma robusta."""
+    # MUDANÇA CRÍTICA: Usa uma conexão do pool (sessão resetada) para garantir a visão mais atual dos dados.
+    conexao = obter_conexao_para_transacao()
+    if not conexao: return pd.DataFrame()
+
+    query, params = montar_consulta_historico(obra_id, limit, data_inicio, data_fim, tipos_transacao)
         
     try:
         # A lógica de execução permanece a mesma, agora com a conexão correta.
@@ -298,66 +935,350 @@ def buscar_historico_db(obra_id, limit=None, data_inicio=None, data_fim=None, ti
         st.error(f"Erro ao buscar histórico: {e}")
         return pd.DataFrame()
     finally:
-        # Garante que a conexão nova seja sempre fechada.
-        if conexao.is_connected():
-            conexao.close()
+        # Garante que a conexão seja sempre devolvida ao pool.
+        liberar_conexao(conexao)
+
+@cache_leitura(ttl=3600, tags=lambda a: [("movimentacoes", a["obra_id"])])
+def buscar_pagina_historico_db(obra_id, data_inicio=None, data_fim=None, tipos_transacao=None, apos=None, itens_por_pagina=50, material_id=None):
+    """
+    Uma janela do histórico para a tela paginada: só as 'itens_por_pagina' linhas
+    visíveis saem do banco. Use cursor_apos_historico() na última linha para a próxima.
+    """
+    # Só leitura: usa a conexão de leitura da execução (autocommit, vê o último commit)
+    conexao = conectar_mysql_leitura()
+    if not conexao: return pd.DataFrame()
+
+    query, params = montar_consulta_historico(obra_id, itens_por_pagina, data_inicio, data_fim, tipos_transacao, apos=apos, material_id=material_id)
+    try:
+        cursor = conexao.cursor(dictionary=True)
+        cursor.execute(query, tuple(params))
+        return pd.DataFrame(cursor.fetchall())
+    except Error as e:
+        st.error(f"Erro ao buscar histórico: {e}")
+        return pd.DataFrame()
+
+@cache_leitura(ttl=3600, tags=lambda a: [("movimentacoes", a["obra_id"])])
+def contar_historico_db(obra_id, data_inicio=None, data_fim=None, tipos_transacao=None, material_id=None):
+    """Total de movimentações do filtro; sem filtro de tipo, a contagem é feita só no índice."""
+    conexao = conectar_mysql_leitura()
+    if not conexao: return 0
+
+    clausula, params = _filtros_historico_sql(obra_id, data_inicio, data_fim, tipos_transacao, material_id)
+    try:
+        cursor = conexao.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM movimentacoes{clausula}", tuple(params))
+        return cursor.fetchone()[0]
+    except Error as e:
+        st.error(f"Erro ao contar histórico: {e}")
+        return 0
+
+def cursor_apos_historico(linha):
+    """Par (data, id) que buscar_pagina_historico_db espera em 'apos' para continuar depois desta linha."""
+    return (linha['data'].to_pydatetime(), int(linha['id']))
+
+CABECALHO_EXPORTACAO_HISTORICO = ["ID", "Data", "Tipo", "Material", "Quantidade", "Fornecedor", "Recebedor", "Observações"]
+LOTE_EXPORTACAO = 2000
+LINHAS_POR_ABA_XLSX = 1_048_575 # Limite do Excel, descontando o cabeçalho
+PREFIXO_EXPORTACAO_HISTORICO = "historico_"
+IDADE_MAXIMA_EXPORTACAO_S = 3600 # Arquivos mais velhos que isso sobraram de execuções interrompidas
+
+def _apagar_exportacoes_antigas():
+    """Apaga do diretório temporário as exportações de histórico esquecidas (processo derrubado, sessão fechada...)."""
+    limite = time.time() - IDADE_MAXIMA_EXPORTACAO_S
+    diretorio = tempfile.gettempdir()
+    for nome in os.listdir(diretorio):
+        if not nome.startswith(PREFIXO_EXPORTACAO_HISTORICO):
+            continue
+        caminho = os.path.join(diretorio, nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass # Apagado por outra sessão ao mesmo tempo
+
+def exportar_historico_arquivo(obra_id, formato="csv", data_inicio=None, data_fim=None, tipos_transacao=None, material_id=None):
+    """
+    Grava o histórico filtrado (em ordem cronológica) num arquivo temporário para auditoria.
+    As linhas saem de um cursor sem buffer, em lotes de LOTE_EXPORTACAO, direto para o
+    csv.writer ou para o xlsxwriter em modo constant_memory: nada de DataFrame, e a memória
+    não cresce com o tamanho do histórico. Retorna (sucesso, caminho do arquivo ou mensagem);
+    quem chama é responsável por apagar o arquivo. Em qualquer falha o arquivo é apagado aqui.
+    """
+    _apagar_exportacoes_antigas()
+    # Conexão própria do pool de leitura: o resultado sem buffer ocupa a conexão durante toda
+    # a exportação, que assim não disputa o pool de escrita nem a conexão de leitura da execução
+    try:
+        conexao = obter_conexao_do_pool("leitura")
+    except Error as e:
+        print(f"ERRO ao obter conexão de leitura para exportação: {e}")
+        return False, "Erro de conexão com o banco de dados."
+
+    clausula, params = _filtros_historico_sql(obra_id, data_inicio, data_fim, tipos_transacao, material_id)
+    query = f"SELECT id, data, tipo, descricao, quantidade, fornecedor, recebedor, observacoes FROM movimentacoes{clausula} ORDER BY data, id"
+    descritor, caminho = tempfile.mkstemp(prefix=PREFIXO_EXPORTACAO_HISTORICO, suffix=f".{formato}")
+    os.close(descritor)
+    cursor = None
+    try:
+        cursor = conexao.cursor(buffered=False)
+        cursor.execute(query, tuple(params))
+        lotes = iter(lambda: cursor.fetchmany(LOTE_EXPORTACAO), [])
+        if formato == "xlsx":
+            _gravar_historico_xlsx(caminho, lotes)
+        else:
+            _gravar_historico_csv(caminho, lotes)
+        return True, caminho
+    except Exception as e: # Inclui falhas de disco (OSError) e de formatação de alguma linha
+        os.remove(caminho)
+        return False, f"Erro ao exportar histórico: {e}"
+    finally:
+        if cursor is not None:
+            try:
+                # Uma exportação interrompida deixa linhas não lidas no resultado sem buffer;
+                # sem descartá-las a conexão não pode voltar limpa ao pool
+                conexao.consume_results()
+                cursor.close()
+            except Error as e:
+                print(f"ERRO ao descartar o resultado da exportação: {e}")
+        liberar_conexao(conexao)
+
+def _gravar_historico_csv(caminho, lotes):
+    # utf-8-sig e ';' para o Excel em português abrir o arquivo direto
+    with open(caminho, "w", newline="", encoding="utf-8-sig") as arquivo:
+        escritor = csv.writer(arquivo, delimiter=";")
+        escritor.writerow(CABECALHO_EXPORTACAO_HISTORICO)
+        for lote in lotes:
+            escritor.writerows(
+                (mid, data.strftime('%d/%m/%Y %H:%M'), tipo, descricao, str(quantidade).replace('.', ','), fornecedor, recebedor, obs)
+                for mid, data, tipo, descricao, quantidade, fornecedor, recebedor, obs in lote
+            )
 
-@st.cache_data(ttl=3600)
+def _gravar_historico_xlsx(caminho, lotes):
+    # constant_memory: cada linha é descarregada em disco assim que a próxima começa
+    workbook = xlsxwriter.Workbook(caminho, {'constant_memory': True, 'default_date_format': 'dd/mm/yyyy hh:mm'})
+    try:
+        aba, linha = None, LINHAS_POR_ABA_XLSX
+        for lote in lotes:
+            for registro in lote:
+                if linha >= LINHAS_POR_ABA_XLSX:
+                    aba = workbook.add_worksheet(f"Movimentações {len(workbook.worksheets()) + 1}")
+                    aba.write_row(0, 0, CABECALHO_EXPORTACAO_HISTORICO)
+                    linha = 0
+                linha += 1
+                aba.write_row(linha, 0, registro)
+        if aba is None:
+            workbook.add_worksheet("Movimentações 1").write_row(0, 0, CABECALHO_EXPORTACAO_HISTORICO)
+    finally:
+        workbook.close()
+
+@comando_escrita
 def cadastrar_material_db(codigo, nome, unidade, categoria, est_min, est_max, obs):
     conexao = obter_conexao_para_transacao()
     if not conexao: return False, "Falha na conexão"
     try:
         cursor = conexao.cursor()
-        comando = "INSERT INTO materiais (codigo, descricao, unidade, categoria, estoque_minimo, estoque_maximo, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-        valores = (codigo, nome, unidade, categoria, est_min, est_max, obs)
+        comando = "INSERT INTO materiais (codigo, descricao, descricao_busca, unidade, categoria, estoque_minimo, estoque_maximo, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+        valores = (codigo, nome, normalizar_busca(nome), unidade, categoria, est_min, est_max, obs)
         cursor.execute(comando, valores)
         conexao.commit()
-        st.cache_resource.clear()
+        invalidar_cache(("materiais", None))
         return True, f"Material '{nome}' cadastrado com sucesso!"
     except Error as e:
         conexao.rollback(); return False, f"Erro ao cadastrar: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def atualizar_material_db(mid, codigo, descricao, unidade, categoria, est_min, est_max, obs):
     conexao = obter_conexao_para_transacao()
     if not conexao: return False, "Falha na conexão"
     try:
         cursor = conexao.cursor()
-        comando = "UPDATE materiais SET codigo=%s, descricao=%s, unidade=%s, categoria=%s, estoque_minimo=%s, estoque_maximo=%s, observacoes=%s WHERE id=%s"
-        valores = (codigo, descricao, unidade, categoria, est_min, est_max, obs, mid)
+        comando = "UPDATE materiais SET codigo=%s, descricao=%s, descricao_busca=%s, unidade=%s, categoria=%s, estoque_minimo=%s, estoque_maximo=%s, observacoes=%s WHERE id=%s"
+        valores = (codigo, descricao, normalizar_busca(descricao), unidade, categoria, est_min, est_max, obs, mid)
         cursor.execute(comando, valores)
         conexao.commit()
-        st.cache_resource.clear()
+        invalidar_cache(("materiais", mid))
         return True, f"Material '{descricao}' atualizado!"
     except Error as e:
         conexao.rollback(); return False, f"Erro ao atualizar: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
-
-@st.cache_data(ttl=3600)
-def cadastrar_materiais_em_lote_db(df_materiais):
+        liberar_conexao(conexao)
+
+# --- Validação da planilha de materiais (antes de enviar ao banco) ---
+# Cada regra é (mensagem, função que recebe a planilha e devolve uma máscara booleana
+# das linhas com erro). Todas são avaliadas por colunas inteiras (pandas/NumPy), sem
+# laço por linha; avaliar_regras junta as mensagens das linhas com erro.
+
+def _vazio(coluna):
+    return coluna.isna() | (coluna.astype("string").str.strip() == "")
+
+def _numero_invalido(coluna):
+    return coluna.notna() & pd.to_numeric(coluna, errors="coerce").isna()
+
+def _texto_longo(coluna, limite):
+    return coluna.astype("string").str.len().gt(limite).fillna(False)
+
+def _estoque(df, coluna):
+    return pd.to_numeric(df[coluna], errors="coerce")
+
+# Regras do cadastro de materiais, definidas uma vez e aplicadas em dois lugares: na tela,
+# sobre a planilha (REGRAS_PLANILHA_MATERIAIS, pandas) e no banco, sobre a área de preparo
+# (REGRAS_IMPORTACAO_MATERIAIS, SQL). Os limites de tamanho são os das colunas de materiais.
+CAMPOS_TEXTO_MATERIAL = [
+    # (coluna, rótulo, tamanho máximo, mensagem quando vazio)
+    ("codigo", "Código", 50, "Código não informado"),
+    ("descricao", "Descrição", 255, "Descrição não informada"),
+    ("unidade", "Unidade", 20, "Unidade não informada"),
+    ("categoria", "Categoria", 100, "Categoria não informada"),
+]
+REGRAS_ESTOQUE_MATERIAL = [
+    # (mensagem, máscara pandas, condição SQL)
+    ("Estoque mínimo/máximo negativo",
+     lambda df: (_estoque(df, "estoque_minimo") < 0) | (_estoque(df, "estoque_maximo") < 0),
+     "estoque_minimo < 0 OR estoque_maximo < 0"),
+    ("Estoque mínimo maior que o máximo",
+     lambda df: _estoque(df, "estoque_minimo") > _estoque(df, "estoque_maximo"),
+     "estoque_minimo > estoque_maximo"),
+]
+
+REGRAS_PLANILHA_MATERIAIS = [
+    *[(vazio, lambda df, coluna=coluna: _vazio(df[coluna])) for coluna, _, _, vazio in CAMPOS_TEXTO_MATERIAL],
+    *[(f"{rotulo} com mais de {limite} caracteres", lambda df, coluna=coluna, limite=limite: _texto_longo(df[coluna], limite))
+      for coluna, rotulo, limite, _ in CAMPOS_TEXTO_MATERIAL],
+    ("Estoque mínimo não numérico", lambda df: _numero_invalido(df["estoque_minimo"])),
+    ("Estoque máximo não numérico", lambda df: _numero_invalido(df["estoque_maximo"])),
+    *[(mensagem, mascara) for mensagem, mascara, _ in REGRAS_ESTOQUE_MATERIAL],
+    # Código em branco já tem o erro de código não informado; não conta como repetido
+    ("Código repetido na planilha", lambda df: ~_vazio(df["codigo"]) & df["codigo"].duplicated(keep="first")),
+]
+
+def avaliar_regras(df, regras):
+    """Série com as mensagens (separadas por vírgula) das regras que cada linha viola; '' se nenhuma."""
+    mascaras = pd.DataFrame({mensagem: regra(df).to_numpy(dtype=bool) for mensagem, regra in regras}, index=df.index)
+    erros = pd.Series("", index=df.index, dtype=object)
+    com_erro = mascaras.any(axis=1).to_numpy()
+    if com_erro.any():
+        # Produto de booleanos por textos: concatena as mensagens das colunas True de cada linha
+        erros[com_erro] = mascaras[com_erro].dot(mascaras.columns + ", ").str[:-2]
+    return erros
+
+def validar_planilha_materiais(df, unidades_validas, categorias_validas):
+    """
+    Valida a planilha de cadastro em lote. Devolve uma cópia com os textos aparados, os
+    estoques convertidos para número e as colunas:
+      - erros_validacao: erros que impedem o cadastro ('' = sem erro);
+      - unidade_valida / categoria_valida: se o valor está nas listas oficiais (linhas
+        com False vão para a revisão, onde o usuário corrige ou aprova o termo novo).
+    """
+    df = df.reindex(columns=list(dict.fromkeys([*df.columns, *COLUNAS_IMPORTACAO_MATERIAIS]))).copy()
+    for coluna in ["codigo", "descricao", "unidade", "categoria"]:
+        df[coluna] = df[coluna].astype("string").str.strip().astype(object).where(df[coluna].notna(), None)
+    df["erros_validacao"] = avaliar_regras(df, REGRAS_PLANILHA_MATERIAIS)
+    for coluna in ["estoque_minimo", "estoque_maximo"]:
+        df[coluna] = pd.to_numeric(df[coluna], errors="coerce")
+    df["unidade_valida"] = df["unidade"].isin(unidades_validas)
+    df["categoria_valida"] = df["categoria"].isin(categorias_validas)
+    return df
+
+COLUNAS_IMPORTACAO_MATERIAIS = ["codigo", "descricao", "unidade", "categoria", "estoque_minimo", "estoque_maximo", "observacoes"]
+# Largura das colunas de texto de materiais_importacao (migracoes/007). Textos maiores são
+# cortados nessa largura ao entrar na área de preparo: ainda passam do limite de materiais,
+# então a linha recebe o erro de tamanho em vez de o INSERT falhar e derrubar o lote inteiro.
+LARGURAS_AREA_PREPARO = {"codigo": 255, "descricao": 1000, "descricao_busca": 1000, "unidade": 255, "categoria": 255}
+LOTE_INSERCAO_IMPORTACAO = 5000 # Linhas por INSERT de várias linhas (cabe no max_allowed_packet padrão)
+
+# Validação da área de preparo: (condição SQL sobre a linha, mensagem), derivadas de
+# CAMPOS_TEXTO_MATERIAL e REGRAS_ESTOQUE_MATERIAL. A primeira regra que falhar é a registrada.
+REGRAS_IMPORTACAO_MATERIAIS = [
+    *[(f"{coluna} IS NULL OR TRIM({coluna}) = ''", vazio) for coluna, _, _, vazio in CAMPOS_TEXTO_MATERIAL],
+    *[(f"CHAR_LENGTH({coluna}) > {limite}", f"{rotulo} com mais de {limite} caracteres") for coluna, rotulo, limite, _ in CAMPOS_TEXTO_MATERIAL],
+    *[(condicao, mensagem) for mensagem, _, condicao in REGRAS_ESTOQUE_MATERIAL],
+]
+
+def _inserir_area_preparo(cursor, lote, df_materiais):
+    """Grava as linhas da planilha em materiais_importacao sob 'lote', em INSERTs de várias linhas."""
+    df = df_materiais.reindex(columns=COLUNAS_IMPORTACAO_MATERIAIS)
+    df = df.astype(object).where(pd.notna(df), None)
+    largura_busca = LARGURAS_AREA_PREPARO["descricao_busca"]
+    descricoes_busca = [normalizar_busca(d)[:largura_busca] if d is not None else None for d in df['descricao']]
+    for coluna in ["codigo", "descricao", "unidade", "categoria"]:
+        df[coluna] = [str(valor)[:LARGURAS_AREA_PREPARO[coluna]] if valor is not None else None for valor in df[coluna]]
+    linhas = [
+        (lote, numero, *valores[:2], busca, *valores[2:])
+        for numero, (valores, busca) in enumerate(zip(df.itertuples(index=False, name=None), descricoes_busca), start=1)
+    ]
+    comando = "INSERT INTO materiais_importacao (lote, linha, codigo, descricao, descricao_busca, unidade, categoria, estoque_minimo, estoque_maximo, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    for inicio in range(0, len(linhas), LOTE_INSERCAO_IMPORTACAO):
+        cursor.executemany(comando, linhas[inicio:inicio + LOTE_INSERCAO_IMPORTACAO])
+
+@comando_escrita
+def cadastrar_materiais_em_lote_db(df_materiais, unidades_validas=None, categorias_validas=None):
+    """
+    Importa a planilha de materiais em poucas idas ao banco, numa única transação:
+      1. grava as linhas na área de preparo (materiais_importacao) com INSERTs de várias linhas;
+      2. valida tudo com UPDATEs de conjunto: campos obrigatórios, tamanhos, estoques,
+         unidade/categoria fora das listas informadas, código repetido na planilha e
+         código já cadastrado (junção pelo índice único de materiais.codigo);
+      3. copia as linhas sem erro para materiais com um único INSERT ... SELECT;
+      4. lê os erros por linha e apaga o lote.
+    Retorna (sucessos, erros, mensagens de erro por linha).
+    """
+    if df_materiais.empty: return 0, 0, []
     conexao = obter_conexao_para_transacao()
-    if not conexao: return 0, 0, []
-    sucessos, erros, mensagens_erro = 0, 0, []
-    comando = "INSERT INTO materiais (codigo, descricao, unidade, categoria, estoque_minimo, estoque_maximo, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-    cursor = conexao.cursor()
-    for _, row in df_materiais.iterrows():
-        try:
-            valores = (row['codigo'], row['descricao'], row['unidade'], row['categoria'],
-                row['estoque_minimo'] if pd.notna(row['estoque_minimo']) else None,
-                row['estoque_maximo'] if pd.notna(row['estoque_maximo']) else None,
-                row['observacoes'] if pd.notna(row['observacoes']) else None)
-            cursor.execute(comando, valores)
-            conexao.commit(); sucessos += 1
-        except Error as e:
-            erros += 1; conexao.rollback()
-            mensagens_erro.append(f"Material Cód: {row['codigo']} - Erro: {e}")
-    st.cache_resource.clear()
+    if not conexao: return 0, len(df_materiais), ["Falha na conexão com o banco de dados."]
+    lote = str(uuid.uuid4())
+    try:
+        cursor = conexao.cursor()
+        conexao.start_transaction()
+        _inserir_area_preparo(cursor, lote, df_materiais)
+
+        sem_erro = "lote = %s AND erro IS NULL"
+        for condicao, mensagem in REGRAS_IMPORTACAO_MATERIAIS:
+            cursor.execute(f"UPDATE materiais_importacao SET erro = %s WHERE {sem_erro} AND ({condicao})", (mensagem, lote))
+        for coluna, permitidos, mensagem in (("unidade", unidades_validas, "Unidade não cadastrada"), ("categoria", categorias_validas, "Categoria não cadastrada")):
+            if permitidos:
+                marcadores = ','.join(['%s'] * len(permitidos))
+                cursor.execute(f"UPDATE materiais_importacao SET erro = %s WHERE {sem_erro} AND {coluna} NOT IN ({marcadores})", (mensagem, lote, *permitidos))
+        cursor.execute("""
+            UPDATE materiais_importacao i
+            JOIN (SELECT codigo, MIN(linha) AS primeira FROM materiais_importacao WHERE lote = %s GROUP BY codigo HAVING COUNT(*) > 1) d
+              ON d.codigo = i.codigo AND i.linha > d.primeira
+            SET i.erro = CONCAT('Código repetido na planilha (primeira ocorrência na linha ', d.primeira, ')')
+            WHERE i.lote = %s AND i.erro IS NULL
+        """, (lote, lote))
+        cursor.execute("""
+            UPDATE materiais_importacao i JOIN materiais m ON m.codigo = i.codigo
+            SET i.erro = 'Código já cadastrado'
+            WHERE i.lote = %s AND i.erro IS NULL
+        """, (lote,))
+
+        # ON DUPLICATE KEY: um código cadastrado por outra sessão depois da validação é pulado, não derruba o lote
+        cursor.execute(f"""
+            INSERT INTO materiais (codigo, descricao, descricao_busca, unidade, categoria, estoque_minimo, estoque_maximo, observacoes)
+            SELECT TRIM(codigo), descricao, descricao_busca, unidade, categoria, estoque_minimo, estoque_maximo, observacoes
+            FROM materiais_importacao WHERE {sem_erro} ORDER BY linha
+            ON DUPLICATE KEY UPDATE id = id
+        """, (lote,))
+        sucessos = cursor.rowcount
+
+        cursor.execute("SELECT linha, codigo, erro FROM materiais_importacao WHERE lote = %s AND erro IS NOT NULL ORDER BY linha", (lote,))
+        mensagens_erro = [f"Linha {linha} - Material Cód: {codigo} - Erro: {erro}" for linha, codigo, erro in cursor.fetchall()]
+        cursor.execute("DELETE FROM materiais_importacao WHERE lote = %s", (lote,))
+        conexao.commit()
+    except Error as e:
+        conexao.rollback()
+        return 0, len(df_materiais), [f"Erro ao importar materiais: {e}"]
+    finally:
+        liberar_conexao(conexao)
+
+    erros = len(df_materiais) - sucessos
+    if erros > len(mensagens_erro):
+        mensagens_erro.append(f"{erros - len(mensagens_erro)} material(is) cadastrado(s) por outro usuário durante a importação.")
+    if sucessos > 0:
+        invalidar_cache(("materiais", None))
     return sucessos, erros, mensagens_erro
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def excluir_materiais_db(lista_de_ids):
     if not lista_de_ids: return False, "Nenhum material selecionado."
     conexao = obter_conexao_para_transacao()
@@ -365,17 +1286,23 @@ def excluir_materiais_db(lista_de_ids):
     try:
         cursor = conexao.cursor()
         placeholders = ','.join(['%s'] * len(lista_de_ids))
+        # A FK de movimentacoes.material_id (ON DELETE SET NULL) muda o histórico dessas obras
+        cursor.execute(f"SELECT DISTINCT obra_id FROM movimentacoes WHERE material_id IN ({placeholders})", tuple(lista_de_ids))
+        obras_afetadas = [obra_id for (obra_id,) in cursor.fetchall()]
         comando = f"DELETE FROM materiais WHERE id IN ({placeholders})"
         cursor.execute(comando, tuple(lista_de_ids))
         conexao.commit()
-        st.cache_resource.clear()
+        invalidar_cache(
+            ("materiais", None), ("estoque_obra", None), ("kit_materiais", None), ("estoque_checkpoints", None),
+            *[("movimentacoes", obra_id) for obra_id in obras_afetadas]
+        )
         return True, f"{cursor.rowcount} material(is) excluído(s)!"
     except Error as e:
         conexao.rollback(); return False, f"Erro ao excluir: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def registrar_movimentacao_db(obra_id, usuario_id, dados):
     tipo = dados['tipo']
     conexao = obter_conexao_para_transacao()
@@ -390,8 +1317,8 @@ def registrar_movimentacao_db(obra_id, usuario_id, dados):
             conexao.start_transaction()
             
             # Passo 1: Registrar a movimentação no histórico (lógica antiga, continua igual)
-            sql_insert = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, fornecedor, recebedor, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-            valores_insert = (obra_id, dados['data'], dados['tipo'], dados['descricao'], quantidade, dados.get('fornecedor'), dados.get('recebedor'), dados['observacoes'])
+            sql_insert = "INSERT INTO movimentacoes (obra_id, material_id, data, tipo, descricao, quantidade, fornecedor, recebedor, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+            valores_insert = (obra_id, material_id, dados['data'], dados['tipo'], dados['descricao'], quantidade, dados.get('fornecedor'), dados.get('recebedor'), dados['observacoes'])
             cursor.execute(sql_insert, valores_insert)
 
             # --- NOVA LÓGICA DE ATUALIZAÇÃO DE ESTOQUE ---
@@ -405,9 +1332,11 @@ def registrar_movimentacao_db(obra_id, usuario_id, dados):
             sql_update = "UPDATE estoque_obra SET quantidade = quantidade + %s WHERE material_id = %s AND obra_id = %s"
             cursor.execute(sql_update, (qtd_para_update, material_id, obra_id))
 
+            # Passo 5: A data é informada pelo usuário e pode ser anterior a checkpoints já gerados
+            ajustar_checkpoints_estoque(cursor, obra_id, material_id, dados['data'], qtd_para_update)
+
             conexao.commit()
-            st.cache_resource.clear()
-            st.cache_data.clear() # Limpa ambos os caches por segurança
+            invalidar_cache(("movimentacoes", obra_id), ("estoque_obra", obra_id))
             
             return True, f"Movimentação de '{tipo}' registrada com sucesso!"
             
@@ -419,8 +1348,7 @@ def registrar_movimentacao_db(obra_id, usuario_id, dados):
             cursor.execute(sql_pendente, valores_pendente)
             conexao.commit()
 
-            st.cache_resource.clear()
-            st.cache_data.clear()
+            invalidar_cache(("transacoes_pendentes", dados['obra_origem_id']), ("transacoes_pendentes", dados['obra_destino_id']))
             return True, f"Solicitação de '{tipo}' enviada. Aguardando aprovação."
             
     except Error as e:
@@ -428,10 +1356,53 @@ def registrar_movimentacao_db(obra_id, usuario_id, dados):
             conexao.rollback()
         return False, f"Erro ao registrar: {e}"
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
+
+@comando_escrita
+def registrar_movimentacoes_em_lote_db(obra_id, usuario_id, tipo, data, linhas, fornecedor=None, recebedor=None, observacoes=None):
+    """
+    Registra várias linhas de Entrada ou Saída (ex.: a nota de um caminhão) numa única
+    transação: um INSERT de várias linhas em movimentacoes e um único upsert em
+    estoque_obra com a soma por material. 'linhas' é uma lista de dicts com
+    material_id, descricao e quantidade. Ou entram todas as linhas, ou nenhuma.
+    """
+    if tipo not in ("Entrada", "Saída"):
+        return False, "O lançamento em lote aceita apenas Entrada ou Saída."
+    if not linhas:
+        return False, "Nenhuma linha para registrar."
+    conexao = obter_conexao_para_transacao()
+    if not conexao: return False, "Falha na conexão."
+
+    sinal = 1 if tipo == "Entrada" else -1
+    saldo_por_material = {}
+    for linha in linhas:
+        saldo_por_material[linha['material_id']] = saldo_por_material.get(linha['material_id'], 0) + sinal * linha['quantidade']
+    try:
+        cursor = conexao.cursor()
+        conexao.start_transaction()
+        # executemany de INSERT ... VALUES vira um único INSERT com várias linhas
+        cursor.executemany(
+            "INSERT INTO movimentacoes (obra_id, material_id, data, tipo, descricao, quantidade, fornecedor, recebedor, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            [(obra_id, linha['material_id'], data, tipo, linha['descricao'], linha['quantidade'], fornecedor, recebedor, observacoes) for linha in linhas]
+        )
+        cursor.executemany(
+            "INSERT INTO estoque_obra (material_id, obra_id, quantidade) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE quantidade = quantidade + VALUES(quantidade)",
+            [(material_id, obra_id, saldo) for material_id, saldo in saldo_por_material.items()]
+        )
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM estoque_cortes WHERE data_corte > %s)", (data,))
+        if cursor.fetchone()[0]:
+            for material_id, saldo in saldo_por_material.items():
+                ajustar_checkpoints_estoque(cursor, obra_id, material_id, data, saldo)
+        conexao.commit()
+        invalidar_cache(("movimentacoes", obra_id), ("estoque_obra", obra_id))
+        return True, f"{len(linhas)} linha(s) de '{tipo}' registrada(s) com sucesso!"
+    except Error as e:
+        conexao.rollback()
+        return False, f"Erro ao registrar o lote: {e}"
+    finally:
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def criar_movimentacao_estorno_db(movimentacao_id, usuario_id):
     conexao = obter_conexao_para_transacao()
     if not conexao: return False, "Falha na conexão."
@@ -445,12 +1416,14 @@ def criar_movimentacao_estorno_db(movimentacao_id, usuario_id):
         if not mov_original or mov_original['estornado']:
             return False, "Movimentação não encontrada ou já estornada."
 
-        # Encontra o ID do material pela descrição
-        cursor.execute("SELECT id FROM materiais WHERE descricao = %s", (mov_original['descricao'],))
-        material = cursor.fetchone()
-        if not material:
-            return False, f"Material '{mov_original['descricao']}' não encontrado."
-        material_id = material['id']
+        material_id = mov_original['material_id']
+        if material_id is None:
+            # Movimentação antiga cuja descrição era ambígua no backfill: só estorna se hoje ela identificar um único material
+            cursor.execute("SELECT id FROM materiais WHERE descricao = %s LIMIT 2", (mov_original['descricao'],))
+            materiais = cursor.fetchall()
+            if len(materiais) != 1:
+                return False, f"Não foi possível identificar o material '{mov_original['descricao']}' desta movimentação."
+            material_id = materiais[0]['id']
         obra_id = mov_original['obra_id']
         
         # Define o tipo de movimentação inversa
@@ -458,10 +1431,17 @@ def criar_movimentacao_estorno_db(movimentacao_id, usuario_id):
         if not tipo_inverso:
             return False, f"Não é possível estornar uma movimentação do tipo '{mov_original['tipo']}'."
 
+        if mov_original['material_id'] is None:
+            # A original passa a apontar para o material resolvido: sem isso o livro (conciliação
+            # e checkpoints) veria o estorno sem a movimentação que ele desfaz
+            cursor.execute("UPDATE movimentacoes SET material_id = %s WHERE id = %s", (material_id, movimentacao_id))
+            qtd_original = mov_original['quantidade'] if mov_original['tipo'] == "Entrada" else -mov_original['quantidade']
+            ajustar_checkpoints_estoque(cursor, obra_id, material_id, mov_original['data'], qtd_original)
+
         # 1. Cria o novo registro de movimentação de estorno
         observacao_estorno = f"ESTORNO da Movimentação ID: {movimentacao_id}. Por usuário ID: {usuario_id}."
-        sql_insert = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, observacoes, fornecedor, recebedor) VALUES (%s, NOW(), %s, %s, %s, %s, %s, %s)"
-        valores_insert = (obra_id, tipo_inverso, mov_original['descricao'], mov_original['quantidade'], observacao_estorno, mov_original['fornecedor'], mov_original['recebedor'])
+        sql_insert = "INSERT INTO movimentacoes (obra_id, material_id, data, tipo, descricao, quantidade, observacoes, fornecedor, recebedor) VALUES (%s, %s, NOW(), %s, %s, %s, %s, %s, %s)"
+        valores_insert = (obra_id, material_id, tipo_inverso, mov_original['descricao'], mov_original['quantidade'], observacao_estorno, mov_original['fornecedor'], mov_original['recebedor'])
         cursor.execute(sql_insert, valores_insert)
 
         # 2. ATUALIZA O ESTOQUE NA TABELA CORRETA (estoque_obra)
@@ -473,9 +1453,8 @@ def criar_movimentacao_estorno_db(movimentacao_id, usuario_id):
         
         conexao.commit()
         
-        # 4. LIMPA OS CACHES CORRETAMENTE
-        st.cache_resource.clear()
-        st.cache_data.clear()
+        # 4. INVALIDA APENAS O CACHE DA OBRA AFETADA
+        invalidar_cache(("movimentacoes", obra_id), ("estoque_obra", obra_id), ("estoque_checkpoints", None))
         
         return True, "Movimentação estornada com sucesso!"
 
@@ -483,9 +1462,9 @@ def criar_movimentacao_estorno_db(movimentacao_id, usuario_id):
         conexao.rollback()
         return False, f"Erro ao estornar: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@cache_leitura(ttl=3600, tags=[("prazos_compra", None)])
 def buscar_prazos_compra_db():
     """Busca todos os prazos de compra cadastrados por categoria."""
     conexao = conectar_mysql_leitura()
@@ -497,7 +1476,7 @@ def buscar_prazos_compra_db():
         st.error(f"Erro ao buscar prazos de compra: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def salvar_prazo_compra_db(categoria, prazo_dias):
     """Salva ou atualiza o prazo de compra para uma categoria."""
     conexao = obter_conexao_para_transacao()
@@ -512,16 +1491,15 @@ def salvar_prazo_compra_db(categoria, prazo_dias):
         """
         cursor.execute(sql, (categoria, prazo_dias, prazo_dias))
         conexao.commit()
-        st.cache_resource.clear() # Limpa cache para garantir que a próxima leitura veja a mudança
-        st.cache_data.clear()
+        invalidar_cache(("prazos_compra", None))
         return True, "Prazo salvo com sucesso!"
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao salvar prazo: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def remover_prazo_compra_db(prazo_id):
     """Remove um prazo de compra pelo seu ID."""
     conexao = obter_conexao_para_transacao()
@@ -531,124 +1509,70 @@ def remover_prazo_compra_db(prazo_id):
         sql = "DELETE FROM prazos_compra WHERE id = %s"
         cursor.execute(sql, (prazo_id,))
         conexao.commit()
-        st.cache_resource.clear()
-        st.cache_data.clear()
+        invalidar_cache(("prazos_compra", None))
         return True, "Prazo removido com sucesso."
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao remover prazo: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
-
-@st.cache_data(ttl=3600)
-def calcular_prazo_maximo_kit(kit_id):
-    """
-    Calcula o maior prazo de compra (em dias) entre todos os materiais de um kit.
-    Retorna o prazo máximo ou 0 se nenhum material tiver prazo definido.
-    """
-    conexao = conectar_mysql_leitura()
-    if not conexao: return 0 # Retorna 0 em caso de falha na conexão
-
-    prazo_maximo = 0
-    try:
-        cursor = conexao.cursor(dictionary=True)
-        # Query para buscar a categoria de cada material no kit e o prazo dessa categoria
-        query = """
-            SELECT pc.prazo_dias
-            FROM kit_materiais km
-            JOIN materiais m ON km.material_id = m.id
-            LEFT JOIN prazos_compra pc ON m.categoria = pc.categoria
-            WHERE km.kit_id = %s
-        """
-        cursor.execute(query, (kit_id,))
-        resultados = cursor.fetchall()
-
-        # Encontra o maior prazo entre os materiais do kit
-        for linha in resultados:
-            if linha['prazo_dias'] is not None and linha['prazo_dias'] > prazo_maximo:
-                prazo_maximo = linha['prazo_dias']
-        
-        return prazo_maximo
-
-    except Error as e:
-        print(f"Erro ao calcular prazo máximo do kit {kit_id}: {e}")
-        return 0 # Retorna 0 em caso de erro
-    finally:
-        if conexao.is_connected():
-            conexao.close()
-
-@st.cache_data(ttl=3600)
-def verificar_e_gerar_notificacoes_compra(obra_id, antecedencia_seguranca_dias=60):
+        liberar_conexao(conexao)
+
+ANTECEDENCIA_SEGURANCA_COMPRA_DIAS = 60 # Somada ao maior prazo de compra do kit
+DIAS_ANTECEDENCIA_MONTAGEM = 2 # Solicitação de montagem: dias antes do início da tarefa
+
+# Data de notificação de cada vínculo kit-tarefa: início da tarefa menos o maior prazo de
+# compra entre os materiais do kit (0 se nenhum tiver prazo) e a antecedência de segurança.
+# '{filtro}' restringe os vínculos (condição sobre 'v' e 't'); o primeiro parâmetro é a antecedência.
+PRAZOS_VINCULOS_SQL = """
+    SELECT v.id AS kit_vinculado_id, t.data_inicio AS data_necessidade,
+           DATE_SUB(t.data_inicio, INTERVAL COALESCE(MAX(pc.prazo_dias), 0) + %s DAY) AS data_notificacao
+    FROM tarefa_kits_vinculados v
+    JOIN planejamento_tarefas t ON t.id = v.tarefa_id
+    LEFT JOIN kit_materiais km ON km.kit_id = v.kit_id
+    LEFT JOIN materiais m ON m.id = km.material_id
+    LEFT JOIN prazos_compra pc ON pc.categoria = m.categoria
+    WHERE {filtro}
+    GROUP BY v.id, t.data_inicio
+"""
+
+@comando_escrita
+def verificar_e_gerar_notificacoes_compra(obra_id, antecedencia_seguranca_dias=ANTECEDENCIA_SEGURANCA_COMPRA_DIAS):
     """
     Verifica tarefas futuras com kits vinculados e gera notificações de compra
     com base no prazo mais longo do kit e na antecedência de segurança.
+    Tudo num único INSERT ... SELECT (PRAZOS_VINCULOS_SQL): só entram os vínculos ainda sem
+    notificação cuja data de notificação já chegou. A chave única por vínculo
+    (migracoes/009) garante que verificações simultâneas não dupliquem notificações.
     """
     conexao = obter_conexao_para_transacao()
     if not conexao: return
 
     try:
-        cursor = conexao.cursor(dictionary=True)
-        
-        # Busca todos os vínculos de kits para tarefas futuras nesta obra
-        query_vinculos = """
-            SELECT 
-                v.id as kit_vinculado_id, 
-                v.kit_id, 
-                t.data_inicio as data_necessidade
-            FROM tarefa_kits_vinculados v
-            JOIN planejamento_tarefas t ON v.tarefa_id = t.id
-            WHERE t.obra_id = %s 
-              AND t.data_inicio >= CURDATE()
-        """
-        cursor.execute(query_vinculos, (obra_id,))
-        vinculos_futuros = cursor.fetchall()
-
-        notificacoes_para_criar = []
-        hoje = datetime.now().date()
-
-        for vinculo in vinculos_futuros:
-            kit_vinculado_id = vinculo['kit_vinculado_id']
-            kit_id = vinculo['kit_id']
-            data_necessidade = vinculo['data_necessidade']
-
-            # Verifica se já existe notificação para este vínculo
-            cursor.execute("SELECT id FROM notificacoes_compra WHERE kit_vinculado_id = %s", (kit_vinculado_id,))
-            notificacao_existente = cursor.fetchone()
-
-            if not notificacao_existente:
-                # Calcula o prazo máximo para os materiais deste kit
-                prazo_compra_kit = calcular_prazo_maximo_kit(kit_id)
-                
-                # Calcula o prazo total (compra + segurança)
-                prazo_total_dias = prazo_compra_kit + antecedencia_seguranca_dias
-                
-                # Calcula a data limite para a notificação
-                from datetime import timedelta
-                data_notificacao = data_necessidade - timedelta(days=prazo_total_dias)
-
-                # Se a data de notificação for hoje ou já passou, adiciona à lista
-                if data_notificacao <= hoje:
-                    notificacoes_para_criar.append((kit_vinculado_id, data_notificacao, data_necessidade))
-
-        # Insere todas as novas notificações no banco de dados
-        if notificacoes_para_criar:
-            sql_insert = """
-                INSERT INTO notificacoes_compra 
-                (kit_vinculado_id, data_notificacao, data_necessidade) 
-                VALUES (%s, %s, %s)
-            """
-            cursor.executemany(sql_insert, notificacoes_para_criar)
-            conexao.commit()
-            st.cache_data.clear()
-            print(f"INFO: {len(notificacoes_para_criar)} nova(s) notificação(ões) de compra criada(s).")
+        cursor = conexao.cursor()
+        prazos = PRAZOS_VINCULOS_SQL.format(filtro="""
+            t.obra_id = %s AND t.data_inicio >= CURDATE()
+            AND NOT EXISTS (SELECT 1 FROM notificacoes_compra n WHERE n.kit_vinculado_id = v.id)
+        """)
+        cursor.execute(f"""
+            INSERT INTO notificacoes_compra (kit_vinculado_id, data_notificacao, data_necessidade)
+            SELECT p.kit_vinculado_id, p.data_notificacao, p.data_necessidade
+            FROM ({prazos}) p
+            WHERE p.data_notificacao <= CURDATE()
+            ON DUPLICATE KEY UPDATE id = id
+        """, (antecedencia_seguranca_dias, obra_id))
+        criadas = cursor.rowcount
+        conexao.commit()
+        if criadas > 0:
+            invalidar_cache(("notificacoes_compra", obra_id))
+            print(f"INFO: {criadas} nova(s) notificação(ões) de compra criada(s).")
 
     except Error as e:
         print(f"ERRO ao gerar notificações de compra: {e}")
         if conexao.is_connected(): conexao.rollback()
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=60)
+@cache_leitura(ttl=60, tags=lambda a: [("notificacoes_compra", a["obra_id"]), ("tarefa_kits_vinculados", a["obra_id"]), ("kits", a["obra_id"]), ("planejamento_tarefas", a["obra_id"])])
 def buscar_notificacoes_compra_db(obra_id):
     """Busca as notificações de COMPRA pendentes para uma obra."""
     conexao = conectar_mysql_leitura()
@@ -675,6 +1599,7 @@ def buscar_notificacoes_compra_db(obra_id):
         st.error(f"Erro ao buscar notificações de compra: {e}")
         return pd.DataFrame()
 
+@comando_escrita
 def atualizar_status_notificacao_compra_db(notificacao_id, novo_status):
     """Atualiza o status de uma notificação de compra."""
     conexao = obter_conexao_para_transacao()
@@ -684,14 +1609,13 @@ def atualizar_status_notificacao_compra_db(notificacao_id, novo_status):
         sql = "UPDATE notificacoes_compra SET status = %s WHERE id = %s"
         cursor.execute(sql, (novo_status, notificacao_id))
         conexao.commit()
-        st.cache_data.clear() # Limpa cache de dados para a lista de notificações atualizar
+        invalidar_cache(("notificacoes_compra", None)) # Atualiza as listas de notificações
         return True, "Status da notificação atualizado!"
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao atualizar status da notificação: {e}"
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
 def buscar_notificacoes_compra_solicitadas_db(obra_id):
     """Busca o histórico de notificações de COMPRA marcadas como 'Solicitado'."""
@@ -725,16 +1649,32 @@ def buscar_notificacoes_compra_solicitadas_db(obra_id):
     except Error as e:
         st.error(f"Erro ao buscar histórico de notificações de compra: {e}")
         return pd.DataFrame()
-    finally:
-        if conexao.is_connected():
-            conexao.close()
 
 
 
 #endregion
 
 #region Funções de Lógica de Negócio (Banco de Dados - Transferências)
-@st.cache_data(ttl=3600)
+def inserir_movimentacoes_transacao(cursor, transacao):
+    """
+    Grava a saída na obra de origem e a entrada na obra de destino de uma transação
+    aprovada, com material_id e a descrição lida do materiais no mesmo comando.
+    Roda dentro da transação de quem chama.
+    """
+    sql_saida = """
+        INSERT INTO movimentacoes (obra_id, material_id, data, tipo, descricao, quantidade, recebedor, observacoes)
+        SELECT %s, m.id, NOW(), %s, m.descricao, %s, %s, %s FROM materiais m WHERE m.id = %s
+    """
+    cursor.execute(sql_saida, (transacao['obra_origem_id'], transacao['tipo_transacao'], transacao['quantidade'], f"Obra Destino ID: {transacao['obra_destino_id']}", transacao['observacoes'], transacao['material_id']))
+    if cursor.rowcount == 0:
+        raise Error("Material da transação não encontrado.")
+    sql_entrada = """
+        INSERT INTO movimentacoes (obra_id, material_id, data, tipo, descricao, quantidade, fornecedor, observacoes)
+        SELECT %s, m.id, NOW(), %s, m.descricao, %s, %s, %s FROM materiais m WHERE m.id = %s
+    """
+    cursor.execute(sql_entrada, (transacao['obra_destino_id'], transacao['tipo_transacao'], transacao['quantidade'], f"Obra Origem ID: {transacao['obra_origem_id']}", transacao['observacoes'], transacao['material_id']))
+
+@cache_leitura(ttl=3600, tags=lambda a: [("transacoes_pendentes", a["obra_id"]), ("materiais", None), ("obras", None)])
 def buscar_transacoes_db(obra_id, tipo_busca='recebidas'):
     """Busca transações pendentes, recebidas ou enviadas por uma obra."""
     conexao = conectar_mysql_leitura()
@@ -768,6 +1708,7 @@ def buscar_transacoes_db(obra_id, tipo_busca='recebidas'):
         st.error(f"Erro ao buscar transações {tipo_busca}: {e}")
         return pd.DataFrame()
 
+@comando_escrita
 def processar_transacao_db(transacao_id, novo_status, usuario_id):
     """
     Processa uma transação e, se aprovada, executa as movimentações de estoque
@@ -793,17 +1734,8 @@ def processar_transacao_db(transacao_id, novo_status, usuario_id):
             obra_destino_id = transacao['obra_destino_id']
             quantidade = transacao['quantidade']
 
-            # Pega o nome do material para o histórico
-            cursor.execute("SELECT descricao FROM materiais WHERE id = %s", (material_id,))
-            material = cursor.fetchone()
-            if not material:
-                raise Error("Material da transação não encontrado.")
-            
-            # 1. Registra as movimentações (esta parte continua igual)
-            sql_saida = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, recebedor, observacoes) VALUES (%s, NOW(), %s, %s, %s, %s, %s)"
-            cursor.execute(sql_saida, (obra_origem_id, transacao['tipo_transacao'], material['descricao'], quantidade, f"Obra Destino ID: {obra_destino_id}", transacao['observacoes']))
-            sql_entrada = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, fornecedor, observacoes) VALUES (%s, NOW(), %s, %s, %s, %s, %s)"
-            cursor.execute(sql_entrada, (obra_destino_id, transacao['tipo_transacao'], material['descricao'], quantidade, f"Obra Origem ID: {obra_origem_id}", transacao['observacoes']))
+            # 1. Registra as movimentações; a descrição vem do próprio materiais no INSERT ... SELECT
+            inserir_movimentacoes_transacao(cursor, transacao)
 
             # 2. ATUALIZA O ESTOQUE NA NOVA TABELA (A grande mudança!)
             # Primeiro, garante que as linhas de estoque existem para ambas as obras para evitar erros
@@ -821,16 +1753,18 @@ def processar_transacao_db(transacao_id, novo_status, usuario_id):
         cursor.execute(sql_update_transacao, (novo_status, usuario_id, transacao_id))
 
         conexao.commit()
-        st.cache_resource.clear()
-        st.cache_data.clear()
+        tags = [("transacoes_pendentes", transacao['obra_origem_id']), ("transacoes_pendentes", transacao['obra_destino_id'])]
+        if novo_status == 'Aprovada':
+            for obra_afetada in (transacao['obra_origem_id'], transacao['obra_destino_id']):
+                tags += [("movimentacoes", obra_afetada), ("estoque_obra", obra_afetada)]
+        invalidar_cache(*tags)
         return True, f"Transação '{novo_status.lower()}' com sucesso!"
 
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao processar transação: {e}"
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
 def buscar_historico_transacoes_db(obra_id):
     """Busca o histórico de transações concluídas (aprovadas, recusadas, canceladas)."""
@@ -895,6 +1829,7 @@ def buscar_transacoes_db(obra_id, tipo_busca='recebidas'):
         st.error(f"Erro ao buscar transações {tipo_busca}: {e}")
         return pd.DataFrame()
 
+@comando_escrita
 def processar_transacao_db(transacao_id, novo_status, usuario_id):
     """
     Processa uma transação e, se aprovada, executa as movimentações de estoque
@@ -918,15 +1853,7 @@ def processar_transacao_db(transacao_id, novo_status, usuario_id):
             obra_destino_id = transacao['obra_destino_id']
             quantidade = transacao['quantidade']
 
-            cursor.execute("SELECT descricao FROM materiais WHERE id = %s", (material_id,))
-            material = cursor.fetchone()
-            if not material:
-                raise Error("Material da transação não encontrado.")
-            
-            sql_saida = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, recebedor, observacoes) VALUES (%s, NOW(), %s, %s, %s, %s, %s)"
-            cursor.execute(sql_saida, (obra_origem_id, transacao['tipo_transacao'], material['descricao'], quantidade, f"Obra Destino ID: {obra_destino_id}", transacao['observacoes']))
-            sql_entrada = "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, fornecedor, observacoes) VALUES (%s, NOW(), %s, %s, %s, %s, %s)"
-            cursor.execute(sql_entrada, (obra_destino_id, transacao['tipo_transacao'], material['descricao'], quantidade, f"Obra Origem ID: {obra_origem_id}", transacao['observacoes']))
+            inserir_movimentacoes_transacao(cursor, transacao)
 
             # --- DEBUGGING LOGIC ---
             print(f"\n--- DEBUG: ATUALIZANDO ESTOQUE ---")
@@ -948,16 +1875,18 @@ def processar_transacao_db(transacao_id, novo_status, usuario_id):
         cursor.execute(sql_update_transacao, (novo_status, usuario_id, transacao_id))
 
         conexao.commit()
-        st.cache_resource.clear()
-        st.cache_data.clear()
+        tags = [("transacoes_pendentes", transacao['obra_origem_id']), ("transacoes_pendentes", transacao['obra_destino_id'])]
+        if novo_status == 'Aprovada':
+            for obra_afetada in (transacao['obra_origem_id'], transacao['obra_destino_id']):
+                tags += [("movimentacoes", obra_afetada), ("estoque_obra", obra_afetada)]
+        invalidar_cache(*tags)
         return True, f"Transação '{novo_status.lower()}' com sucesso!"
 
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao processar transação: {e}"
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
 def buscar_historico_transacoes_db(obra_id):
     """Busca o histórico de transações concluídas (aprovadas, recusadas, canceladas)."""
@@ -1057,11 +1986,276 @@ def calcular_balanco_emprestimos_db(obra_id):
 
 
 
+#endregion
+
+#region Funções de Lógica de Negócio (Banco de Dados - Conciliação de Estoque)
+
+# O saldo em estoque_obra é alterado no lugar a cada movimentação; o livro de
+# movimentações é a fonte da verdade. Sinal de cada linha do livro:
+#   Entrada +, Saída -; nas transferências aprovadas (inserir_movimentacoes_transacao)
+#   a linha da obra de origem é a que tem recebedor 'Obra Destino ID: ...' (saída) e a
+#   da obra de destino tem fornecedor (entrada). Um estorno não apaga a linha original:
+#   grava a movimentação inversa, então linhas estornadas também entram na soma.
+TIPOS_TRANSFERENCIA = ["Transferência", "Empréstimo", "Devolução"]
+PREFIXO_SAIDA_TRANSFERENCIA = "Obra Destino ID:"
+TOLERANCIA_DIVERGENCIA = 0.005 # Metade do centésimo do DECIMAL(12,2)
+
+# A mesma regra de sinal em SQL, para as somas feitas no banco (checkpoints de estoque)
+QUANTIDADE_COM_SINAL_SQL = """
+    CASE
+        WHEN tipo = 'Entrada' THEN quantidade
+        WHEN tipo = 'Saída' THEN -quantidade
+        WHEN tipo IN ('Transferência', 'Empréstimo', 'Devolução') THEN IF(recebedor LIKE 'Obra Destino ID:%%', -quantidade, quantidade)
+        ELSE 0
+    END
+"""
+
+def sinal_movimentacoes(tipos, saidas_transferencia):
+    """Vetor de sinais (+1/-1/0) das linhas do livro, calculado de uma vez com NumPy."""
+    tipos = np.asarray(tipos, dtype=object)
+    saidas = np.asarray(saidas_transferencia, dtype=bool)
+    return np.select(
+        [tipos == "Entrada", tipos == "Saída", np.isin(tipos, TIPOS_TRANSFERENCIA)],
+        [1, -1, np.where(saidas, -1, 1)],
+        default=0,
+    )
+
+def calcular_divergencias_estoque_db(obra_id=None):
+    """
+    Recalcula o saldo esperado de cada (obra, material) a partir do livro de movimentações
+    e compara com estoque_obra. O banco agrega o livro numa única consulta agrupada
+    (uma linha por obra/material/tipo/sentido); os sinais e a soma final são feitos em
+    NumPy. As duas leituras usam o mesmo snapshot, então uma movimentação registrada no
+    meio da conciliação não aparece como divergência.
+    A coluna 'sem_movimentacoes' marca os saldos que não têm nenhuma linha no livro (carga
+    inicial feita direto em estoque_obra): o livro não tem como dizer que estão errados.
+    Retorna (DataFrame das divergências, nº de movimentações sem material_id) ou (None, 0) em erro.
+    """
+    # Só leitura: conexão própria do pool de leitura, com o snapshot aberto e fechado aqui
+    try:
+        conexao = obter_conexao_do_pool("leitura")
+    except Error as e:
+        print(f"ERRO ao obter conexão de leitura para conciliação: {e}")
+        return None, 0
+
+    filtro_obra, params_obra = (" AND obra_id = %s", (obra_id,)) if obra_id else ("", ())
+    query_livro = f"""
+        SELECT obra_id, material_id, tipo, recebedor LIKE %s AS saida_transferencia, SUM(quantidade) AS quantidade
+        FROM movimentacoes WHERE material_id IS NOT NULL{filtro_obra}
+        GROUP BY obra_id, material_id, tipo, saida_transferencia
+    """
+    query_estoque = f"SELECT obra_id, material_id, quantidade FROM estoque_obra WHERE 1=1{filtro_obra}"
+    query_sem_material = f"SELECT COUNT(*) FROM movimentacoes WHERE material_id IS NULL{filtro_obra}"
+    try:
+        conexao.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = conexao.cursor()
+        cursor.execute(query_livro, (PREFIXO_SAIDA_TRANSFERENCIA + "%",) + params_obra)
+        livro = pd.DataFrame(cursor.fetchall(), columns=["obra_id", "material_id", "tipo", "saida_transferencia", "quantidade"])
+        cursor.execute(query_estoque, params_obra)
+        estoque = pd.DataFrame(cursor.fetchall(), columns=["obra_id", "material_id", "quantidade_atual"])
+        cursor.execute(query_sem_material, params_obra)
+        sem_material = cursor.fetchone()[0]
+        conexao.commit()
+    except Error as e:
+        conexao.rollback()
+        st.error(f"Erro ao conciliar estoque: {e}")
+        return None, 0
+    finally:
+        liberar_conexao(conexao)
+
+    livro["quantidade_esperada"] = livro["quantidade"].to_numpy(dtype=float) * sinal_movimentacoes(livro["tipo"], livro["saida_transferencia"].fillna(0))
+    esperado = livro.groupby(["obra_id", "material_id"], as_index=False)["quantidade_esperada"].sum()
+    estoque["quantidade_atual"] = estoque["quantidade_atual"].astype(float)
+
+    comparacao = estoque.merge(esperado, on=["obra_id", "material_id"], how="outer", indicator=True).fillna({"quantidade_atual": 0.0, "quantidade_esperada": 0.0})
+    comparacao["sem_movimentacoes"] = comparacao.pop("_merge").eq("left_only").to_numpy()
+    comparacao["diferenca"] = (comparacao["quantidade_atual"] - comparacao["quantidade_esperada"]).round(2)
+    divergencias = comparacao[np.abs(comparacao["diferenca"].to_numpy()) >= TOLERANCIA_DIVERGENCIA]
+    return divergencias.sort_values(["obra_id", "material_id"]).reset_index(drop=True), sem_material
+
+@comando_escrita
+def corrigir_divergencias_estoque_db(divergencias):
+    """
+    Ajusta estoque_obra para o saldo do livro numa única transação. O ajuste é relativo
+    (quantidade - diferenca), então movimentações feitas depois da conciliação são preservadas.
+    Saldos sem movimentações no livro não são tocados, e nada é corrigido se alguma obra
+    envolvida tiver movimentações sem material_id: o livro dessas obras está incompleto.
+    """
+    if divergencias is None or divergencias.empty: return False, "Nenhuma divergência para corrigir."
+    divergencias = divergencias[~divergencias["sem_movimentacoes"]]
+    if divergencias.empty: return False, "Só há saldos sem movimentações no livro; nada a corrigir."
+    conexao = obter_conexao_para_transacao()
+    if not conexao: return False, "Falha na conexão."
+    obras = [int(oid) for oid in divergencias["obra_id"].unique()]
+    comando = """
+        INSERT INTO estoque_obra (material_id, obra_id, quantidade) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE quantidade = quantidade + VALUES(quantidade)
+    """
+    valores = [
+        (int(material_id), int(obra_id), -float(diferenca))
+        for obra_id, material_id, diferenca in divergencias[["obra_id", "material_id", "diferenca"]].itertuples(index=False)
+    ]
+    try:
+        conexao.start_transaction()
+        cursor = conexao.cursor()
+        cursor.execute(
+            f"SELECT COUNT(*) FROM movimentacoes WHERE material_id IS NULL AND obra_id IN ({','.join(['%s'] * len(obras))})",
+            tuple(obras),
+        )
+        sem_material = cursor.fetchone()[0]
+        if sem_material:
+            conexao.rollback()
+            return False, f"{sem_material} movimentação(ões) sem material identificado nestas obras; corrija-as antes de ajustar os saldos."
+        cursor.executemany(comando, valores)
+        conexao.commit()
+        invalidar_cache(*[("estoque_obra", oid) for oid in obras])
+        return True, f"{len(valores)} saldo(s) de estoque corrigido(s)."
+    except Error as e:
+        conexao.rollback()
+        return False, f"Erro ao corrigir estoque: {e}"
+    finally:
+        liberar_conexao(conexao)
+
+# --- Checkpoints de saldo (estoque em uma data) ---
+# estoque_checkpoints guarda, no primeiro dia de cada mês, o saldo de cada (obra, material)
+# considerando as movimentações com data < data_corte. O saldo numa data qualquer é o
+# checkpoint anterior mais próximo mais as movimentações desde ele: a consulta lê no
+# máximo um intervalo entre checkpoints do livro, não o histórico inteiro.
+# Movimentações lançadas com data retroativa (antes de um corte já gerado) corrigem os
+# checkpoints seguintes em ajustar_checkpoints_estoque(), na mesma transação.
+# As datas de corte geradas ficam em estoque_cortes (migracoes/010): pares com saldo zero
+# não têm linha em estoque_checkpoints, então só essa lista diz quais cortes existem.
+# Movimentações sem material_id (legado ambíguo da migracoes/005) ficam fora dos saldos;
+# contar_movimentacoes_sem_material_db diz quantas são para a tela avisar.
+DATA_MINIMA_MYSQL = datetime(1000, 1, 1)
+
+def ajustar_checkpoints_estoque(cursor, obra_id, material_id, data, quantidade_com_sinal):
+    """Soma uma movimentação retroativa aos checkpoints posteriores a ela (nada faz se não houver)."""
+    cursor.execute("""
+        INSERT INTO estoque_checkpoints (obra_id, material_id, data_corte, quantidade)
+        SELECT %s, %s, data_corte, %s FROM estoque_cortes WHERE data_corte > %s
+        ON DUPLICATE KEY UPDATE quantidade = quantidade + VALUES(quantidade)
+    """, (obra_id, material_id, quantidade_com_sinal, data))
+
+def _proximos_cortes(ultimo_corte, primeira_movimentacao, limite):
+    """Primeiros dias de mês depois do último corte (ou da primeira movimentação) até 'limite'."""
+    base = ultimo_corte or primeira_movimentacao
+    corte = datetime(base.year, base.month, 1)
+    cortes = []
+    while True:
+        corte = datetime(corte.year + corte.month // 12, corte.month % 12 + 1, 1)
+        if corte > limite:
+            return cortes
+        cortes.append(corte)
+
+@comando_escrita
+def gerar_checkpoints_estoque_db():
+    """
+    Gera os checkpoints mensais que faltam até o início do mês atual. Cada corte é um
+    único INSERT ... SELECT: o checkpoint anterior mais as movimentações do intervalo.
+    """
+    conexao = obter_conexao_para_transacao()
+    if not conexao: return False, "Falha na conexão."
+    comando = f"""
+        INSERT INTO estoque_checkpoints (obra_id, material_id, data_corte, quantidade)
+        SELECT obra_id, material_id, %s, SUM(quantidade) FROM (
+            SELECT obra_id, material_id, quantidade FROM estoque_checkpoints WHERE data_corte = %s
+            UNION ALL
+            SELECT obra_id, material_id, {QUANTIDADE_COM_SINAL_SQL} FROM movimentacoes
+            WHERE material_id IS NOT NULL AND data >= %s AND data < %s
+        ) AS saldos
+        GROUP BY obra_id, material_id
+        HAVING SUM(quantidade) <> 0
+    """
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("SELECT MAX(data_corte) FROM estoque_cortes")
+        ultimo_corte = cursor.fetchone()[0]
+        cursor.execute("SELECT MIN(data) FROM movimentacoes")
+        primeira_movimentacao = cursor.fetchone()[0]
+        if primeira_movimentacao is None:
+            return True, "Nenhuma movimentação registrada."
+        hoje = datetime.now()
+        cortes = _proximos_cortes(ultimo_corte, primeira_movimentacao, datetime(hoje.year, hoje.month, 1))
+        for corte in cortes:
+            # Um commit por corte: uma interrupção no meio preserva os meses já gerados
+            conexao.start_transaction()
+            cursor.execute(comando, (corte, ultimo_corte, ultimo_corte or DATA_MINIMA_MYSQL, corte))
+            cursor.execute("INSERT INTO estoque_cortes (data_corte) VALUES (%s)", (corte,))
+            conexao.commit()
+            ultimo_corte = corte
+        if cortes:
+            invalidar_cache(("estoque_checkpoints", None))
+        cursor.execute("SELECT COUNT(*) FROM movimentacoes WHERE material_id IS NULL")
+        sem_material = cursor.fetchone()[0]
+        aviso = f" {sem_material} movimentação(ões) sem material identificado ficaram fora dos saldos." if sem_material else ""
+        return True, f"{len(cortes)} checkpoint(s) mensal(is) gerado(s).{aviso}"
+    except Error as e:
+        conexao.rollback()
+        return False, f"Erro ao gerar checkpoints de estoque: {e}"
+    finally:
+        liberar_conexao(conexao)
+
+def montar_consulta_estoque_em(obra_id, momento, corte=None, material_id=None):
+    """
+    Monta (query, params) do saldo por material de uma obra em 'momento' (movimentações
+    com data < momento), partindo do checkpoint 'corte' (None = desde o início).
+    """
+    filtro_material, params_material = (" AND material_id = %s", (material_id,)) if material_id else ("", ())
+    # Com material, o índice (obra_id, material_id, data) atende. Sem ele, estornado IN (FALSE, TRUE)
+    # não filtra nada (estornos também contam no saldo), mas deixa o banco usar o intervalo
+    # de data do índice (obra_id, estornado, data)
+    filtro_livro = "material_id = %s" if material_id else "estornado IN (FALSE, TRUE)"
+    query = f"""
+        SELECT saldos.material_id, m.codigo, m.descricao, m.unidade, SUM(saldos.quantidade) AS quantidade
+        FROM (
+            SELECT material_id, quantidade FROM estoque_checkpoints WHERE obra_id = %s AND data_corte = %s{filtro_material}
+            UNION ALL
+            SELECT material_id, {QUANTIDADE_COM_SINAL_SQL} FROM movimentacoes
+            WHERE obra_id = %s AND {filtro_livro} AND material_id IS NOT NULL AND data >= %s AND data < %s
+        ) AS saldos
+        JOIN materiais m ON m.id = saldos.material_id
+        GROUP BY saldos.material_id, m.codigo, m.descricao, m.unidade
+        HAVING SUM(saldos.quantidade) <> 0
+        ORDER BY m.descricao
+    """
+    params = [obra_id, corte, *params_material, obra_id, *params_material, corte or DATA_MINIMA_MYSQL, momento]
+    return query, params
+
+@cache_leitura(ttl=3600, tags=lambda a: [("movimentacoes", a["obra_id"]), ("estoque_checkpoints", None)])
+def calcular_estoque_em_db(obra_id, momento, material_id=None):
+    """Saldo por material de uma obra em 'momento' (datetime): checkpoint mais próximo + movimentações desde ele."""
+    conexao = conectar_mysql_leitura()
+    if not conexao: return pd.DataFrame()
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("SELECT MAX(data_corte) FROM estoque_cortes WHERE data_corte <= %s", (momento,))
+        corte = cursor.fetchone()[0]
+        query, params = montar_consulta_estoque_em(obra_id, momento, corte, material_id)
+        return pd.read_sql(query, conexao, params=tuple(params))
+    except Error as e:
+        st.error(f"Erro ao calcular o estoque na data: {e}")
+        return pd.DataFrame()
+
+@cache_leitura(ttl=3600, tags=lambda a: [("movimentacoes", a["obra_id"])])
+def contar_movimentacoes_sem_material_db(obra_id, momento=None):
+    """Movimentações da obra (antes de 'momento', se informado) que o estoque em data e a conciliação não conseguem contar."""
+    conexao = conectar_mysql_leitura()
+    if not conexao: return 0
+    filtro_data, params_data = (" AND data < %s", (momento,)) if momento else ("", ())
+    try:
+        cursor = conexao.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM movimentacoes WHERE obra_id = %s AND material_id IS NULL{filtro_data}", (obra_id, *params_data))
+        return cursor.fetchone()[0]
+    except Error as e:
+        print(f"Erro ao contar movimentações sem material: {e}")
+        return 0
+
 #endregion
 
 #region Funções de Lógica de Negócio (Banco de Dados - Kits)
 
-@st.cache_data(ttl=60)
+@cache_leitura(ttl=60, tags=lambda a: [("tarefa_kits_vinculados", a["obra_id"]), ("kits", a["obra_id"]), ("planejamento_tarefas", a["obra_id"])])
 def buscar_todos_vinculos_da_obra_db(obra_id):
     """
     Busca TODOS os vínculos de kits de uma obra em uma única consulta.
@@ -1087,7 +2281,7 @@ def buscar_todos_vinculos_da_obra_db(obra_id):
     except Error:
         return pd.DataFrame()
 
-@st.cache_data(ttl=60)
+@cache_leitura(ttl=60, tags=lambda a: [("kits", a["obra_id"])])
 def buscar_kits_da_obra_db(obra_id):
     """Busca todos os kits de uma obra específica."""
     conexao = conectar_mysql_leitura()
@@ -1099,7 +2293,7 @@ def buscar_kits_da_obra_db(obra_id):
         st.error(f"Erro ao buscar kits: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=300)
+@cache_leitura(ttl=300, tags=lambda a: [("kit_materiais", a["kit_id"]), ("materiais", None)])
 def buscar_materiais_de_um_kit_db(kit_id):
     """Busca os materiais de um kit específico (não precisa de obra_id pois kit_id é único)."""
     conexao = conectar_mysql_leitura()
@@ -1116,6 +2310,7 @@ def buscar_materiais_de_um_kit_db(kit_id):
         st.error(f"Erro ao buscar materiais do kit: {e}")
         return pd.DataFrame()
 
+@comando_escrita
 def salvar_kit_completo_db(obra_id, nome, descricao, lista_materiais):
     """Salva um novo kit e sua lista de materiais em uma única transação."""
     conexao = obter_conexao_para_transacao()
@@ -1133,15 +2328,16 @@ def salvar_kit_completo_db(obra_id, nome, descricao, lista_materiais):
             cursor.execute(sql_materiais, (kit_id, material['id'], material['quantidade']))
         conexao.commit()
         
-        st.cache_resource.clear()
+        invalidar_cache(("kits", obra_id), ("kit_materiais", kit_id))
         
         return True, f"Kit '{nome}' salvo com sucesso!"
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao salvar o kit: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
+@comando_escrita
 def atualizar_kit_db(kit_id, nome, descricao, lista_materiais):
     """Atualiza um kit existente e sua lista de materiais."""
     conexao = obter_conexao_para_transacao()
@@ -1157,14 +2353,15 @@ def atualizar_kit_db(kit_id, nome, descricao, lista_materiais):
                 cursor.execute(sql_materiais, (kit_id, material['id'], material['quantidade']))
         conexao.commit()
 
-        st.cache_resource.clear()
+        invalidar_cache(("kits", None), ("kit_materiais", kit_id))
         return True, f"Kit '{nome}' atualizado com sucesso!"
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao atualizar o kit: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
+@comando_escrita
 def excluir_kit_db(kit_id):
     """Exclui um kit. A exclusão dos materiais é em cascata (ON DELETE CASCADE)."""
     conexao = obter_conexao_para_transacao()
@@ -1174,39 +2371,23 @@ def excluir_kit_db(kit_id):
         cursor.execute("DELETE FROM kits WHERE id = %s", (kit_id,))
         conexao.commit()
 
-        st.cache_resource.clear()
+        invalidar_cache(("kits", None), ("kit_materiais", kit_id), ("tarefa_kits_vinculados", None))
 
         return True, "Kit excluído com sucesso."
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao excluir o kit: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
 #endregion
 
 #region Funções de Lógica de Negócio (Banco de Dados - PLANEJAMENTO)
 
-def ler_e_salvar_tarefas_excel(uploaded_file, obra_id):
-    """
-    Lê um arquivo .xlsx, valida a presença da coluna 'Id_exclusiva',
-    e salva as tarefas no banco de dados.
-    """
-    try:
-        # --- 1. LEITURA E VALIDAÇÃO DO ARQUIVO EXCEL ---
-        df_excel = pd.read_excel(uploaded_file, engine='openpyxl')
-
-        # Verificação inteligente que prioriza "Id_exclusiva"
-        unique_id_col = None
-        if 'Id_exclusiva' in df_excel.columns:
-            unique_id_col = 'Id_exclusiva'
-        elif 'ID Exclusivo' in df_excel.columns:
-            unique_id_col = 'ID Exclusivo'
-        elif 'Unique ID' in df_excel.columns:
-            unique_id_col = 'Unique ID'
+COLUNAS_ID_EXCLUSIVA = ['Id_exclusiva', 'ID Exclusivo', 'Unique ID'] # Em ordem de prioridade
+TAMANHO_BLOCO_TAREFAS = 2000
 
-        if unique_id_col is None:
-            mensagem_erro = """
+MENSAGEM_SEM_ID_EXCLUSIVA = """
             **ERRO: A coluna 'Id_exclusiva' não foi encontrada no arquivo Excel.**
 
             Para corrigir no MS Project:
@@ -1215,126 +2396,316 @@ def ler_e_salvar_tarefas_excel(uploaded_file, obra_id):
             3.  Escolha **'ID Exclusivo'** (exporta como 'Id_exclusiva').
             4.  Exporte o arquivo para Excel novamente.
             """
-            return False, mensagem_erro
 
+def ler_tarefas_excel_em_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO_TAREFAS):
+    """
+    Lê a primeira aba de uma exportação do MS Project em modo read_only do openpyxl,
+    linha a linha, sem carregar a pasta inteira. Só as colunas usadas (ID exclusivo,
+    Nome, Início, Término) são extraídas, e as linhas saem em DataFrames de até
+    'tamanho_bloco' linhas com as colunas unique_id_mpp, nome_tarefa, data_inicio, data_fim.
+    Lança ValueError com a mensagem para o usuário se faltar alguma coluna.
+    """
+    workbook = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = workbook.worksheets[0].iter_rows(values_only=True)
+        cabecalho = list(next(linhas, ()))
+        unique_id_col = next((coluna for coluna in COLUNAS_ID_EXCLUSIVA if coluna in cabecalho), None)
+        if unique_id_col is None:
+            raise ValueError(MENSAGEM_SEM_ID_EXCLUSIVA)
         colunas_necessarias = [unique_id_col, 'Nome', 'Início', 'Término']
-        if not all(coluna in df_excel.columns for coluna in colunas_necessarias):
-            return False, f"O arquivo Excel precisa conter as colunas: {', '.join(colunas_necessarias)}"
-        
-        # --- 2. LIMPEZA E PREPARAÇÃO DOS DADOS DO EXCEL ---
-        df_excel = df_excel[colunas_necessarias].copy()
-        df_excel.dropna(subset=[unique_id_col, 'Nome', 'Início'], inplace=True)
-        df_excel.rename(columns={
-            unique_id_col: 'unique_id_mpp',
-            'Nome': 'nome_tarefa',
-            'Início': 'data_inicio',
-            'Término': 'data_fim'
-        }, inplace=True)
+        if not all(coluna in cabecalho for coluna in colunas_necessarias):
+            raise ValueError(f"O arquivo Excel precisa conter as colunas: {', '.join(colunas_necessarias)}")
+
+        posicoes = [cabecalho.index(coluna) for coluna in colunas_necessarias]
+        nomes = ['unique_id_mpp', 'nome_tarefa', 'data_inicio', 'data_fim']
+        bloco = []
+        for linha in linhas:
+            bloco.append([linha[i] if i < len(linha) else None for i in posicoes])
+            if len(bloco) == tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=nomes)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=nomes)
+    finally:
+        workbook.close()
 
-        # --- 3. TRATAMENTO DE DATAS (CORRIGIDO) ---
-        # Adicionamos dayfirst=True e format='mixed' para evitar erros de inferência
-        df_excel['data_inicio'] = pd.to_datetime(
-            df_excel['data_inicio'].astype(str).apply(traduzir_data_pt_en), 
-            dayfirst=True, 
-            format='mixed', 
-            errors='coerce'
-        ).dt.date
-        
-        df_excel['data_fim'] = pd.to_datetime(
-            df_excel['data_fim'].astype(str).apply(traduzir_data_pt_en), 
-            dayfirst=True, 
-            format='mixed', 
-            errors='coerce'
-        ).dt.date
-
-        # --- 4. GARANTIR CONSISTÊNCIA DE TIPO PARA O MERGE ---
-        df_db = buscar_tarefas_para_comparacao(obra_id)
-        df_db['unique_id_mpp'] = df_db['unique_id_mpp'].astype(str)
-        df_excel['unique_id_mpp'] = df_excel['unique_id_mpp'].astype(str)
-
-        # --- 5. COMPARAÇÃO COM OS DADOS DO BANCO ---
-        df_merged = pd.merge(df_db, df_excel, on='unique_id_mpp', how='outer', suffixes=('_db', '_excel'), indicator=True)
-
-        novas_tarefas = df_merged[df_merged['_merge'] == 'right_only']
-        tarefas_removidas = df_merged[df_merged['_merge'] == 'left_only']
-        tarefas_existentes = df_merged[df_merged['_merge'] == 'both']
-        
-        tarefas_modificadas = tarefas_existentes[
-            (tarefas_existentes['data_inicio_db'] != tarefas_existentes['data_inicio_excel']) |
-            (tarefas_existentes['nome_tarefa_db'] != tarefas_existentes['nome_tarefa_excel'])
-        ].copy()
+NAMESPACE_MSPDI = "{http://schemas.microsoft.com/project}"
+CAMPOS_TAREFA_MSPDI = {'UID': 'unique_id_mpp', 'Name': 'nome_tarefa', 'Start': 'data_inicio', 'Finish': 'data_fim', 'OutlineLevel': 'nivel', 'IsNull': 'nula'}
+MENSAGEM_XML_INVALIDO = "O arquivo não é um XML do MS Project. No MS Project, use Arquivo > Salvar como > Formato XML (*.xml)."
 
-        # --- 6. EXECUÇÃO DAS OPERAÇÕES NO BANCO DE DADOS ---
+def ler_tarefas_mspdi_em_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO_TAREFAS):
+    """
+    Lê o XML do MS Project (MSPDI) com iterparse, tarefa a tarefa: cada <Task> é lida,
+    reduzida aos campos de CAMPOS_TAREFA_MSPDI e descartada, então a memória não cresce
+    com o cronograma. O XML já traz o UID de cada tarefa (o 'ID Exclusivo'), sem coluna extra.
+    A tarefa-resumo do projeto (nível 0) e as linhas em branco (IsNull) ficam de fora.
+    Devolve DataFrames com as mesmas colunas de ler_tarefas_excel_em_blocos.
+    Lança ValueError com a mensagem para o usuário se o arquivo não for MSPDI.
+    """
+    nomes = ['unique_id_mpp', 'nome_tarefa', 'data_inicio', 'data_fim']
+    bloco = []
+    profundidade = 0
+    try:
+        for evento, elemento in ET.iterparse(arquivo, events=("start", "end")):
+            if evento == "start":
+                if profundidade == 0 and elemento.tag != f"{NAMESPACE_MSPDI}Project":
+                    raise ValueError(MENSAGEM_XML_INVALIDO)
+                if profundidade == 1:
+                    secao = elemento # <Tasks>, <Resources>, <Assignments>...
+                profundidade += 1
+                continue
+            profundidade -= 1
+            if profundidade != 2:
+                continue
+            # Fim de um item de seção: lê se for tarefa e descarta (junto com os anteriores)
+            campos = {}
+            if elemento.tag == f"{NAMESPACE_MSPDI}Task":
+                campos = {
+                    CAMPOS_TAREFA_MSPDI[filho.tag[len(NAMESPACE_MSPDI):]]: filho.text
+                    for filho in elemento if filho.tag[len(NAMESPACE_MSPDI):] in CAMPOS_TAREFA_MSPDI
+                }
+            secao.clear()
+            if not campos or campos.get('nula') == '1' or campos.get('nivel') == '0':
+                continue
+            bloco.append([campos.get(nome) for nome in nomes])
+            if len(bloco) == tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=nomes)
+                bloco = []
+    except ET.ParseError:
+        raise ValueError(MENSAGEM_XML_INVALIDO)
+    if bloco:
+        yield pd.DataFrame(bloco, columns=nomes)
+
+def _preparar_bloco_tarefas(df, cache_datas=None):
+    """
+    Limpa um bloco lido da planilha e converte as datas (texto em português ou data do Excel).
+    Retorna (tarefas válidas, tarefas com data de início em branco ou não reconhecida).
+    """
+    df = df.dropna(subset=['unique_id_mpp', 'nome_tarefa']).copy()
+    # Um bloco com linhas vazias vira float (10.0); o ID exclusivo é sempre inteiro
+    df['unique_id_mpp'] = pd.to_numeric(df['unique_id_mpp'], errors='coerce').astype('Int64')
+    df = df.dropna(subset=['unique_id_mpp'])
+    for coluna in ['data_inicio', 'data_fim']:
+        df[coluna] = converter_datas_ms_project(df[coluna], cache_datas).dt.date
+    sem_inicio = df['data_inicio'].isna()
+    return df[~sem_inicio], df[sem_inicio]
+
+# Tarefas da obra que não vieram no arquivo: a mesma junção lista os nomes para o relatório e apaga.
+# '{preservadas}' exclui as tarefas que vieram no arquivo mas foram descartadas na leitura.
+ANTIJUNCAO_TAREFAS_REMOVIDAS = """
+    FROM planejamento_tarefas t
+    LEFT JOIN planejamento_importacao i ON i.lote = %s AND i.unique_id_mpp = t.unique_id_mpp
+    WHERE t.obra_id = %s AND i.unique_id_mpp IS NULL{preservadas}
+"""
+
+def sincronizar_tarefas_db(cursor, obra_id, df_tarefas, ids_preservados=()):
+    """
+    Sincroniza planejamento_tarefas da obra com as tarefas lidas do arquivo
+    (unique_id_mpp, nome_tarefa, data_inicio, data_fim), dentro da transação do chamador:
+      1. grava as tarefas na área de preparo (planejamento_importacao) sob um lote próprio;
+      2. compara com o banco num único UPDATE com junção por (obra_id, unique_id_mpp),
+         marcando cada linha como 'adicionada', 'modificada' ou inalterada (NULL);
+      3. apaga as tarefas da obra que não vieram no arquivo (anti-junção), exceto as de
+         'ids_preservados' (estavam no arquivo, mas com data de início ilegível);
+      4. grava adicionadas e modificadas com um INSERT ... SELECT ... ON DUPLICATE KEY UPDATE.
+    Retorna o relatório {"adicionadas", "removidas", "modificadas"} com os nomes das tarefas
+    e "tarefas_alteradas", os ids das modificadas cuja data de início ou de fim mudou (só elas
+    mexem nos prazos dos kits vinculados; renomear não muda prazo, e as removidas levam
+    vínculos, notificações e solicitações junto pelo ON DELETE CASCADE).
+    """
+    lote = str(uuid.uuid4())
+    df = df_tarefas.drop_duplicates(subset=['unique_id_mpp']) # Planilha editada à mão pode repetir o ID; vale a primeira linha
+    df = df.astype(object).where(pd.notna(df), None)
+    linhas = [
+        (lote, int(unique_id), numero, str(nome), normalizar_busca(nome), inicio, fim)
+        for numero, (unique_id, nome, inicio, fim) in enumerate(
+            df[['unique_id_mpp', 'nome_tarefa', 'data_inicio', 'data_fim']].itertuples(index=False, name=None), start=1
+        )
+    ]
+    comando = "INSERT INTO planejamento_importacao (lote, unique_id_mpp, linha, nome_tarefa, nome_tarefa_busca, data_inicio, data_fim) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    for inicio in range(0, len(linhas), LOTE_INSERCAO_IMPORTACAO):
+        cursor.executemany(comando, linhas[inicio:inicio + LOTE_INSERCAO_IMPORTACAO])
+
+    # COLLATE utf8mb4_bin: renomear só a caixa ou os acentos de uma tarefa também é modificação
+    cursor.execute("""
+        UPDATE planejamento_importacao i
+        LEFT JOIN planejamento_tarefas t ON t.obra_id = %s AND t.unique_id_mpp = i.unique_id_mpp
+        SET i.tarefa_id = t.id,
+            i.nome_anterior = t.nome_tarefa,
+            i.acao = CASE
+                WHEN t.id IS NULL THEN 'adicionada'
+                WHEN t.nome_tarefa <> i.nome_tarefa COLLATE utf8mb4_bin
+                  OR t.data_inicio <> i.data_inicio
+                  OR NOT (t.data_fim <=> i.data_fim) THEN 'modificada'
+            END
+        WHERE i.lote = %s
+    """, (obra_id, lote))
+
+    ids_preservados = tuple(int(unique_id) for unique_id in ids_preservados)
+    antijuncao = ANTIJUNCAO_TAREFAS_REMOVIDAS.format(
+        preservadas=f" AND t.unique_id_mpp NOT IN ({','.join(['%s'] * len(ids_preservados))})" if ids_preservados else ""
+    )
+    cursor.execute(f"SELECT t.nome_tarefa {antijuncao} FOR UPDATE", (lote, obra_id, *ids_preservados))
+    removidas = [nome for (nome,) in cursor.fetchall()]
+    if removidas:
+        cursor.execute(f"DELETE t {antijuncao}", (lote, obra_id, *ids_preservados))
+
+    # O relatório sai antes do INSERT, enquanto as datas antigas ainda estão na tabela
+    cursor.execute("""
+        SELECT i.acao, i.nome_tarefa, i.nome_anterior, i.tarefa_id,
+               t.data_inicio <> i.data_inicio OR NOT (t.data_fim <=> i.data_fim) AS datas_alteradas
+        FROM planejamento_importacao i
+        LEFT JOIN planejamento_tarefas t ON t.id = i.tarefa_id
+        WHERE i.lote = %s AND i.acao IS NOT NULL ORDER BY i.linha
+    """, (lote,))
+    alteracoes = cursor.fetchall()
+
+    cursor.execute("""
+        INSERT INTO planejamento_tarefas (obra_id, unique_id_mpp, nome_tarefa, nome_tarefa_busca, data_inicio, data_fim)
+        SELECT %s, unique_id_mpp, nome_tarefa, nome_tarefa_busca, data_inicio, data_fim
+        FROM planejamento_importacao WHERE lote = %s AND acao IS NOT NULL ORDER BY linha
+        ON DUPLICATE KEY UPDATE
+            nome_tarefa = VALUES(nome_tarefa), nome_tarefa_busca = VALUES(nome_tarefa_busca),
+            data_inicio = VALUES(data_inicio), data_fim = VALUES(data_fim)
+    """, (obra_id, lote))
+
+    relatorio = {"adicionadas": [], "removidas": removidas, "modificadas": [], "tarefas_alteradas": set()}
+    for acao, nome, nome_anterior, tarefa_id, datas_alteradas in alteracoes:
+        if acao == 'adicionada':
+            relatorio["adicionadas"].append(nome)
+        else:
+            relatorio["modificadas"].append(nome_anterior)
+            if datas_alteradas:
+                relatorio["tarefas_alteradas"].add(tarefa_id)
+    cursor.execute("DELETE FROM planejamento_importacao WHERE lote = %s", (lote,))
+    return relatorio
+
+def reavaliar_vinculos_tarefas_db(cursor, tarefa_ids,
+                                  antecedencia_seguranca_dias=ANTECEDENCIA_SEGURANCA_COMPRA_DIAS,
+                                  dias_antecedencia_montagem=DIAS_ANTECEDENCIA_MONTAGEM):
+    """
+    Refaz, dentro da transação do chamador, as notificações de compra e as solicitações de
+    montagem dos kits vinculados às tarefas 'tarefa_ids' (as que mudaram de data na importação),
+    sem varrer o resto do planejamento. Só as pendentes mudam; as já solicitadas/montadas ficam:
+      - pendentes ganham as datas novas e saem se ainda não estão no prazo (voltam pela varredura);
+      - vínculos que entraram no prazo e não têm notificação/solicitação ganham uma agora.
+    """
+    if not tarefa_ids: return
+    marcadores = ','.join(['%s'] * len(tarefa_ids))
+    tarefa_ids = tuple(tarefa_ids)
+    prazos = PRAZOS_VINCULOS_SQL.format(filtro=f"v.tarefa_id IN ({marcadores})")
+
+    # --- Notificações de compra ---
+    cursor.execute(f"""
+        UPDATE notificacoes_compra n JOIN ({prazos}) p ON p.kit_vinculado_id = n.kit_vinculado_id
+        SET n.data_notificacao = p.data_notificacao, n.data_necessidade = p.data_necessidade
+        WHERE n.status = 'Pendente'
+    """, (antecedencia_seguranca_dias, *tarefa_ids))
+    cursor.execute(f"""
+        DELETE n FROM notificacoes_compra n JOIN tarefa_kits_vinculados v ON v.id = n.kit_vinculado_id
+        WHERE v.tarefa_id IN ({marcadores}) AND n.status = 'Pendente' AND n.data_notificacao > CURDATE()
+    """, tarefa_ids)
+    notificacoes_retiradas = cursor.rowcount
+    cursor.execute(f"""
+        INSERT INTO notificacoes_compra (kit_vinculado_id, data_notificacao, data_necessidade)
+        SELECT p.kit_vinculado_id, p.data_notificacao, p.data_necessidade
+        FROM ({prazos}) p
+        WHERE p.data_necessidade >= CURDATE() AND p.data_notificacao <= CURDATE()
+          AND NOT EXISTS (SELECT 1 FROM notificacoes_compra n WHERE n.kit_vinculado_id = p.kit_vinculado_id)
+        ON DUPLICATE KEY UPDATE id = id
+    """, (antecedencia_seguranca_dias, *tarefa_ids))
+    notificacoes_criadas = cursor.rowcount
+
+    # --- Solicitações de montagem ---
+    cursor.execute(f"""
+        UPDATE solicitacoes_montagem s
+        JOIN tarefa_kits_vinculados v ON v.id = s.kit_vinculado_id
+        JOIN planejamento_tarefas t ON t.id = v.tarefa_id
+        SET s.data_execucao_prevista = t.data_inicio
+        WHERE v.tarefa_id IN ({marcadores}) AND s.status = 'Pendente'
+    """, tarefa_ids)
+    cursor.execute(f"""
+        DELETE s FROM solicitacoes_montagem s JOIN tarefa_kits_vinculados v ON v.id = s.kit_vinculado_id
+        WHERE v.tarefa_id IN ({marcadores}) AND s.status = 'Pendente'
+          AND s.data_execucao_prevista > CURDATE() + INTERVAL %s DAY
+    """, (*tarefa_ids, dias_antecedencia_montagem))
+    solicitacoes_retiradas = cursor.rowcount
+    cursor.execute(f"""
+        INSERT INTO solicitacoes_montagem (kit_vinculado_id, data_execucao_prevista)
+        SELECT v.id, t.data_inicio
+        FROM tarefa_kits_vinculados v
+        JOIN planejamento_tarefas t ON t.id = v.tarefa_id
+        LEFT JOIN solicitacoes_montagem s ON s.kit_vinculado_id = v.id
+        WHERE v.tarefa_id IN ({marcadores}) AND t.data_inicio <= CURDATE() + INTERVAL %s DAY AND s.id IS NULL
+    """, (*tarefa_ids, dias_antecedencia_montagem))
+    solicitacoes_criadas = cursor.rowcount
+
+    print(f"INFO: reavaliação de {len(tarefa_ids)} tarefa(s): notificações +{notificacoes_criadas}/-{notificacoes_retiradas}, solicitações +{solicitacoes_criadas}/-{solicitacoes_retiradas}.")
+
+def _salvar_tarefas_importadas(blocos_lidos, obra_id):
+    """
+    Etapa comum das importações de planejamento: limpa os blocos de um leitor
+    (ler_tarefas_excel_em_blocos ou ler_tarefas_mspdi_em_blocos), sincroniza as tarefas
+    da obra (sincronizar_tarefas_db) e reavalia os kits das tarefas alteradas.
+    """
+    try:
+        # --- 1. LEITURA EM BLOCOS (só as colunas usadas), LIMPEZA E DATAS ---
+        try:
+            cache_datas = {}
+            blocos = [_preparar_bloco_tarefas(bloco, cache_datas) for bloco in blocos_lidos]
+        except ValueError as e:
+            return False, str(e)
+        colunas_tarefas = ['unique_id_mpp', 'nome_tarefa', 'data_inicio', 'data_fim']
+        df_tarefas = pd.concat([validas for validas, _ in blocos], ignore_index=True) if blocos else pd.DataFrame(columns=colunas_tarefas)
+        # Sem data de início a tarefa não pode ser gravada; ela fica como está no banco (não é removida)
+        df_sem_inicio = pd.concat([sem_inicio for _, sem_inicio in blocos], ignore_index=True) if blocos else pd.DataFrame(columns=colunas_tarefas)
+
+        # --- 2. SINCRONIZAÇÃO NO BANCO (área de preparo + comandos de conjunto) ---
         conexao = obter_conexao_para_transacao()
         if not conexao: return False, "Falha na conexão."
         cursor = conexao.cursor()
         conexao.start_transaction()
-
-        if not tarefas_removidas.empty:
-            ids_para_remover = tuple(tarefas_removidas['id'].astype(int).tolist())
-            if len(ids_para_remover) == 1:
-                cursor.execute("DELETE FROM planejamento_tarefas WHERE id = %s", (ids_para_remover[0],))
-            else:
-                cursor.execute(f"DELETE FROM planejamento_tarefas WHERE id IN ({','.join(['%s']*len(ids_para_remover))})", ids_para_remover)
-
-        if not tarefas_modificadas.empty:
-            updates = []
-            for _, row in tarefas_modificadas.iterrows():
-                updates.append((row['nome_tarefa_excel'], row['data_inicio_excel'], row['data_fim_excel'], int(row['id'])))
-            cursor.executemany("UPDATE planejamento_tarefas SET nome_tarefa = %s, data_inicio = %s, data_fim = %s WHERE id = %s", updates)
-        
-        if not novas_tarefas.empty:
-            inserts = []
-            for _, row in novas_tarefas.iterrows():
-                inserts.append((obra_id, int(row['unique_id_mpp']), row['nome_tarefa_excel'], row['data_inicio_excel'], row['data_fim_excel']))
-            cursor.executemany("INSERT INTO planejamento_tarefas (obra_id, unique_id_mpp, nome_tarefa, data_inicio, data_fim) VALUES (%s, %s, %s, %s, %s)", inserts)
-            
+        relatorio = sincronizar_tarefas_db(cursor, obra_id, df_tarefas, ids_preservados=df_sem_inicio['unique_id_mpp'].tolist())
+        relatorio["ignoradas"] = df_sem_inicio['nome_tarefa'].astype(str).tolist()
+        reavaliar_vinculos_tarefas_db(cursor, relatorio["tarefas_alteradas"])
         conexao.commit()
-        st.cache_resource.clear()
-
-        relatorio = {
-            "adicionadas": novas_tarefas['nome_tarefa_excel'].tolist(),
-            "removidas": tarefas_removidas['nome_tarefa_db'].tolist(),
-            "modificadas": tarefas_modificadas['nome_tarefa_db'].tolist()
-        }
+        invalidar_cache(
+            ("planejamento_tarefas", obra_id), ("tarefa_kits_vinculados", obra_id),
+            ("notificacoes_compra", obra_id), ("solicitacoes_montagem", obra_id),
+        )
         return True, relatorio
 
     except Exception as e:
         if 'conexao' in locals() and conexao.is_connected(): conexao.rollback()
         return False, f"Ocorreu um erro ao processar o arquivo: {e}"
     finally:
-        if 'conexao' in locals() and conexao.is_connected(): conexao.close()
+        if 'conexao' in locals(): liberar_conexao(conexao)
+
+@comando_escrita
+def ler_e_salvar_tarefas_excel(uploaded_file, obra_id):
+    """
+    Lê um arquivo .xlsx, valida a presença da coluna 'Id_exclusiva',
+    e sincroniza as tarefas da obra no banco de dados (sincronizar_tarefas_db).
+    """
+    return _salvar_tarefas_importadas(ler_tarefas_excel_em_blocos(uploaded_file), obra_id)
+
+@comando_escrita
+def ler_e_salvar_tarefas_mspdi(uploaded_file, obra_id):
+    """Lê o XML do MS Project (MSPDI) e sincroniza as tarefas da obra, como ler_e_salvar_tarefas_excel."""
+    return _salvar_tarefas_importadas(ler_tarefas_mspdi_em_blocos(uploaded_file), obra_id)
 
-@st.cache_data(ttl=60)
+@cache_leitura(ttl=60, tags=lambda a: [("planejamento_tarefas", a["obra_id"])])
 def buscar_tarefas_db(obra_id):
     """Busca todas as tarefas de um planejamento para uma obra específica."""
     conexao = conectar_mysql_leitura()
     if not conexao: return pd.DataFrame()
-    query = "SELECT id, nome_tarefa, DATE_FORMAT(data_inicio, '%d/%m/%Y') as data_inicio_fmt FROM planejamento_tarefas WHERE obra_id = %s ORDER BY data_inicio"
+    query = "SELECT id, nome_tarefa, nome_tarefa_busca, DATE_FORMAT(data_inicio, '%d/%m/%Y') as data_inicio_fmt FROM planejamento_tarefas WHERE obra_id = %s ORDER BY data_inicio"
     try:
         return pd.read_sql(query, conexao, params=(obra_id,))
     except Error:
         return pd.DataFrame()
 
-def buscar_tarefas_para_comparacao(obra_id):
-    """Busca as tarefas de uma obra para a lógica de comparação de planejamento."""
-    conexao = conectar_mysql_leitura()
-    if not conexao: return pd.DataFrame()
-    query = """
-        SELECT id, unique_id_mpp, nome_tarefa, data_inicio, data_fim 
-        FROM planejamento_tarefas 
-        WHERE obra_id = %s
-    """
-    try:
-        df = pd.read_sql(query, conexao, params=(obra_id,))
-        # Garante que as colunas de data estão no formato correto para comparação
-        df['data_inicio'] = pd.to_datetime(df['data_inicio']).dt.date
-        df['data_fim'] = pd.to_datetime(df['data_fim'], errors='coerce').dt.date
-        return df
-    except Error:
-        return pd.DataFrame()
-
-@st.cache_data(ttl=60)
+@cache_leitura(ttl=60, tags=[("tarefa_kits_vinculados", None), ("kits", None)])
 def buscar_kits_vinculados_db(tarefa_id):
     """Busca os kits que já foram vinculados a uma tarefa específica."""
     conexao = conectar_mysql_leitura()
@@ -1350,6 +2721,7 @@ def buscar_kits_vinculados_db(tarefa_id):
     except Error:
         return pd.DataFrame()
 
+@comando_escrita
 def vincular_kit_a_tarefa_db(tarefa_id, kit_id, quantidade):
     """Salva um novo vínculo entre uma tarefa e um kit."""
     conexao = obter_conexao_para_transacao()
@@ -1360,7 +2732,7 @@ def vincular_kit_a_tarefa_db(tarefa_id, kit_id, quantidade):
         sql = "INSERT INTO tarefa_kits_vinculados (tarefa_id, kit_id, quantidade_kits) SELECT %s, %s, %s WHERE NOT EXISTS (SELECT 1 FROM tarefa_kits_vinculados WHERE tarefa_id = %s AND kit_id = %s)"
         cursor.execute(sql, (tarefa_id, kit_id, quantidade, tarefa_id, kit_id))
         conexao.commit()
-        st.cache_resource.clear()
+        invalidar_cache(("tarefa_kits_vinculados", None))
         if cursor.rowcount > 0:
             st.session_state.verificacoes_rodaram = False
             return True, "Kit vinculado com sucesso!"
@@ -1370,8 +2742,9 @@ def vincular_kit_a_tarefa_db(tarefa_id, kit_id, quantidade):
         conexao.rollback()
         return False, f"Erro ao vincular kit: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
+@comando_escrita
 def desvincular_kit_da_tarefa_db(vinculo_id):
     """Remove um vínculo entre tarefa e kit pelo ID do vínculo."""
     conexao = obter_conexao_para_transacao()
@@ -1381,16 +2754,16 @@ def desvincular_kit_da_tarefa_db(vinculo_id):
         sql = "DELETE FROM tarefa_kits_vinculados WHERE id = %s"
         cursor.execute(sql, (vinculo_id,))
         conexao.commit()
-        st.cache_resource.clear()
+        invalidar_cache(("tarefa_kits_vinculados", None))
         return True, "Vínculo removido com sucesso."
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao remover vínculo: {e}"
     finally:
-        if conexao.is_connected(): conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
-def verificar_e_gerar_solicitacoes_db(obra_id, dias_antecedencia=2):
+@comando_escrita
+def verificar_e_gerar_solicitacoes_db(obra_id, dias_antecedencia=DIAS_ANTECEDENCIA_MONTAGEM):
     """
     Verifica as tarefas futuras e cria solicitações de montagem se ainda não existirem.
     Esta função atua como nosso "agendador".
@@ -1425,16 +2798,16 @@ def verificar_e_gerar_solicitacoes_db(obra_id, dias_antecedencia=2):
             valores_para_inserir = [(vinculo['id'], vinculo['data_inicio']) for vinculo in vinculos_para_solicitar]
             cursor.executemany(sql_insert, valores_para_inserir)
             conexao.commit()
+            invalidar_cache(("solicitacoes_montagem", obra_id))
             print(f"INFO: {len(valores_para_inserir)} nova(s) solicitação(ões) de montagem criada(s).")
 
     except Error as e:
         print(f"ERRO ao gerar solicitações de montagem: {e}")
         conexao.rollback()
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
-@st.cache_data(ttl=3600)
+@cache_leitura(ttl=3600, tags=lambda a: [("solicitacoes_montagem", a["obra_id"]), ("tarefa_kits_vinculados", a["obra_id"]), ("kits", a["obra_id"])])
 def buscar_solicitacoes_montagem_db(obra_id):
     """Busca as solicitações de montagem de kit que estão pendentes ou em andamento para uma obra."""
     conexao = conectar_mysql_leitura()
@@ -1459,7 +2832,7 @@ def buscar_solicitacoes_montagem_db(obra_id):
         st.error(f"Erro ao buscar solicitações de montagem: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+@comando_escrita
 def atualizar_status_solicitacao_db(solicitacao_id, novo_status):
     """Atualiza o status de uma solicitação de montagem."""
     conexao = obter_conexao_para_transacao()
@@ -1469,16 +2842,15 @@ def atualizar_status_solicitacao_db(solicitacao_id, novo_status):
         sql = "UPDATE solicitacoes_montagem SET status = %s WHERE id = %s"
         cursor.execute(sql, (novo_status, solicitacao_id))
         conexao.commit()
-        st.cache_resource.clear()
-        st.cache_data.clear()
+        invalidar_cache(("solicitacoes_montagem", None))
         return True, "Status atualizado com sucesso!"
     except Error as e:
         conexao.rollback()
         return False, f"Erro ao atualizar status: {e}"
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
+@comando_escrita
 def vincular_kit_a_multiplas_tarefas_db(lista_tarefa_ids, kit_id, quantidade):
     """
     Vincula um kit específico a uma lista de tarefas, evitando duplicatas.
@@ -1522,7 +2894,7 @@ def vincular_kit_a_multiplas_tarefas_db(lista_tarefa_ids, kit_id, quantidade):
         
         # Limpa os caches apenas se houve alguma alteração bem-sucedida
         if sucessos > 0:
-            st.cache_resource.clear()
+            invalidar_cache(("tarefa_kits_vinculados", None))
             st.session_state.verificacoes_rodaram = False
             mensagens.insert(0, f"{sucessos} kit(s) vinculados com sucesso!")
 
@@ -1532,8 +2904,7 @@ def vincular_kit_a_multiplas_tarefas_db(lista_tarefa_ids, kit_id, quantidade):
         conexao.rollback()
         return 0, [f"Erro geral ao vincular kits em lote: {e}"]
     finally:
-        if conexao.is_connected():
-            conexao.close()
+        liberar_conexao(conexao)
 
 #endregion
 
@@ -1608,6 +2979,9 @@ def render_estoque_materiais_page():
         st.session_state.filtros_materiais = {"nome": "", "categoria": "Todas"}
     if "pagina_atual_materiais" not in st.session_state:
         st.session_state.pagina_atual_materiais = 1
+    if "cursores_materiais" not in st.session_state:
+        # Chave (descricao ou relevancia, id) do último item de cada página anterior à atual
+        st.session_state.cursores_materiais = []
     if "ver_todos_materiais" not in st.session_state:
         st.session_state.ver_todos_materiais = False
     if 'itens_selecionados_ids' not in st.session_state:
@@ -1616,6 +2990,11 @@ def render_estoque_materiais_page():
         st.session_state.confirmando_exclusao = False
     if 'upload_processado' not in st.session_state:
         st.session_state.upload_processado = False
+    # Chaves de idempotência: uma por intenção de cadastro (trocadas após o sucesso)
+    if 'cad_material_chave' not in st.session_state:
+        st.session_state.cad_material_chave = nova_chave_idempotencia()
+    if 'upload_lote_chave' not in st.session_state:
+        st.session_state.upload_lote_chave = nova_chave_idempotencia()
 
     # --- Listas Dinâmicas ---
     UNIDADES_VALIDAS = buscar_unidades_unicas()
@@ -1637,6 +3016,12 @@ def render_estoque_materiais_page():
     
     def on_file_change():
         st.session_state.upload_processado = False
+        st.session_state.upload_lote_chave = nova_chave_idempotencia()
+        st.session_state.pop('codigos_existentes_upload', None)
+
+    def voltar_para_primeira_pagina():
+        st.session_state.pagina_atual_materiais = 1
+        st.session_state.cursores_materiais = []
 
     # --- Roteador de Páginas ---
 
@@ -1650,9 +3035,12 @@ def render_estoque_materiais_page():
         df_pagina, total_itens = buscar_materiais_paginados(
             obra_id=st.session_state.obra_selecionada_id,  # <-- ADICIONADO AQUI
             filtros=st.session_state.filtros_materiais,
-            pagina=st.session_state.pagina_atual_materiais,
+            apos=st.session_state.cursores_materiais[-1] if st.session_state.cursores_materiais else None,
             ver_todos=st.session_state.ver_todos_materiais
         )
+        if df_pagina.empty and st.session_state.cursores_materiais:
+            # A página atual ficou vazia (ex.: itens excluídos): recomeça do início
+            voltar_para_primeira_pagina(); st.rerun()
 
         with main_col:
             st.title("Estoque de Materiais")
@@ -1661,14 +3049,14 @@ def render_estoque_materiais_page():
             
             colf1, colf2, colf3 = st.columns([3, 1, 1])
             with colf1:
-                filtro_nome = st.text_input("Pesquisar por descrição", value=st.session_state.filtros_materiais['nome'], key="filtro_nome_materiais")
+                filtro_nome = st.text_input("Pesquisar por descrição ou código", value=st.session_state.filtros_materiais['nome'], key="filtro_nome_materiais")
             with colf2:
                 filtro_categoria = st.selectbox("Filtrar por Categoria", options=["Todas"] + CATEGORIAS_VALIDAS, key="filtro_cat_materiais")
             with colf3:
                 st.markdown("<div style='margin-top: 28px;'></div>", unsafe_allow_html=True)
                 if st.button("🔎 Buscar"):
                     st.session_state.filtros_materiais['nome'] = filtro_nome; st.session_state.filtros_materiais['categoria'] = filtro_categoria
-                    st.session_state.pagina_atual_materiais = 1; st.session_state.ver_todos_materiais = False
+                    voltar_para_primeira_pagina(); st.session_state.ver_todos_materiais = False
                     close_details_panel(); st.rerun()
             st.markdown("---")
             
@@ -1681,8 +3069,9 @@ def render_estoque_materiais_page():
                     st.write(f"Exibindo todos os **{total_itens}** materiais encontrados.")
                 col_nav_buttons = st.columns([2, 2, 3, 3, 3])
                 if col_nav_buttons[0].button("⬅️ Anterior", disabled=(st.session_state.pagina_atual_materiais == 1 or st.session_state.ver_todos_materiais), use_container_width=True):
-                    st.session_state.pagina_atual_materiais -= 1; close_details_panel(); st.rerun()
+                    st.session_state.cursores_materiais.pop(); st.session_state.pagina_atual_materiais -= 1; close_details_panel(); st.rerun()
                 if col_nav_buttons[1].button("Próxima ➡️", disabled=(st.session_state.pagina_atual_materiais >= total_paginas or st.session_state.ver_todos_materiais), use_container_width=True):
+                    st.session_state.cursores_materiais.append(cursor_apos_material(df_pagina.iloc[-1]))
                     st.session_state.pagina_atual_materiais += 1; close_details_panel(); st.rerun()
                 if not st.session_state.ver_todos_materiais:
                     if col_nav_buttons[2].button("Ver todos os resultados", key="ver_todos_btn", use_container_width=True):
@@ -1691,7 +3080,7 @@ def render_estoque_materiais_page():
                     if col_nav_buttons[2].button("Ver de forma paginada", use_container_width=True):
                         st.session_state.ver_todos_materiais = False; close_details_panel(); st.rerun()
                 if col_nav_buttons[3].button("🔄 Atualizar Lista", use_container_width=True):
-                    st.session_state.filtros_materiais = {"nome": "", "categoria": "Todas"}; st.session_state.ver_todos_materiais = False; st.session_state.pagina_atual_materiais = 1; close_details_panel(); st.rerun()
+                    st.session_state.filtros_materiais = {"nome": "", "categoria": "Todas"}; st.session_state.ver_todos_materiais = False; voltar_para_primeira_pagina(); close_details_panel(); st.rerun()
                 col_nav_buttons[4].button("➕ Novo Material", on_click=ir_para_cadastro, use_container_width=True)
                 st.markdown("---")
                 df_display = df_pagina.copy()
@@ -1753,8 +3142,8 @@ def render_estoque_materiais_page():
                     if not nome or not codigo or not unidade or not categoria:
                         st.warning("Nome, Código, Unidade e Categoria são campos obrigatórios.")
                     else:
-                        sucesso, msg = cadastrar_material_db(codigo, nome, unidade, categoria, estoque_minimo, estoque_maximo, observacoes)
-                        if sucesso: st.success(msg); st.balloons()
+                        sucesso, msg = cadastrar_material_db(codigo, nome, unidade, categoria, estoque_minimo, estoque_maximo, observacoes, chave_idempotencia=st.session_state.cad_material_chave)
+                        if sucesso: st.success(msg); st.balloons(); st.session_state.cad_material_chave = nova_chave_idempotencia()
                         else: st.error(msg)
         with tab_lote:
             st.info("Faça o download do modelo, preencha e envie o arquivo para cadastro em massa.")
@@ -1767,25 +3156,30 @@ def render_estoque_materiais_page():
                 try:
                     upload_df = pd.read_excel(uploaded_file, dtype={'codigo': str})
                     upload_df.dropna(how='all', inplace=True)
-                    upload_df.dropna(subset=['codigo', 'descricao'], inplace=True)
-                    upload_df['codigo'] = upload_df['codigo'].str.strip()
                     if not upload_df.empty:
-                        colunas_obrigatorias = ['codigo', 'descricao', 'unidade', 'categoria']
-                        upload_df['erros_validacao'] = upload_df.apply(lambda row: ', '.join([col for col in colunas_obrigatorias if pd.isna(row[col]) or str(row[col]).strip() == '']), axis=1)
-                        materiais_invalidos_campos = upload_df[upload_df['erros_validacao'] != ''].copy()
-                        materiais_validos_campos = upload_df[upload_df['erros_validacao'] == ''].copy()
-                        codigos_existentes = buscar_todos_codigos_materiais()
-                        df_duplicados = materiais_validos_campos[materiais_validos_campos['codigo'].isin(codigos_existentes)]
-                        df_para_processar = materiais_validos_campos[~materiais_validos_campos['codigo'].isin(codigos_existentes)]
-                        df_para_processar['unidade_valida'] = df_para_processar['unidade'].isin(UNIDADES_VALIDAS)
-                        df_para_processar['categoria_valida'] = df_para_processar['categoria'].isin(CATEGORIAS_VALIDAS)
-                        df_validos = df_para_processar[df_para_processar['unidade_valida'] & df_para_processar['categoria_valida']]
-                        df_para_revisao = df_para_processar[~(df_para_processar['unidade_valida'] & df_para_processar['categoria_valida'])]
+                        upload_df = validar_planilha_materiais(upload_df, UNIDADES_VALIDAS, CATEGORIAS_VALIDAS)
+                        materiais_invalidos_campos = upload_df[upload_df['erros_validacao'] != '']
+                        materiais_validos_campos = upload_df[upload_df['erros_validacao'] == '']
+                        # A checagem grava (e desfaz) na área de preparo: roda uma vez por arquivo, não a cada rerun da tela
+                        hash_arquivo = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+                        verificacao = st.session_state.get('codigos_existentes_upload')
+                        if verificacao is None or verificacao[0] != hash_arquivo:
+                            codigos_existentes, erro_codigos = buscar_codigos_existentes_db(materiais_validos_campos['codigo'].tolist())
+                            if not erro_codigos: st.session_state.codigos_existentes_upload = (hash_arquivo, codigos_existentes)
+                        else:
+                            codigos_existentes, erro_codigos = verificacao[1], None
+                        if erro_codigos: st.error(erro_codigos) # A importação ainda recusa códigos repetidos no banco
+                        ja_cadastrado = materiais_validos_campos['codigo'].isin(codigos_existentes)
+                        df_duplicados = materiais_validos_campos[ja_cadastrado]
+                        df_para_processar = materiais_validos_campos[~ja_cadastrado]
+                        termos_validos = df_para_processar['unidade_valida'] & df_para_processar['categoria_valida']
+                        df_validos = df_para_processar[termos_validos]
+                        df_para_revisao = df_para_processar[~termos_validos]
                         st.markdown("---"); st.subheader("Análise da Planilha")
                         if not df_duplicados.empty: st.warning(f"**{len(df_duplicados)} materiais ignorados por já possuírem código cadastrado:**"); st.dataframe(df_duplicados[['codigo', 'descricao']])
-                        if not materiais_invalidos_campos.empty: st.error(f"**{len(materiais_invalidos_campos)} materiais inválidos (campos obrigatórios faltando):**"); st.dataframe(materiais_invalidos_campos[['codigo', 'descricao', 'erros_validacao']])
-                        novas_unidades = df_para_revisao[~df_para_revisao['unidade'].isin(UNIDADES_VALIDAS)]['unidade'].dropna().unique().tolist()
-                        novas_categorias = df_para_revisao[~df_para_revisao['categoria'].isin(CATEGORIAS_VALIDAS)]['categoria'].dropna().unique().tolist()
+                        if not materiais_invalidos_campos.empty: st.error(f"**{len(materiais_invalidos_campos)} materiais inválidos:**"); st.dataframe(materiais_invalidos_campos[['codigo', 'descricao', 'erros_validacao']])
+                        novas_unidades = df_para_revisao.loc[~df_para_revisao['unidade_valida'], 'unidade'].dropna().unique().tolist()
+                        novas_categorias = df_para_revisao.loc[~df_para_revisao['categoria_valida'], 'categoria'].dropna().unique().tolist()
                         unidades_aprovadas, categorias_aprovadas = [], []
                         if novas_unidades or novas_categorias:
                             st.info("Encontramos novos termos. Selecione quais deseja adicionar ao sistema.")
@@ -1803,12 +3197,11 @@ def render_estoque_materiais_page():
                                 for und_aprovada in unidades_aprovadas: edited_df_revisao.loc[edited_df_revisao['unidade'] == und_aprovada, 'unidade'] = und_aprovada
                                 df_para_cadastrar = pd.concat([df_para_cadastrar, edited_df_revisao], ignore_index=True)
                             if not df_para_cadastrar.empty:
-                                with st.spinner("Cadastrando..."): sucessos, erros, mensagens_erro = cadastrar_materiais_em_lote_db(df_para_cadastrar)
+                                with st.spinner("Cadastrando..."): sucessos, erros, mensagens_erro = cadastrar_materiais_em_lote_db(df_para_cadastrar, UNIDADES_VALIDAS + unidades_aprovadas, CATEGORIAS_VALIDAS + categorias_aprovadas, chave_idempotencia=st.session_state.upload_lote_chave)
                                 st.success(f"{sucessos} materiais cadastrados com sucesso!")
                                 if erros > 0:
                                     st.error(f"{erros} materiais não puderam ser cadastrados."); 
                                     for msg in mensagens_erro: st.code(msg, language=None)
-                                if sucessos > 0: st.cache_data.clear()
                                 st.session_state.upload_processado = True; st.rerun()
                             else: st.warning("Nenhum material válido para cadastrar.")
                 except Exception as e: st.error(f"Erro ao processar o arquivo: {e}")
@@ -1941,6 +3334,59 @@ def limpar_formulario_mov():
         st.session_state.mov_recebedor = ""
         st.session_state.mov_obra_destino_nome = None
         st.session_state.mov_observacoes = ""
+        st.session_state.mov_chave_idempotencia = nova_chave_idempotencia()
+
+def render_lancamento_em_lote(obra_id, usuario_id, df_materiais):
+    """Grade editável com várias linhas de Entrada/Saída, gravadas numa única transação."""
+    if 'lote_chave_idempotencia' not in st.session_state: st.session_state.lote_chave_idempotencia = nova_chave_idempotencia()
+    if 'lote_versao_editor' not in st.session_state: st.session_state.lote_versao_editor = 0
+
+    materiais_por_display = df_materiais.set_index('display')[['id', 'descricao']].to_dict('index') if not df_materiais.empty else {}
+    cols = st.columns([1, 1, 1])
+    tipo = cols[0].selectbox("Tipo*", ["Entrada", "Saída"], key="lote_tipo")
+    data_lote = datetime.combine(
+        cols[1].date_input("Data*", value=datetime.now(), key="lote_data"),
+        cols[2].time_input("Hora*", value=datetime.now().time(), key="lote_hora")
+    )
+    cols = st.columns(2)
+    fornecedor = cols[0].text_input("Fornecedor / Origem", key="lote_fornecedor")
+    recebedor = cols[1].text_input("Recebedor / Destino", key="lote_recebedor")
+
+    # Trocar a key do editor após salvar é o que limpa a grade
+    df_linhas = st.data_editor(
+        pd.DataFrame({"material": pd.Series(dtype="str"), "quantidade": pd.Series(dtype="float")}),
+        num_rows="dynamic", use_container_width=True, hide_index=True,
+        key=f"editor_lote_{st.session_state.lote_versao_editor}",
+        column_config={
+            "material": st.column_config.SelectboxColumn("Material*", options=list(materiais_por_display), required=True, width="large"),
+            "quantidade": st.column_config.NumberColumn("Quantidade*", min_value=0.0001, format="%.4f", required=True),
+        },
+    )
+    observacoes = st.text_area("Observações", key="lote_observacoes")
+
+    if st.button("✅ Registrar Lote", type="primary"):
+        df_validas = df_linhas.dropna(how="all")
+        if df_validas.empty:
+            st.warning("Adicione ao menos uma linha.")
+        elif df_validas['material'].isna().any() or not (df_validas['quantidade'] > 0).all():
+            st.warning("Todas as linhas precisam de material e quantidade maior que zero.")
+        else:
+            linhas = [
+                {"material_id": int(materiais_por_display[material]['id']), "descricao": materiais_por_display[material]['descricao'], "quantidade": float(quantidade)}
+                for material, quantidade in df_validas[['material', 'quantidade']].itertuples(index=False)
+            ]
+            sucesso, msg = registrar_movimentacoes_em_lote_db(
+                obra_id, usuario_id, tipo, data_lote, linhas,
+                fornecedor=fornecedor or None, recebedor=recebedor or None, observacoes=observacoes,
+                chave_idempotencia=st.session_state.lote_chave_idempotencia
+            )
+            if sucesso:
+                st.success(msg)
+                st.session_state.lote_chave_idempotencia = nova_chave_idempotencia()
+                st.session_state.lote_versao_editor += 1
+                st.rerun()
+            else:
+                st.error(msg)
 
 def render_relatar_movimentacao_page():
 
@@ -1960,6 +3406,7 @@ def render_relatar_movimentacao_page():
     if 'mov_recebedor' not in st.session_state: st.session_state.mov_recebedor = ""
     if 'mov_obra_destino_nome' not in st.session_state: st.session_state.mov_obra_destino_nome = None
     if 'mov_observacoes' not in st.session_state: st.session_state.mov_observacoes = ""
+    if 'mov_chave_idempotencia' not in st.session_state: st.session_state.mov_chave_idempotencia = nova_chave_idempotencia()
 
     obra_id = st.session_state.obra_selecionada_id
     usuario_id = st.session_state.usuario_id
@@ -1976,6 +3423,9 @@ def render_relatar_movimentacao_page():
     if st.session_state.pagina_mov == "lancamento":
         st.title("Registrar Movimentação")
 
+        with st.expander("📦 Lançamento em lote (várias linhas numa única operação)"):
+            render_lancamento_em_lote(obra_id, usuario_id, buscar_materiais_para_selecao())
+
         col1, col2 = st.columns([1, 1])
         with col1:
 
@@ -2015,12 +3465,10 @@ def render_relatar_movimentacao_page():
                 }
 
                 # 3. Execução da transação no banco
-                sucesso, msg = registrar_movimentacao_db(obra_id, usuario_id, dados_mov)
+                sucesso, msg = registrar_movimentacao_db(obra_id, usuario_id, dados_mov, chave_idempotencia=st.session_state.mov_chave_idempotencia)
                 if sucesso:
                     st.success(msg)
                     limpar_formulario_mov() # Limpa o formulário SE for um sucesso
-                    st.cache_resource.clear()
-                    st.cache_data.clear()
                     st.rerun()
                 else:
                     st.error(msg)
@@ -2100,10 +3548,11 @@ def render_relatar_movimentacao_page():
                             "obra_origem_id": obra_id, 
                             "obra_destino_id": obra_destino_id
                         }
-                        sucesso, msg = registrar_movimentacao_db(obra_id, usuario_id, dados_mov)
+                        sucesso, msg = registrar_movimentacao_db(obra_id, usuario_id, dados_mov, chave_idempotencia=st.session_state.mov_chave_idempotencia)
 
                         if sucesso:
                             st.success(msg)
+                            st.session_state.mov_chave_idempotencia = nova_chave_idempotencia()
                             st.session_state.limpar_form_agora = True
                             st.rerun()
                         else:
@@ -2130,7 +3579,7 @@ def render_relatar_movimentacao_page():
                     st.warning(f"Tem certeza que deseja estornar a movimentação de **{row['descricao']}**?")
                     c1, c2 = st.columns(2)
                     if c1.button("Sim, tenho certeza", key=f"conf_est_{row['id']}", type="primary"):
-                        sucesso, msg = criar_movimentacao_estorno_db(row['id'], usuario_id)
+                        sucesso, msg = criar_movimentacao_estorno_db(row['id'], usuario_id, chave_idempotencia=f"estorno-{row['id']}")
                         if sucesso: st.success(msg)
                         else: st.error(msg)
                         st.session_state.mov_para_estornar_id = None
@@ -2147,25 +3596,30 @@ def render_relatar_movimentacao_page():
         st.write("#### Ferramentas de Busca")
         tipos_disponiveis = ["Entrada", "Saída"]
         
-        cols_filtro = st.columns([1, 1, 2, 1, 1])
+        df_materiais_filtro = buscar_materiais_para_selecao()
+        opcoes_material = {int(mid): nome for mid, nome in zip(df_materiais_filtro['id'], df_materiais_filtro['display'])} if not df_materiais_filtro.empty else {}
+        cols_filtro = st.columns([1, 1, 2, 2, 1, 1])
         with cols_filtro[0]:
             data_inicio_input = st.date_input("Data Inicial", value=None)
         with cols_filtro[1]:
             data_fim_input = st.date_input("Data Final", value=None)
         with cols_filtro[2]:
             tipos_selecionados_input = st.multiselect("Filtrar por Tipo", options=tipos_disponiveis)
-        
         with cols_filtro[3]:
+            material_filtro_input = st.selectbox("Filtrar por Material", options=list(opcoes_material), format_func=opcoes_material.get, index=None, placeholder="Todos")
+        
+        with cols_filtro[4]:
             st.markdown("<div><br></div>", unsafe_allow_html=True)
             if st.button("Aplicar Filtros", use_container_width=True, type="primary"):
                 st.session_state.filtros_historico = {
                     'data_inicio': data_inicio_input,
                     'data_fim': data_fim_input,
-                    'tipos_transacao': tipos_selecionados_input
+                    'tipos_transacao': tipos_selecionados_input,
+                    'material_id': material_filtro_input
                 }
                 st.rerun()
 
-        with cols_filtro[4]:
+        with cols_filtro[5]:
             st.markdown("<div><br></div>", unsafe_allow_html=True)
             if st.button("Limpar Filtros", use_container_width=True):
                 st.session_state.filtros_historico = {}
@@ -2173,15 +3627,80 @@ def render_relatar_movimentacao_page():
 
         st.markdown("---")
         filtros_ativos = st.session_state.get('filtros_historico', {})
-        df_historico = buscar_historico_db(
-            obra_id, 
-            data_inicio=filtros_ativos.get('data_inicio'), 
-            data_fim=filtros_ativos.get('data_fim'), 
-            tipos_transacao=filtros_ativos.get('tipos_transacao')
+        filtros_consulta = {
+            'data_inicio': filtros_ativos.get('data_inicio'),
+            'data_fim': filtros_ativos.get('data_fim'),
+            'tipos_transacao': filtros_ativos.get('tipos_transacao') or None,
+            'material_id': filtros_ativos.get('material_id'),
+        }
+        # Só a página visível vem do banco; a pilha guarda o (data, id) do fim de cada página anterior
+        if st.session_state.get('cursores_historico_filtros') != filtros_consulta:
+            st.session_state.cursores_historico = []
+            st.session_state.cursores_historico_filtros = filtros_consulta
+        cursores = st.session_state.cursores_historico
+        itens_por_pagina = 50
+
+        total_registros = contar_historico_db(obra_id, **filtros_consulta)
+        df_historico = buscar_pagina_historico_db(
+            obra_id,
+            apos=cursores[-1] if cursores else None,
+            itens_por_pagina=itens_por_pagina,
+            **filtros_consulta
         )
 
-        st.markdown(f"**{len(df_historico)} registros encontrados.**")
-        st.dataframe(df_historico, use_container_width=True)
+        pagina_atual = len(cursores) + 1
+        total_paginas = max(1, (total_registros + itens_por_pagina - 1) // itens_por_pagina)
+        st.markdown(f"**{total_registros} registros encontrados.** Página **{pagina_atual}** de **{total_paginas}**.")
+        if not df_historico.empty:
+            st.dataframe(df_historico.drop(columns=['data']), use_container_width=True, hide_index=True)
+
+        col_ant, col_prox, _ = st.columns([1, 1, 4])
+        if col_ant.button("⬅️ Anterior", key="hist_anterior", disabled=not cursores, use_container_width=True):
+            cursores.pop(); st.rerun()
+        if col_prox.button("Próxima ➡️", key="hist_proxima", disabled=(pagina_atual >= total_paginas or len(df_historico) < itens_por_pagina), use_container_width=True):
+            cursores.append(cursor_apos_historico(df_historico.iloc[-1])); st.rerun()
+
+        with st.expander("📤 Exportar histórico filtrado"):
+            # O arquivo é gerado só ao clicar e lido uma única vez pelo botão de download
+            # (o Streamlit guarda os bytes até a próxima execução); o temporário é apagado
+            # logo em seguida e nada fica na sessão. on_click="ignore": baixar não reexecuta
+            # o script, então o botão continua disponível até a próxima interação.
+            col_formato, col_gerar = st.columns([2, 1])
+            formato = col_formato.radio("Formato", ["csv", "xlsx"], horizontal=True, key="formato_exportacao_historico")
+            if col_gerar.button("Gerar arquivo", use_container_width=True):
+                with st.spinner("Exportando movimentações..."):
+                    sucesso, resultado = exportar_historico_arquivo(obra_id, formato, **filtros_consulta)
+                if sucesso:
+                    mime = "text/csv" if formato == "csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    try:
+                        with open(resultado, "rb") as arquivo:
+                            st.download_button(
+                                label=f"📄 Baixar {formato.upper()}",
+                                data=arquivo,
+                                file_name=f"historico_obra_{obra_id}_{datetime.now():%Y%m%d}.{formato}",
+                                mime=mime,
+                                on_click="ignore",
+                            )
+                    finally:
+                        os.remove(resultado)
+                else:
+                    st.error(resultado)
+
+        with st.expander("📅 Estoque em uma data"):
+            col_data, col_material = st.columns([1, 2])
+            data_posicao = col_data.date_input("Posição ao fim do dia", value=None, key="data_posicao_estoque", format="DD/MM/YYYY")
+            material_posicao = col_material.selectbox("Material", options=list(opcoes_material), format_func=opcoes_material.get, index=None, placeholder="Todos", key="material_posicao_estoque")
+            if data_posicao:
+                # Fim do dia = antes da meia-noite seguinte (mesmo intervalo semiaberto do histórico)
+                momento = datetime.combine(data_posicao, datetime.min.time()) + timedelta(days=1)
+                df_posicao = calcular_estoque_em_db(obra_id, momento, material_posicao)
+                sem_material = contar_movimentacoes_sem_material_db(obra_id, momento)
+                if sem_material:
+                    st.warning(f"{sem_material} movimentação(ões) antigas sem material identificado não entram nestes saldos; materiais com descrição repetida podem aparecer com saldo diferente do real.")
+                if df_posicao.empty:
+                    st.info("Sem saldo de materiais nesta data.")
+                else:
+                    st.dataframe(df_posicao.drop(columns=['material_id']), use_container_width=True, hide_index=True)
         
         st.button("⬅️ Voltar para Lançamentos", on_click=ir_para_lancamento)
 
@@ -2244,6 +3763,7 @@ def render_kits_cadastrados_page():
     # --- Funções de Navegação Interna ---
     def ir_para_cadastro():
         st.session_state.kit_materiais_temp = []
+        st.session_state.kit_cadastro_chave = nova_chave_idempotencia()
         st.session_state.pagina_kits = 'cadastrar'
 
     def ir_para_edicao(kit_id):
@@ -2354,7 +3874,7 @@ def render_kits_cadastrados_page():
                 elif not st.session_state.kit_materiais_temp:
                     st.error("Adicione pelo menos um material ao kit.")
                 else:
-                    sucesso, msg = salvar_kit_completo_db(obra_id, nome_kit, desc_kit, st.session_state.kit_materiais_temp)
+                    sucesso, msg = salvar_kit_completo_db(obra_id, nome_kit, desc_kit, st.session_state.kit_materiais_temp, chave_idempotencia=st.session_state.get('kit_cadastro_chave'))
                     if sucesso:
                         st.success(msg)
                         st.session_state.operacao_concluida = "kit_salvo"
@@ -2486,13 +4006,13 @@ def render_central_de_transferencias_page():
                 with cols[4]:
                     c_btn1, c_btn2 = st.columns(2)
                     if c_btn1.button("Aprovar ✅", key=f"apv_{row['id']}", use_container_width=True):
-                        sucesso, msg = processar_transacao_db(row['id'], 'Aprovada', usuario_id)
+                        sucesso, msg = processar_transacao_db(row['id'], 'Aprovada', usuario_id, chave_idempotencia=f"transacao-{row['id']}-Aprovada")
                         if sucesso: st.success(msg)
                         else: st.error(msg)
                         st.rerun()
 
                     if c_btn2.button("Recusar ❌", key=f"rec_{row['id']}", use_container_width=True):
-                        sucesso, msg = processar_transacao_db(row['id'], 'Recusada', usuario_id)
+                        sucesso, msg = processar_transacao_db(row['id'], 'Recusada', usuario_id, chave_idempotencia=f"transacao-{row['id']}-Recusada")
                         if sucesso: st.warning(msg)
                         else: st.error(msg)
                         st.rerun()
@@ -2514,7 +4034,7 @@ def render_central_de_transferencias_page():
                 cols[3].caption(f"Enviado em:")
                 cols[3].caption(row['data_solicitacao'])
                 if cols[4].button("Cancelar ⚠️", key=f"canc_env_{row['id']}", use_container_width=True):
-                    sucesso, msg = processar_transacao_db(row['id'], 'Cancelada', usuario_id)
+                    sucesso, msg = processar_transacao_db(row['id'], 'Cancelada', usuario_id, chave_idempotencia=f"transacao-{row['id']}-Cancelada")
                     if sucesso: st.warning(msg)
                     else: st.error(msg)
                     st.rerun()
@@ -2612,13 +4132,13 @@ def render_planejamento_page():
     df_todos_vinculos = buscar_todos_vinculos_da_obra_db(obra_id)
 
     # --- SEÇÃO 1: UPLOAD DO ARQUIVO (código existente) ---
-    st.subheader("Importar/Atualizar Planejamento (.xlsx)")
+    st.subheader("Importar/Atualizar Planejamento (.xlsx ou .xml)")
     # ... (o seu código do file_uploader continua aqui, sem alterações) ...
     if 'plan_file' not in st.session_state:
         st.session_state.plan_file = None
     uploaded_file = st.file_uploader(
-        "Selecione o arquivo Excel exportado do MS Project",
-        type=["xlsx"],
+        "Selecione o arquivo Excel ou XML exportado do MS Project",
+        type=["xlsx", "xml"],
         key=str(st.session_state.get('plan_file', ''))
     )
     if uploaded_file is not None:
@@ -2626,24 +4146,37 @@ def render_planejamento_page():
     if st.session_state.plan_file is not None:
         if st.button("Processar Arquivo"):
             with st.spinner("Comparando e atualizando planejamento..."):
-                sucesso, relatorio = ler_e_salvar_tarefas_excel(st.session_state.plan_file, obra_id)
+                if st.session_state.plan_file.name.lower().endswith(".xml"):
+                    sucesso, relatorio = ler_e_salvar_tarefas_mspdi(st.session_state.plan_file, obra_id)
+                else:
+                    sucesso, relatorio = ler_e_salvar_tarefas_excel(st.session_state.plan_file, obra_id)
             if sucesso:
-                st.success("Planejamento atualizado com sucesso!")
-                if relatorio["adicionadas"]:
-                    with st.expander(f"✅ {len(relatorio['adicionadas'])} Tarefas Adicionadas"):
-                        for tarefa in relatorio["adicionadas"]: st.write(f"- {tarefa}")
-                if relatorio["removidas"]:
-                    with st.expander(f"❌ {len(relatorio['removidas'])} Tarefas Removidas"):
-                        for tarefa in relatorio["removidas"]: st.write(f"- {tarefa}")
-                if relatorio["modificadas"]:
-                    with st.expander(f"✏️ {len(relatorio['modificadas'])} Tarefas Modificadas"):
-                        for tarefa in relatorio["modificadas"]: st.write(f"- {tarefa}")
+                # O relatório sobrevive ao rerun que limpa o upload
+                st.session_state.relatorio_planejamento = relatorio
                 st.session_state.plan_file = None
                 st.rerun()
             else:
                 st.error(relatorio, icon="🚨")
+    relatorio = st.session_state.pop('relatorio_planejamento', None)
+    if relatorio:
+        st.success("Planejamento atualizado com sucesso!")
+        if relatorio["ignoradas"]:
+            st.warning(f"{len(relatorio['ignoradas'])} tarefa(s) ignorada(s) por data de início em branco ou em formato não reconhecido; as que já existiam foram mantidas como estavam.")
+            with st.expander(f"⚠️ {len(relatorio['ignoradas'])} Tarefas Ignoradas"):
+                for tarefa in relatorio["ignoradas"]: st.write(f"- {tarefa}")
+        if relatorio["adicionadas"]:
+            with st.expander(f"✅ {len(relatorio['adicionadas'])} Tarefas Adicionadas"):
+                for tarefa in relatorio["adicionadas"]: st.write(f"- {tarefa}")
+        if relatorio["removidas"]:
+            with st.expander(f"❌ {len(relatorio['removidas'])} Tarefas Removidas"):
+                for tarefa in relatorio["removidas"]: st.write(f"- {tarefa}")
+        if relatorio["modificadas"]:
+            with st.expander(f"✏️ {len(relatorio['modificadas'])} Tarefas Modificadas"):
+                for tarefa in relatorio["modificadas"]: st.write(f"- {tarefa}")
 
     st.info("""
+        **Dica:** O XML do MS Project (Arquivo > Salvar como > Formato XML) já traz o ID exclusivo e é lido mais rápido.
+
         **Atenção:** Verifique se a coluna 'Id_exclusiva' existe em seu MSProject antes de exportar para Excel.
         Caso não, é simples. No MS Project:
         1. Clique com o botão direito no cabeçalho de qualquer coluna (ex: 'Nome da Tarefa').
@@ -2669,10 +4202,11 @@ def render_planejamento_page():
             placeholder="Digite parte do nome da tarefa..."
         )
 
-        # Aplica o filtro
+        # Aplica o filtro sobre a chave normalizada (sem acentos/maiúsculas, texto literal)
+        termo_tarefa = normalizar_busca(st.session_state.filtro_tarefa_lote)
         df_tarefas_filtradas = df_tarefas_all[
-            df_tarefas_all['nome_tarefa'].str.contains(st.session_state.filtro_tarefa_lote, case=False, na=False)
-        ]
+            df_tarefas_all['nome_tarefa_busca'].str.contains(termo_tarefa, regex=False, na=False)
+        ] if termo_tarefa else df_tarefas_all
 
         # --- Preparação do DataFrame para o Editor ---
         df_display = df_tarefas_filtradas[['id', 'nome_tarefa', 'data_inicio_fmt']].copy()
@@ -2796,6 +4330,61 @@ def render_planejamento_page():
 
 #region render_main_app
 
+def render_conciliacao_estoque():
+    """Barra lateral (apenas administradores): confere estoque_obra contra o livro de movimentações."""
+    if not usuario_admin():
+        return
+    with st.sidebar.expander("🧮 Conciliação de estoque"):
+        todas_obras = st.checkbox("Todas as obras", key="conciliacao_todas_obras")
+        if st.button("Verificar divergências", use_container_width=True):
+            obra_alvo = None if todas_obras else st.session_state.obra_selecionada_id
+            inicio = time.perf_counter()
+            divergencias, sem_material = calcular_divergencias_estoque_db(obra_alvo)
+            st.session_state.conciliacao_estoque = {
+                "divergencias": divergencias, "sem_material": sem_material,
+                "segundos": time.perf_counter() - inicio,
+            }
+        resultado = st.session_state.get("conciliacao_estoque")
+        if not resultado or resultado["divergencias"] is None:
+            return
+        divergencias = resultado["divergencias"]
+        st.caption(f"Conciliado em {resultado['segundos']:.1f}s.")
+        if resultado["sem_material"]:
+            st.warning(
+                f"{resultado['sem_material']} movimentação(ões) sem material identificado ficaram fora da conta. "
+                "Enquanto existirem, os saldos não podem ser corrigidos pelo livro."
+            )
+        if divergencias.empty:
+            st.success("Estoque confere com o livro de movimentações.")
+            return
+        st.error(f"{len(divergencias)} saldo(s) divergente(s).")
+        st.dataframe(divergencias, hide_index=True, use_container_width=True)
+        corrigiveis = int((~divergencias["sem_movimentacoes"]).sum())
+        if corrigiveis < len(divergencias):
+            st.info(f"{len(divergencias) - corrigiveis} saldo(s) sem nenhuma movimentação no livro (carga inicial?) não serão alterados.")
+        if resultado["sem_material"] or not corrigiveis:
+            return
+        confirmado = st.checkbox(f"Confirmo a substituição de {corrigiveis} saldo(s) pelo valor do livro", key="confirmar_correcao_estoque")
+        if st.button("Corrigir saldos pelo livro", type="primary", use_container_width=True, disabled=not confirmado):
+            sucesso, msg = corrigir_divergencias_estoque_db(divergencias)
+            if sucesso:
+                st.session_state.conciliacao_estoque = None
+                st.success(msg)
+            else:
+                st.error(msg)
+
+def render_checkpoints_estoque():
+    """Barra lateral (apenas administradores): gera os checkpoints mensais de saldo."""
+    if not usuario_admin():
+        return
+    with st.sidebar.expander("📅 Checkpoints de estoque"):
+        st.caption("Saldos mensais usados para consultar o estoque em datas passadas.")
+        if st.button("Gerar checkpoints pendentes", use_container_width=True):
+            with st.spinner("Gerando checkpoints..."):
+                sucesso, msg = gerar_checkpoints_estoque_db()
+            if sucesso: st.success(msg)
+            else: st.error(msg)
+
 def render_main_app():
     # Verifica se já rodamos as verificações nesta sessão
     if 'verificacoes_rodaram' not in st.session_state:
@@ -2845,7 +4434,8 @@ def render_main_app():
 
             with col_button:
                 if st.button("🔄 Atualizar Notificações", type="primary"):
-                    st.cache_data.clear()
+                    # Recarrega apenas as listas desta obra
+                    invalidar_cache(("notificacoes_compra", obra_id), ("solicitacoes_montagem", obra_id))
                     # Chama as funções de verificação usando o ID da obra que já está na sessão
                     verificar_e_gerar_notificacoes_compra(st.session_state.obra_selecionada_id)
                     verificar_e_gerar_solicitacoes_db(st.session_state.obra_selecionada_id)
@@ -2906,11 +4496,21 @@ def render_main_app():
         elif opcao == "PRAZOS DE COMPRA":
             render_prazos_compra_page()
 
+    render_conciliacao_estoque()
+    render_checkpoints_estoque()
+    # Painel de SQL por último, para somar todas as consultas desta execução
+    render_painel_sql()
         
 #endregion
 
 if 'usuario_logado' not in st.session_state: st.session_state.usuario_logado = False
-if not st.session_state.usuario_logado: 
-    render_login_page()
-else: 
-    render_main_app()
\ No newline at end of file
+iniciar_metricas_execucao()
+try:
+    if not st.session_state.usuario_logado: 
+        render_login_page()
+    else: 
+        render_main_app()
+finally:
+    # Devolve ao pool a conexão de leitura desta execução (também em st.rerun/st.stop)
+    liberar_conexao_leitura()
+    finalizar_metricas_execucao()
\ No newline at end of file
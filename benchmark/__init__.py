@@ -0,0 +1,20 @@
+"""
+Benchmark do app de almoxarifado.
+
+Cria o esquema que o app.py espera num MySQL descartável, preenche as
+tabelas com dados sintéticos em escala configurável e mede cada função
+buscar_*/registrar_* e cada página do menu (render_*_page) com o AppTest do
+Streamlit, gravando relatórios JSON/CSV comparáveis entre commits.
+
+Uso (a partir da raiz do repositório):
+
+    python -m benchmark carregar --servidor-local --escala grande
+    python -m benchmark executar --servidor-local --repeticoes 5
+    python -m benchmark planos --servidor-local
+    python -m benchmark comparar .benchmark/relatorios/A.json .benchmark/relatorios/B.json
+
+--servidor-local sobe um mysqld (ou contêiner Docker do MySQL 8.4) com
+os dados em .benchmark/servidor; sem ele, informe um servidor existente com
+--host/--porta/--usuario/--senha. O banco usado é sempre --banco
+(padrão almoxarifado_benchmark), nunca o de produção.
+"""
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import os
+import sys
+
+from . import __doc__ as DESCRICAO
+from .casos import carregar_contexto, funcoes_sem_caso
+from .gerador import ESCALAS, aplicar_migracoes, criar_esquema, popular_banco
+from .medicao import comparar_relatorios, executar_benchmark, imprimir_relatorio, salvar_relatorio
+from .planos import imprimir_planos, verificar_planos
+from .servidor import BANCO_PADRAO, ServidorLocal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMINHO_APP = os.path.join(RAIZ, "app.py")
+DIRETORIO_BENCHMARK = os.path.join(RAIZ, ".benchmark")
+
+
+def _argumentos():
+    conexao = argparse.ArgumentParser(add_help=False)
+    conexao.add_argument("--servidor-local", action="store_true", help="sobe um MySQL próprio em .benchmark/servidor")
+    conexao.add_argument("--host", default="127.0.0.1")
+    conexao.add_argument("--porta", type=int, default=3307)
+    conexao.add_argument("--usuario", default="root")
+    conexao.add_argument("--senha", default="")
+    conexao.add_argument("--banco", default=BANCO_PADRAO)
+
+    escala = argparse.ArgumentParser(add_help=False)
+    escala.add_argument("--escala", choices=sorted(ESCALAS), default="pequena")
+    for chave in ESCALAS["pequena"]:
+        escala.add_argument(f"--{chave.replace('_', '-')}", type=int, dest=chave, help=f"sobrescreve '{chave}' da escala")
+    escala.add_argument("--semente", type=int, default=42)
+
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description=DESCRICAO, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("carregar", parents=[conexao, escala], help="recria o banco e gera os dados sintéticos")
+
+    executar = comandos.add_parser("executar", parents=[conexao, escala], help="mede funções e páginas e grava o relatório")
+    executar.add_argument("--carregar", action="store_true", help="recria e popula o banco antes de medir")
+    executar.add_argument("--repeticoes", type=int, default=5)
+    executar.add_argument("--filtro", help="expressão regular sobre o nome do caso")
+    executar.add_argument("--sem-funcoes", action="store_true")
+    executar.add_argument("--sem-paginas", action="store_true")
+    executar.add_argument("--saida", default=os.path.join(DIRETORIO_BENCHMARK, "relatorios"))
+
+    comandos.add_parser("planos", parents=[conexao], help="confere com EXPLAIN se as consultas usam os índices declarados")
+
+    comparar = comandos.add_parser("comparar", help="compara dois relatórios JSON")
+    comparar.add_argument("base")
+    comparar.add_argument("novo")
+    comparar.add_argument("--limite", type=float, default=10.0, help="variação (%%) considerada regressão")
+    return parser.parse_args()
+
+
+def _carregar(args, parametros):
+    escala = {chave: getattr(args, chave) or valor for chave, valor in ESCALAS[args.escala].items()}
+    print(f"Criando o banco '{args.banco}' com {escala}")
+    criar_esquema(parametros, args.banco, recriar=True)
+    popular_banco(parametros, escala, args.banco, semente=args.semente)
+    aplicar_migracoes(parametros, args.banco)
+
+
+def main():
+    args = _argumentos()
+    if args.comando == "comparar":
+        return 1 if comparar_relatorios(args.base, args.novo, args.limite) else 0
+
+    os.chdir(RAIZ) # O app abre arquivos de assets/ por caminho relativo
+    with contextlib.ExitStack() as pilha:
+        if args.servidor_local:
+            servidor = pilha.enter_context(ServidorLocal(os.path.join(DIRETORIO_BENCHMARK, "servidor"), args.porta))
+            parametros = servidor.parametros
+        else:
+            parametros = {"host": args.host, "port": args.porta, "user": args.usuario, "password": args.senha}
+
+        if args.comando == "carregar" or getattr(args, "carregar", False):
+            _carregar(args, parametros)
+        if args.comando == "carregar":
+            return 0
+
+        if args.comando == "planos":
+            contexto = carregar_contexto(parametros, args.banco)
+            return 0 if imprimir_planos(verificar_planos(CAMINHO_APP, parametros, args.banco, contexto)) else 1
+
+        faltando = funcoes_sem_caso(CAMINHO_APP)
+        if faltando:
+            print(f"AVISO: sem caso de benchmark para: {', '.join(faltando)}")
+        contexto = carregar_contexto(parametros, args.banco)
+        relatorio = executar_benchmark(
+            CAMINHO_APP, parametros, args.banco, contexto, args.repeticoes, args.filtro,
+            funcoes=not args.sem_funcoes, paginas=not args.sem_paginas,
+        )
+        imprimir_relatorio(relatorio)
+        caminho_json, caminho_csv = salvar_relatorio(relatorio, args.saida)
+        print(f"\nRelatório: {caminho_json}\n           {caminho_csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
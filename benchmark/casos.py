@@ -0,0 +1,221 @@
+"""
+Casos medidos pelo benchmark.
+
+Cada caso de função é (nome, função do app.py, gerador de argumentos). O gerador
+recebe o contexto (ids reais do banco) e o número da repetição e devolve
+(args, kwargs); escritas usam a repetição para não repetir chaves nem dados.
+Ao criar uma nova função buscar_*/registrar_* no app.py, acrescente o caso aqui:
+funcoes_sem_caso() aponta as que ficaram de fora.
+"""
+
+import ast
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+
+from .gerador import USUARIO_BENCHMARK, conectar
+
+FILTRO_VAZIO = {"nome": "", "categoria": "Todas"}
+
+
+def _mov(tipo):
+    def argumentos(ctx, i):
+        dados = {
+            "tipo": tipo, "material_id": ctx["material_id"], "descricao": ctx["material_descricao"],
+            "quantidade": 1, "data": date.today(), "observacoes": f"benchmark {i}",
+            "fornecedor": "Benchmark" if tipo == "Entrada" else None,
+            "recebedor": "Benchmark" if tipo == "Saída" else None,
+            "obra_origem_id": ctx["obra_id"], "obra_destino_id": ctx["outra_obra_id"],
+        }
+        return (ctx["obra_id"], ctx["usuario_id"], dados), {"chave_idempotencia": f"benchmark-{tipo}-{ctx['execucao']}-{i}"}
+    return argumentos
+
+
+def _lote(linhas):
+    def argumentos(ctx, i):
+        itens = [{"material_id": ctx["material_id"], "descricao": ctx["material_descricao"], "quantidade": 1} for _ in range(linhas)]
+        return (ctx["obra_id"], ctx["usuario_id"], "Entrada", date.today(), itens), {"chave_idempotencia": f"benchmark-lote-{ctx['execucao']}-{i}"}
+    return argumentos
+
+
+def _planilha_materiais(linhas):
+    def argumentos(ctx, i):
+        planilha = pd.DataFrame({
+            "codigo": [f"BENCH-{ctx['execucao']}-{i}-{n}" for n in range(linhas)],
+            "descricao": [f"Material de benchmark {n}" for n in range(linhas)],
+            "unidade": "Un", "categoria": ctx["categoria"],
+            "estoque_minimo": 1.0, "estoque_maximo": 100.0, "observacoes": None,
+        })
+        return (planilha,), {"chave_idempotencia": f"benchmark-planilha-{ctx['execucao']}-{i}"}
+    return argumentos
+
+
+# (nome do caso, função, argumentos, escrita?)
+CASOS_FUNCOES = [
+    ("buscar_obras_do_usuario_db", "buscar_obras_do_usuario_db", lambda c, i: ((c["usuario_id"],), {}), False),
+    ("buscar_categorias_unicas", "buscar_categorias_unicas", lambda c, i: ((), {}), False),
+    ("buscar_unidades_unicas", "buscar_unidades_unicas", lambda c, i: ((), {}), False),
+    ("buscar_materiais_paginados[pagina 1]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], FILTRO_VAZIO), {}), False),
+    ("buscar_materiais_paginados[pagina 500]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], FILTRO_VAZIO), {"apos": c["cursor_pagina_500"]}), False),
+    ("buscar_materiais_paginados[ultima pagina]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], FILTRO_VAZIO), {"apos": c["cursor_ultima_pagina"]}), False),
+    ("buscar_materiais_paginados[busca]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], {"nome": "cimento", "categoria": "Todas"}), {}), False),
+    ("buscar_materiais_paginados[busca pagina 2]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], {"nome": "cimento", "categoria": "Todas"}), {"apos": c["cursor_busca_pagina_2"]}), False),
+    ("buscar_materiais_paginados[busca codigo]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], {"nome": "MAT-0001", "categoria": "Todas"}), {}), False),
+    ("buscar_materiais_paginados[busca 1 letra]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], {"nome": "t", "categoria": "Todas"}), {}), False),
+    ("buscar_materiais_paginados[categoria]", "buscar_materiais_paginados", lambda c, i: ((c["obra_id"], {"nome": "", "categoria": c["categoria"]}), {}), False),
+    ("contar_materiais_filtrados", "contar_materiais_filtrados", lambda c, i: ((FILTRO_VAZIO,), {}), False),
+    ("buscar_material_por_id", "buscar_material_por_id", lambda c, i: ((c["material_id"],), {}), False),
+    ("buscar_materiais_para_selecao", "buscar_materiais_para_selecao", lambda c, i: ((), {}), False),
+    ("buscar_outras_obras", "buscar_outras_obras", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_historico_db[ultimos 10]", "buscar_historico_db", lambda c, i: ((c["obra_id"],), {"limit": 10}), False),
+    ("buscar_historico_db[30 dias]", "buscar_historico_db", lambda c, i: ((c["obra_id"],), {"data_inicio": date.today() - timedelta(days=30), "data_fim": date.today()}), False),
+    ("buscar_historico_db[completo]", "buscar_historico_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_pagina_historico_db[pagina 1]", "buscar_pagina_historico_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_pagina_historico_db[pagina 100]", "buscar_pagina_historico_db", lambda c, i: ((c["obra_id"],), {"apos": c["cursor_historico_pagina_100"]}), False),
+    ("buscar_pagina_historico_db[30 dias, por tipo]", "buscar_pagina_historico_db", lambda c, i: ((c["obra_id"],), {"data_inicio": date.today() - timedelta(days=30), "data_fim": date.today(), "tipos_transacao": ["Entrada"]}), False),
+    ("buscar_pagina_historico_db[por material]", "buscar_pagina_historico_db", lambda c, i: ((c["obra_id"],), {"material_id": c["material_id"]}), False),
+    ("contar_historico_db", "contar_historico_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_prazos_compra_db", "buscar_prazos_compra_db", lambda c, i: ((), {}), False),
+    ("buscar_notificacoes_compra_db", "buscar_notificacoes_compra_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_notificacoes_compra_solicitadas_db", "buscar_notificacoes_compra_solicitadas_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_transacoes_db[recebidas]", "buscar_transacoes_db", lambda c, i: ((c["obra_id"], "recebidas"), {}), False),
+    ("buscar_transacoes_db[enviadas]", "buscar_transacoes_db", lambda c, i: ((c["obra_id"], "enviadas"), {}), False),
+    ("buscar_historico_transacoes_db", "buscar_historico_transacoes_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_todos_vinculos_da_obra_db", "buscar_todos_vinculos_da_obra_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_kits_da_obra_db", "buscar_kits_da_obra_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_materiais_de_um_kit_db", "buscar_materiais_de_um_kit_db", lambda c, i: ((c["kit_id"],), {}), False),
+    ("buscar_tarefas_db", "buscar_tarefas_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("buscar_kits_vinculados_db", "buscar_kits_vinculados_db", lambda c, i: ((c["tarefa_id"],), {}), False),
+    ("buscar_solicitacoes_montagem_db", "buscar_solicitacoes_montagem_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("calcular_balanco_emprestimos_db", "calcular_balanco_emprestimos_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("calcular_divergencias_estoque_db[obra]", "calcular_divergencias_estoque_db", lambda c, i: ((c["obra_id"],), {}), False),
+    ("calcular_divergencias_estoque_db[todas as obras]", "calcular_divergencias_estoque_db", lambda c, i: ((), {}), False),
+    ("calcular_estoque_em_db[obra]", "calcular_estoque_em_db", lambda c, i: ((c["obra_id"], datetime.combine(date.today() - timedelta(days=30), time.min)), {}), False),
+    ("calcular_estoque_em_db[material]", "calcular_estoque_em_db", lambda c, i: ((c["obra_id"], datetime.combine(date.today() - timedelta(days=30), time.min)), {"material_id": c["material_id"]}), False),
+    ("contar_movimentacoes_sem_material_db", "contar_movimentacoes_sem_material_db", lambda c, i: ((c["obra_id"], datetime.combine(date.today() - timedelta(days=30), time.min)), {}), False),
+    ("registrar_usuario_db", "registrar_usuario_db", lambda c, i: ((f"bench_{c['execucao']}_{i}", f"bench_{c['execucao']}_{i}@example.com", "0" * 64), {}), True),
+    ("registrar_movimentacoes_em_lote_db[60 linhas]", "registrar_movimentacoes_em_lote_db", _lote(60), True),
+    ("cadastrar_materiais_em_lote_db[2000 linhas]", "cadastrar_materiais_em_lote_db", _planilha_materiais(2000), True),
+    # Grava na área de preparo da importação e desfaz: medida como escrita, sem fase 'quente'
+    ("buscar_codigos_existentes_db[5000 codigos]", "buscar_codigos_existentes_db", lambda c, i: ((tuple(f"MAT-{n:06d}" for n in range(0, 10000, 2)),), {}), True),
+    ("gerar_checkpoints_estoque_db", "gerar_checkpoints_estoque_db", lambda c, i: ((), {}), True),
+    ("registrar_movimentacao_db[Entrada]", "registrar_movimentacao_db", _mov("Entrada"), True),
+    ("registrar_movimentacao_db[Saída]", "registrar_movimentacao_db", _mov("Saída"), True),
+    ("registrar_movimentacao_db[Transferência]", "registrar_movimentacao_db", _mov("Transferência"), True),
+    # Rodam a cada sessão (primeira execução após o login)
+    ("verificar_e_gerar_solicitacoes_db", "verificar_e_gerar_solicitacoes_db", lambda c, i: ((c["obra_id"],), {}), True),
+    ("verificar_e_gerar_notificacoes_compra", "verificar_e_gerar_notificacoes_compra", lambda c, i: ((c["obra_id"],), {}), True),
+]
+
+# Páginas: rótulo do menu principal -> nome do caso
+CASOS_PAGINAS = {
+    "INÍCIO": "pagina_inicio",
+    "RELATAR MOVIMENTAÇÃO": "render_relatar_movimentacao_page",
+    "ESTOQUE DE MATERIAIS": "render_estoque_materiais_page",
+    "KITS": "render_kits_cadastrados_page",
+    "CENTRAL DE TRANSFERÊNCIAS": "render_central_de_transferencias_page",
+    "PLANEJAMENTO": "render_planejamento_page",
+    "PRAZOS DE COMPRA": "render_prazos_compra_page",
+}
+
+
+def funcoes_sem_caso(caminho_app):
+    """Funções buscar_*/registrar_*/render_*_page do app.py que não têm caso no benchmark."""
+    with open(caminho_app, encoding="utf-8") as arquivo:
+        arvore = ast.parse(arquivo.read())
+    definidas = {
+        no.name for no in ast.walk(arvore)
+        if isinstance(no, ast.FunctionDef)
+        and (no.name.startswith(("buscar_", "registrar_")) or (no.name.startswith("render_") and no.name.endswith("_page")))
+    }
+    cobertas = {funcao for _, funcao, _, _ in CASOS_FUNCOES} | set(CASOS_PAGINAS.values()) | {"render_login_page"}
+    return sorted(definidas - cobertas)
+
+
+def _cursor_da_pagina(cursor, pagina, itens_por_pagina):
+    """Chave (descricao, id) do último item antes da página, como a tela guarda ao avançar."""
+    if pagina <= 1:
+        return None
+    cursor.execute(
+        "SELECT descricao, id FROM materiais ORDER BY descricao, id LIMIT 1 OFFSET %s",
+        ((pagina - 1) * itens_por_pagina - 1,),
+    )
+    linha = cursor.fetchone()
+    return (linha["descricao"], linha["id"])
+
+
+def _cursor_da_busca(cursor, texto, itens_por_pagina):
+    """Par (relevancia, id) do último item da primeira página de uma busca textual."""
+    cursor.execute(
+        """
+        SELECT MATCH(descricao_busca, codigo) AGAINST (%s IN BOOLEAN MODE) AS relevancia, id FROM materiais
+        WHERE MATCH(descricao_busca, codigo) AGAINST (%s IN BOOLEAN MODE)
+        ORDER BY relevancia DESC, id LIMIT 1 OFFSET %s
+        """,
+        (f'+"{texto}"', f'+"{texto}"', itens_por_pagina - 1),
+    )
+    linha = cursor.fetchone()
+    return (float(linha["relevancia"]), linha["id"]) if linha else None
+
+
+def _cursor_do_historico(cursor, obra_id, pagina, itens_por_pagina=50):
+    """Par (data, id) do último item antes da página do histórico paginado."""
+    if pagina <= 1:
+        return None
+    cursor.execute(
+        """
+        SELECT data, id FROM movimentacoes WHERE obra_id = %s AND estornado = FALSE
+        ORDER BY data DESC, id DESC LIMIT 1 OFFSET %s
+        """,
+        (obra_id, (pagina - 1) * itens_por_pagina - 1),
+    )
+    linha = cursor.fetchone()
+    return (linha["data"], linha["id"]) if linha else None
+
+
+def carregar_contexto(parametros, banco, itens_por_pagina=20):
+    """Escolhe ids reais do banco para os argumentos dos casos (sempre os mesmos para os mesmos dados)."""
+    conexao = conectar(parametros, banco)
+    try:
+        cursor = conexao.cursor(dictionary=True)
+        cursor.execute("SELECT id, nome_usuario FROM usuarios WHERE nome_usuario = %s", (USUARIO_BENCHMARK,))
+        usuario = cursor.fetchone()
+        if not usuario:
+            raise RuntimeError("Banco sem dados do benchmark; rode primeiro o comando 'carregar'.")
+        cursor.execute("SELECT id, nome_obra FROM obras ORDER BY id LIMIT 2")
+        obras = cursor.fetchall()
+        cursor.execute("""
+            SELECT m.id, m.descricao, m.categoria FROM estoque_obra eo
+            JOIN materiais m ON m.id = eo.material_id
+            WHERE eo.obra_id = %s ORDER BY m.id LIMIT 1
+        """, (obras[0]["id"],))
+        material = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) AS total FROM materiais")
+        total_materiais = cursor.fetchone()["total"]
+        ultima_pagina = max(1, -(-total_materiais // itens_por_pagina))
+        cursor.execute("SELECT id FROM kits WHERE obra_id = %s ORDER BY id LIMIT 1", (obras[0]["id"],))
+        kit = cursor.fetchone()
+        cursor.execute("""
+            SELECT v.tarefa_id FROM tarefa_kits_vinculados v
+            JOIN planejamento_tarefas t ON t.id = v.tarefa_id
+            WHERE t.obra_id = %s ORDER BY v.id LIMIT 1
+        """, (obras[0]["id"],))
+        vinculo = cursor.fetchone()
+        return {
+            "usuario_id": usuario["id"],
+            "usuario_nome": usuario["nome_usuario"],
+            "obra_id": obras[0]["id"],
+            "obra_nome": obras[0]["nome_obra"],
+            "outra_obra_id": obras[-1]["id"],
+            "material_id": material["id"],
+            "material_descricao": material["descricao"],
+            "categoria": material["categoria"],
+            "cursor_pagina_500": _cursor_da_pagina(cursor, min(500, ultima_pagina), itens_por_pagina),
+            "cursor_ultima_pagina": _cursor_da_pagina(cursor, ultima_pagina, itens_por_pagina),
+            "cursor_busca_pagina_2": _cursor_da_busca(cursor, "cimento", itens_por_pagina),
+            "cursor_historico_pagina_100": _cursor_do_historico(cursor, obras[0]["id"], 100),
+            "kit_id": kit["id"] if kit else 0,
+            "tarefa_id": vinculo["tarefa_id"] if vinculo else 0,
+        }
+    finally:
+        conexao.close()
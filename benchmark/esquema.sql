@@ -0,0 +1,134 @@
+-- Esquema que o app.py espera encontrar no MySQL/MariaDB.
+-- Usado pelo benchmark para montar um banco descartável; comandos separados por ';' no fim da linha.
+
+CREATE TABLE IF NOT EXISTS obras (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    nome_obra VARCHAR(255) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    nome_usuario VARCHAR(100) NOT NULL UNIQUE,
+    email VARCHAR(255) NOT NULL UNIQUE,
+    senha_hash CHAR(64) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS usuario_obras_acesso (
+    usuario_id INT NOT NULL,
+    obra_id INT NOT NULL,
+    PRIMARY KEY (usuario_id, obra_id),
+    FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE,
+    FOREIGN KEY (obra_id) REFERENCES obras(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS materiais (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    codigo VARCHAR(50) NOT NULL UNIQUE,
+    descricao VARCHAR(255) NOT NULL,
+    unidade VARCHAR(20),
+    categoria VARCHAR(100),
+    estoque_minimo DECIMAL(12,2) DEFAULT 0,
+    estoque_maximo DECIMAL(12,2) DEFAULT 0,
+    observacoes TEXT,
+    data_cadastro DATETIME DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS estoque_obra (
+    material_id INT NOT NULL,
+    obra_id INT NOT NULL,
+    quantidade DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (material_id, obra_id),
+    FOREIGN KEY (material_id) REFERENCES materiais(id) ON DELETE CASCADE,
+    FOREIGN KEY (obra_id) REFERENCES obras(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS movimentacoes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    obra_id INT NOT NULL,
+    data DATETIME NOT NULL,
+    tipo VARCHAR(30) NOT NULL,
+    descricao VARCHAR(255) NOT NULL,
+    quantidade DECIMAL(12,2) NOT NULL,
+    fornecedor VARCHAR(255),
+    recebedor VARCHAR(255),
+    observacoes TEXT,
+    estornado BOOLEAN NOT NULL DEFAULT FALSE,
+    FOREIGN KEY (obra_id) REFERENCES obras(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS transacoes_pendentes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    obra_origem_id INT NOT NULL,
+    obra_destino_id INT NOT NULL,
+    material_id INT NOT NULL,
+    quantidade DECIMAL(12,2) NOT NULL,
+    tipo_transacao VARCHAR(30) NOT NULL,
+    observacoes TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'Pendente',
+    solicitado_por_usuario_id INT,
+    processado_por_usuario_id INT,
+    data_solicitacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_aprovacao_recusa DATETIME,
+    FOREIGN KEY (obra_origem_id) REFERENCES obras(id),
+    FOREIGN KEY (obra_destino_id) REFERENCES obras(id),
+    FOREIGN KEY (material_id) REFERENCES materiais(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS prazos_compra (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    categoria VARCHAR(100) NOT NULL UNIQUE,
+    prazo_dias INT NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS kits (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    obra_id INT NOT NULL,
+    nome VARCHAR(255) NOT NULL,
+    descricao TEXT,
+    FOREIGN KEY (obra_id) REFERENCES obras(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS kit_materiais (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    kit_id INT NOT NULL,
+    material_id INT NOT NULL,
+    quantidade DECIMAL(12,2) NOT NULL,
+    FOREIGN KEY (kit_id) REFERENCES kits(id) ON DELETE CASCADE,
+    FOREIGN KEY (material_id) REFERENCES materiais(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS planejamento_tarefas (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    obra_id INT NOT NULL,
+    unique_id_mpp INT NOT NULL,
+    nome_tarefa VARCHAR(255) NOT NULL,
+    data_inicio DATE NOT NULL,
+    data_fim DATE,
+    FOREIGN KEY (obra_id) REFERENCES obras(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS tarefa_kits_vinculados (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    tarefa_id INT NOT NULL,
+    kit_id INT NOT NULL,
+    quantidade_kits INT NOT NULL DEFAULT 1,
+    FOREIGN KEY (tarefa_id) REFERENCES planejamento_tarefas(id) ON DELETE CASCADE,
+    FOREIGN KEY (kit_id) REFERENCES kits(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS notificacoes_compra (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    kit_vinculado_id INT NOT NULL,
+    data_notificacao DATE NOT NULL,
+    data_necessidade DATE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'Pendente',
+    FOREIGN KEY (kit_vinculado_id) REFERENCES tarefa_kits_vinculados(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS solicitacoes_montagem (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    kit_vinculado_id INT NOT NULL,
+    data_execucao_prevista DATE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'Pendente',
+    FOREIGN KEY (kit_vinculado_id) REFERENCES tarefa_kits_vinculados(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
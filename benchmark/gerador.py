@@ -0,0 +1,306 @@
+"""Criação do esquema e geração de dados sintéticos em escala configurável."""
+
+import os
+import random
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+from .servidor import BANCO_PADRAO
+
+CAMINHO_ESQUEMA = os.path.join(os.path.dirname(__file__), "esquema.sql")
+# Migrações do app (índices, colunas novas), aplicadas em ordem de nome depois da carga,
+# como em produção: o esquema base recebe os dados e as migrações rodam sobre eles
+DIRETORIO_MIGRACOES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migracoes")
+
+USUARIO_BENCHMARK = "benchmark"
+SENHA_BENCHMARK = "benchmark"
+
+# Tamanhos pré-definidos; qualquer chave pode ser sobrescrita pela linha de comando.
+ESCALAS = {
+    "pequena": {
+        "obras": 10, "materiais": 2_000, "movimentacoes": 50_000, "transacoes": 2_000,
+        "estoque_por_obra": 500, "kits_por_obra": 10, "tarefas_por_obra": 100, "anos": 2,
+    },
+    "media": {
+        "obras": 50, "materiais": 20_000, "movimentacoes": 500_000, "transacoes": 20_000,
+        "estoque_por_obra": 2_000, "kits_por_obra": 20, "tarefas_por_obra": 300, "anos": 3,
+    },
+    "grande": {
+        "obras": 200, "materiais": 100_000, "movimentacoes": 5_000_000, "transacoes": 100_000,
+        "estoque_por_obra": 5_000, "kits_por_obra": 30, "tarefas_por_obra": 500, "anos": 5,
+    },
+}
+
+TAMANHO_LOTE = 5_000
+
+NOMES_MATERIAIS = [
+    "Cimento", "Areia", "Brita", "Tijolo Cerâmico", "Bloco de Concreto", "Vergalhão", "Arame Recozido",
+    "Prego", "Parafuso", "Bucha", "Tubo PVC", "Joelho PVC", "Luva de Correr", "Registro de Gaveta",
+    "Cabo Flexível", "Disjuntor", "Eletroduto", "Caixa de Passagem", "Tomada", "Interruptor",
+    "Argamassa", "Rejunte", "Piso Porcelanato", "Azulejo", "Tinta Acrílica", "Massa Corrida",
+    "Lixa", "Impermeabilizante", "Manta Asfáltica", "Telha Fibrocimento", "Forma de Madeira",
+    "Compensado Naval", "Escora Metálica", "Luva de Proteção", "Capacete", "Óculos de Segurança",
+]
+ESPECIFICACOES = [
+    "CP-II", "Média Lavada", "Nº 1", "9 Furos", "14x19x39", "CA-50", "Galvanizado", "Sextavado",
+    "Soldável", "Esgoto", "Elétrico", "Bipolar", "Corrugado", "Embutir", "Branca", "Cinza",
+    "Fosca", "Acetinada", "Acabamento Fino", "Aditivada", "Ondulada", "Resinado", "Ajustável", "Nitrílica",
+]
+MEDIDAS = ["50kg", "20kg", "m³", "3/4\"", "1/2\"", "25mm", "2,5mm²", "10mm", "6mm", "18L", "3,6L", "1m", "2,44x1,22m", "M"]
+UNIDADES = ["UN", "KG", "M", "M²", "M³", "L", "SC", "CX", "PC", "RL"]
+CATEGORIAS = [
+    "Estrutura", "Alvenaria", "Hidráulica", "Elétrica", "Acabamento", "Pintura",
+    "Impermeabilização", "Cobertura", "Formas", "EPI", "Ferramentas", "Diversos",
+]
+CIDADES = ["São Paulo", "Goiânia", "Brasília", "Belo Horizonte", "Curitiba", "Recife", "Salvador", "Florianópolis"]
+FORNECEDORES = ["Depósito Central", "Casa do Construtor", "Leroy Merlin", "Gerdau", "Votorantim", "Tigre", "Fornecedor Local"]
+ETAPAS = ["Fundação", "Estrutura", "Alvenaria", "Instalações Hidráulicas", "Instalações Elétricas", "Revestimento", "Pintura", "Cobertura"]
+TIPOS_MOVIMENTACAO = ["Entrada", "Saída"]
+TIPOS_TRANSACAO = ["Transferência", "Empréstimo", "Devolução"]
+
+
+def conectar(parametros, banco=None):
+    return mysql.connector.connect(**parametros, database=banco, autocommit=False)
+
+
+def _comandos_sql(caminho):
+    """Separa o arquivo .sql em comandos (';' no fim da linha), ignorando comentários."""
+    with open(caminho, encoding="utf-8") as arquivo:
+        linhas = [linha for linha in arquivo if not linha.strip().startswith("--")]
+    return [comando.strip() for comando in "".join(linhas).split(";\n") if comando.strip().rstrip(";")]
+
+
+def arquivos_migracao():
+    if not os.path.isdir(DIRETORIO_MIGRACOES):
+        return []
+    return [os.path.join(DIRETORIO_MIGRACOES, nome) for nome in sorted(os.listdir(DIRETORIO_MIGRACOES)) if nome.endswith(".sql")]
+
+
+def _executar_arquivos(parametros, banco, caminhos):
+    conexao = conectar(parametros, banco)
+    try:
+        cursor = conexao.cursor()
+        for caminho in caminhos:
+            print(f"  aplicando {os.path.basename(caminho)}")
+            for comando in _comandos_sql(caminho):
+                cursor.execute(comando.rstrip(";"))
+            conexao.commit()
+    finally:
+        conexao.close()
+
+
+def criar_esquema(parametros, banco=BANCO_PADRAO, recriar=False):
+    """Cria o banco (do zero, se 'recriar') com as tabelas do esquema base."""
+    conexao = conectar(parametros)
+    try:
+        cursor = conexao.cursor()
+        if recriar:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{banco}`")
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{banco}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    finally:
+        conexao.close()
+    _executar_arquivos(parametros, banco, [CAMINHO_ESQUEMA])
+
+
+def aplicar_migracoes(parametros, banco=BANCO_PADRAO):
+    """Aplica migracoes/*.sql em ordem (sobre um banco recém-criado e carregado)."""
+    _executar_arquivos(parametros, banco, arquivos_migracao())
+
+
+def _inserir_em_lotes(conexao, sql, linhas, rotulo):
+    """Insere as linhas (iterável) em lotes com executemany (o conector gera INSERTs multi-linha)."""
+    cursor = conexao.cursor()
+    lote = []
+    total = 0
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= TAMANHO_LOTE:
+            cursor.executemany(sql, lote)
+            conexao.commit()
+            total += len(lote)
+            lote = []
+            if total % (TAMANHO_LOTE * 40) == 0:
+                print(f"  {rotulo}: {total:,} linhas")
+    if lote:
+        cursor.executemany(sql, lote)
+        conexao.commit()
+        total += len(lote)
+    print(f"  {rotulo}: {total:,} linhas")
+    return total
+
+
+def _ids(conexao, sql, params=()):
+    cursor = conexao.cursor()
+    cursor.execute(sql, params)
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def popular_banco(parametros, escala, banco=BANCO_PADRAO, semente=42):
+    """
+    Preenche o banco com dados sintéticos determinísticos (mesma semente, mesmos dados).
+    'escala' é um dicionário com as chaves de ESCALAS.
+    """
+    aleatorio = random.Random(semente)
+    hoje = date.today()
+    agora = datetime.now().replace(microsecond=0)
+    conexao = conectar(parametros, banco)
+    try:
+        cursor = conexao.cursor()
+        cursor.execute("SET SESSION foreign_key_checks = 0")
+        cursor.execute("SET SESSION unique_checks = 0")
+
+        _inserir_em_lotes(
+            conexao, "INSERT INTO prazos_compra (categoria, prazo_dias) VALUES (%s, %s)",
+            ((categoria, aleatorio.choice([7, 15, 30, 45, 60, 90])) for categoria in CATEGORIAS), "prazos_compra",
+        )
+        _inserir_em_lotes(
+            conexao, "INSERT INTO obras (nome_obra) VALUES (%s)",
+            ((f"Obra {i:03d} - {aleatorio.choice(CIDADES)}",) for i in range(1, escala["obras"] + 1)), "obras",
+        )
+        obras = _ids(conexao, "SELECT id FROM obras ORDER BY id")
+
+        cursor.execute(
+            "INSERT INTO usuarios (nome_usuario, email, senha_hash) VALUES (%s, %s, SHA2(%s, 256))",
+            (USUARIO_BENCHMARK, "benchmark@example.com", SENHA_BENCHMARK),
+        )
+        usuario_id = cursor.lastrowid
+        _inserir_em_lotes(
+            conexao, "INSERT INTO usuario_obras_acesso (usuario_id, obra_id) VALUES (%s, %s)",
+            ((usuario_id, obra_id) for obra_id in obras), "usuario_obras_acesso",
+        )
+
+        # Materiais: descrição única (o estorno localiza o material pela descrição)
+        descricoes = {}
+        def gerar_materiais():
+            for i in range(1, escala["materiais"] + 1):
+                descricao = f"{aleatorio.choice(NOMES_MATERIAIS)} {aleatorio.choice(ESPECIFICACOES)} {aleatorio.choice(MEDIDAS)} ref. {i:06d}"
+                descricoes[i] = descricao
+                minimo = aleatorio.randint(0, 50)
+                yield (f"MAT-{i:06d}", descricao, aleatorio.choice(UNIDADES), aleatorio.choice(CATEGORIAS), minimo, minimo + aleatorio.randint(10, 500), None)
+        _inserir_em_lotes(
+            conexao,
+            "INSERT INTO materiais (codigo, descricao, unidade, categoria, estoque_minimo, estoque_maximo, observacoes) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            gerar_materiais(), "materiais",
+        )
+        materiais = _ids(conexao, "SELECT id FROM materiais ORDER BY id")
+        descricao_por_id = {material_id: descricoes[posicao] for posicao, material_id in enumerate(materiais, start=1)}
+
+        estoque_por_obra = {
+            obra_id: aleatorio.sample(materiais, min(escala["estoque_por_obra"], len(materiais))) for obra_id in obras
+        }
+        _inserir_em_lotes(
+            conexao, "INSERT INTO estoque_obra (material_id, obra_id, quantidade) VALUES (%s, %s, %s)",
+            ((material_id, obra_id, aleatorio.randint(0, 1_000)) for obra_id, ids in estoque_por_obra.items() for material_id in ids),
+            "estoque_obra",
+        )
+
+        segundos_historico = escala["anos"] * 365 * 24 * 3600
+        def gerar_movimentacoes():
+            for _ in range(escala["movimentacoes"]):
+                obra_id = aleatorio.choice(obras)
+                material_id = aleatorio.choice(estoque_por_obra[obra_id])
+                tipo = aleatorio.choice(TIPOS_MOVIMENTACAO)
+                yield (
+                    obra_id,
+                    agora - timedelta(seconds=aleatorio.randrange(segundos_historico)),
+                    tipo,
+                    descricao_por_id[material_id],
+                    aleatorio.randint(1, 200),
+                    aleatorio.choice(FORNECEDORES) if tipo == "Entrada" else None,
+                    f"Equipe {aleatorio.randint(1, 20)}" if tipo == "Saída" else None,
+                    None,
+                    aleatorio.random() < 0.01,
+                )
+        _inserir_em_lotes(
+            conexao,
+            "INSERT INTO movimentacoes (obra_id, data, tipo, descricao, quantidade, fornecedor, recebedor, observacoes, estornado) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            gerar_movimentacoes(), "movimentacoes",
+        )
+
+        def gerar_transacoes():
+            for _ in range(escala["transacoes"]):
+                origem, destino = aleatorio.sample(obras, 2) if len(obras) > 1 else (obras[0], obras[0])
+                status = aleatorio.choices(["Pendente", "Aprovada", "Recusada"], weights=[1, 6, 1])[0]
+                solicitada = agora - timedelta(seconds=aleatorio.randrange(segundos_historico))
+                yield (
+                    origem, destino, aleatorio.choice(estoque_por_obra[origem]), aleatorio.randint(1, 50),
+                    aleatorio.choice(TIPOS_TRANSACAO), None, status, usuario_id,
+                    None if status == "Pendente" else usuario_id, solicitada,
+                    None if status == "Pendente" else solicitada + timedelta(days=1),
+                )
+        _inserir_em_lotes(
+            conexao,
+            "INSERT INTO transacoes_pendentes (obra_origem_id, obra_destino_id, material_id, quantidade, tipo_transacao, observacoes, status, solicitado_por_usuario_id, processado_por_usuario_id, data_solicitacao, data_aprovacao_recusa) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            gerar_transacoes(), "transacoes_pendentes",
+        )
+
+        _inserir_em_lotes(
+            conexao, "INSERT INTO kits (obra_id, nome, descricao) VALUES (%s, %s, %s)",
+            ((obra_id, f"Kit {aleatorio.choice(ETAPAS)} {i:02d}", None) for obra_id in obras for i in range(1, escala["kits_por_obra"] + 1)),
+            "kits",
+        )
+        kits_por_obra = {}
+        for kit_id, obra_id in _linhas(conexao, "SELECT id, obra_id FROM kits"):
+            kits_por_obra.setdefault(obra_id, []).append(kit_id)
+        _inserir_em_lotes(
+            conexao, "INSERT INTO kit_materiais (kit_id, material_id, quantidade) VALUES (%s, %s, %s)",
+            (
+                (kit_id, material_id, aleatorio.randint(1, 20))
+                for obra_id, kits in kits_por_obra.items() for kit_id in kits
+                for material_id in aleatorio.sample(estoque_por_obra[obra_id], min(aleatorio.randint(3, 10), len(estoque_por_obra[obra_id])))
+            ),
+            "kit_materiais",
+        )
+
+        def gerar_tarefas():
+            for obra_id in obras:
+                for unique_id in range(1, escala["tarefas_por_obra"] + 1):
+                    inicio = hoje + timedelta(days=aleatorio.randint(-180, 365))
+                    yield (obra_id, unique_id, f"{aleatorio.choice(ETAPAS)} - Pavimento {aleatorio.randint(1, 20)}", inicio, inicio + timedelta(days=aleatorio.randint(1, 30)))
+        _inserir_em_lotes(
+            conexao, "INSERT INTO planejamento_tarefas (obra_id, unique_id_mpp, nome_tarefa, data_inicio, data_fim) VALUES (%s, %s, %s, %s, %s)",
+            gerar_tarefas(), "planejamento_tarefas",
+        )
+
+        # Um terço das tarefas recebe um kit da própria obra
+        _inserir_em_lotes(
+            conexao, "INSERT INTO tarefa_kits_vinculados (tarefa_id, kit_id, quantidade_kits) VALUES (%s, %s, %s)",
+            (
+                (tarefa_id, aleatorio.choice(kits_por_obra[obra_id]), aleatorio.randint(1, 5))
+                for tarefa_id, obra_id in _linhas(conexao, "SELECT id, obra_id FROM planejamento_tarefas")
+                if obra_id in kits_por_obra and aleatorio.random() < 1 / 3
+            ),
+            "tarefa_kits_vinculados",
+        )
+
+        # Notificações e solicitações já existentes para vínculos de tarefas próximas ou passadas
+        vinculos = _linhas(conexao, """
+            SELECT v.id, t.data_inicio FROM tarefa_kits_vinculados v
+            JOIN planejamento_tarefas t ON v.tarefa_id = t.id
+            WHERE t.data_inicio <= %s
+        """, (hoje + timedelta(days=90),))
+        _inserir_em_lotes(
+            conexao, "INSERT INTO notificacoes_compra (kit_vinculado_id, data_notificacao, data_necessidade, status) VALUES (%s, %s, %s, %s)",
+            ((vinculo_id, inicio - timedelta(days=90), inicio, "Pendente" if inicio >= hoje else "Solicitado") for vinculo_id, inicio in vinculos),
+            "notificacoes_compra",
+        )
+        _inserir_em_lotes(
+            conexao, "INSERT INTO solicitacoes_montagem (kit_vinculado_id, data_execucao_prevista, status) VALUES (%s, %s, %s)",
+            ((vinculo_id, inicio, aleatorio.choice(["Pendente", "Montado", "Entregue"])) for vinculo_id, inicio in vinculos if inicio <= hoje),
+            "solicitacoes_montagem",
+        )
+
+        cursor.execute("SET SESSION foreign_key_checks = 1")
+        cursor.execute("SET SESSION unique_checks = 1")
+        for tabela in ("materiais", "estoque_obra", "movimentacoes", "transacoes_pendentes", "planejamento_tarefas"):
+            cursor.execute(f"ANALYZE TABLE {tabela}")
+            cursor.fetchall()
+    finally:
+        conexao.close()
+
+
+def _linhas(conexao, sql, params=()):
+    cursor = conexao.cursor()
+    cursor.execute(sql, params)
+    return cursor.fetchall()
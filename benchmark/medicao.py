@@ -0,0 +1,285 @@
+"""Medição das funções e páginas do app.py via streamlit.testing (AppTest) e relatórios."""
+
+import csv
+import json
+import math
+import os
+import re
+import runpy
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from .casos import CASOS_FUNCOES, CASOS_PAGINAS
+from .gerador import conectar
+
+TIMEOUT_EXECUCAO_S = 3600
+TABELAS_CONTADAS = [
+    "obras", "materiais", "estoque_obra", "movimentacoes", "transacoes_pendentes", "kits",
+    "kit_materiais", "planejamento_tarefas", "tarefa_kits_vinculados", "notificacoes_compra",
+    "solicitacoes_montagem", "prazos_compra",
+]
+
+
+def _resumir(caso, tipo, fase, amostras, consultas, linhas, erro):
+    ordenadas = sorted(amostras)
+    return {
+        "caso": caso,
+        "tipo": tipo,
+        "fase": fase,
+        "repeticoes": len(ordenadas),
+        "mediana_ms": round(statistics.median(ordenadas), 3) if ordenadas else None,
+        "p95_ms": round(ordenadas[math.ceil(0.95 * len(ordenadas)) - 1], 3) if ordenadas else None,
+        "min_ms": round(ordenadas[0], 3) if ordenadas else None,
+        "max_ms": round(ordenadas[-1], 3) if ordenadas else None,
+        "consultas": round(statistics.mean(consultas), 1) if consultas else None,
+        "linhas": round(statistics.mean(linhas), 1) if linhas else None,
+        "erro": erro,
+    }
+
+
+def _secrets(parametros, banco, log_jsonl):
+    return {
+        "db": {**parametros, "database": banco},
+        "instrumentacao": {"ativa": True, "admins": [], "log_jsonl": log_jsonl},
+    }
+
+
+#region Funções
+
+def medir_funcoes_no_app(caminho_app, contexto, repeticoes, filtro):
+    """
+    Roda DENTRO do AppTest: executa o app.py (que para na tela de login) para obter
+    as funções com o contexto do Streamlit e mede cada caso. Leituras são medidas
+    'fria' (cache da função limpo antes de cada chamada) e 'quente' (cache cheio);
+    escritas, uma vez por repetição com dados e chave de idempotência novos.
+    """
+    import streamlit as st
+
+    ns = runpy.run_path(caminho_app, run_name="__benchmark__")
+    resultados = []
+    try:
+        for caso, nome_funcao, argumentos, escrita in CASOS_FUNCOES:
+            if filtro and not re.search(filtro, caso):
+                continue
+            funcao = ns.get(nome_funcao)
+            if funcao is None:
+                resultados.append(_resumir(caso, "funcao", "escrita" if escrita else "fria", [], [], [], "função não encontrada"))
+                continue
+            limpar = getattr(funcao, "clear", None)
+            fases = ["escrita"] if escrita else ["fria", "quente"]
+            for fase in fases:
+                amostras, consultas, linhas, erro = [], [], [], None
+                if fase == "quente":
+                    args, kwargs = argumentos(contexto, 0)
+                    funcao(*args, **kwargs) # Aquece o cache
+                for i in range(repeticoes):
+                    args, kwargs = argumentos(contexto, i)
+                    if fase == "fria" and limpar:
+                        limpar()
+                    ns["iniciar_metricas_execucao"]()
+                    inicio = time.perf_counter()
+                    try:
+                        resultado = funcao(*args, **kwargs)
+                    except Exception as e:
+                        erro = f"{type(e).__name__}: {e}"
+                        break
+                    amostras.append((time.perf_counter() - inicio) * 1000)
+                    registros = ns["_registros_execucao"]() or []
+                    consultas.append(len(registros))
+                    linhas.append(sum(registro["linhas"] for registro in registros))
+                    if escrita and isinstance(resultado, tuple) and resultado and not resultado[0]:
+                        erro = str(resultado[1]) if len(resultado) > 1 else "falhou"
+                        break
+                resultados.append(_resumir(caso, "funcao", fase, amostras, consultas, linhas, erro))
+    finally:
+        ns["liberar_conexao_leitura"]()
+        ns["iniciar_metricas_execucao"]()
+    st.session_state["_benchmark_resultados"] = resultados
+
+
+def _roteiro_funcoes(caminho_app, contexto, repeticoes, filtro):
+    from benchmark.medicao import medir_funcoes_no_app
+    medir_funcoes_no_app(caminho_app, contexto, repeticoes, filtro)
+
+
+def medir_funcoes(caminho_app, parametros, banco, contexto, repeticoes, filtro=None):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_function(
+        _roteiro_funcoes, default_timeout=TIMEOUT_EXECUCAO_S,
+        args=(caminho_app, contexto, repeticoes, filtro),
+    )
+    at.secrets.update(_secrets(parametros, banco, None))
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"Falha ao medir funções: {at.exception[0].value}")
+    return at.session_state["_benchmark_resultados"]
+
+#endregion
+
+#region Páginas
+
+def _novo_app(caminho_app, secrets, contexto, rotulo):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(caminho_app, default_timeout=TIMEOUT_EXECUCAO_S)
+    at.secrets.update(secrets)
+    at.session_state["usuario_logado"] = True
+    at.session_state["usuario_id"] = contexto["usuario_id"]
+    at.session_state["usuario_nome"] = contexto["usuario_nome"]
+    at.session_state["verificacoes_rodaram"] = True # As verificações são medidas como funções
+    at.session_state["obra_selectbox"] = contexto["obra_nome"]
+    at.session_state["menu_principal"] = rotulo
+    return at
+
+
+def _contar_linhas(caminho):
+    if not os.path.exists(caminho):
+        return 0
+    with open(caminho, encoding="utf-8") as arquivo:
+        return sum(1 for _ in arquivo)
+
+
+def medir_paginas(caminho_app, parametros, banco, contexto, repeticoes, filtro=None):
+    """
+    Executa o app inteiro como um usuário logado em cada página do menu.
+    'fria': app novo com st.cache_data vazio; 'quente': reexecução do mesmo app.
+    As consultas por execução vêm do log JSONL da instrumentação.
+    """
+    import streamlit as st
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as temporario:
+        log_jsonl = os.path.join(temporario, "sql.jsonl")
+        secrets = _secrets(parametros, banco, log_jsonl)
+        for rotulo, caso in CASOS_PAGINAS.items():
+            if filtro and not re.search(filtro, caso):
+                continue
+            for fase in ("fria", "quente"):
+                amostras, consultas, erro = [], [], None
+                at = None
+                if fase == "quente":
+                    at = _novo_app(caminho_app, secrets, contexto, rotulo)
+                    at.run()
+                for _ in range(repeticoes):
+                    if fase == "fria":
+                        st.cache_data.clear()
+                        at = _novo_app(caminho_app, secrets, contexto, rotulo)
+                    linhas_antes = _contar_linhas(log_jsonl)
+                    inicio = time.perf_counter()
+                    at.run()
+                    amostras.append((time.perf_counter() - inicio) * 1000)
+                    consultas.append(_contar_linhas(log_jsonl) - linhas_antes)
+                    if at.exception:
+                        erro = at.exception[0].value
+                        break
+                resultados.append(_resumir(caso, "pagina", fase, amostras, consultas, [], erro))
+    return resultados
+
+#endregion
+
+#region Relatórios
+
+def _commit_atual(caminho_app):
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(caminho_app),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def contar_tabelas(parametros, banco):
+    conexao = conectar(parametros, banco)
+    try:
+        cursor = conexao.cursor()
+        contagens = {}
+        for tabela in TABELAS_CONTADAS:
+            cursor.execute(f"SELECT COUNT(*) FROM {tabela}")
+            contagens[tabela] = cursor.fetchone()[0]
+        cursor.execute("SELECT VERSION()")
+        return contagens, cursor.fetchone()[0]
+    finally:
+        conexao.close()
+
+
+def executar_benchmark(caminho_app, parametros, banco, contexto, repeticoes, filtro=None, funcoes=True, paginas=True):
+    contagens, versao = contar_tabelas(parametros, banco)
+    contexto = {**contexto, "execucao": uuid.uuid4().hex[:8]}
+    resultados = []
+    if funcoes:
+        resultados += medir_funcoes(caminho_app, parametros, banco, contexto, repeticoes, filtro)
+    if paginas:
+        resultados += medir_paginas(caminho_app, parametros, banco, contexto, repeticoes, filtro)
+    return {
+        "meta": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit_atual(caminho_app),
+            "servidor": versao,
+            "repeticoes": repeticoes,
+            "filtro": filtro,
+            "tabelas": contagens,
+        },
+        "resultados": resultados,
+    }
+
+
+def salvar_relatorio(relatorio, diretorio):
+    """Grava o relatório em JSON (completo, para comparar) e CSV (uma linha por caso/fase)."""
+    os.makedirs(diretorio, exist_ok=True)
+    nome = f"benchmark_{datetime.now():%Y%m%d_%H%M%S}_{relatorio['meta']['commit'] or 'sem-commit'}"
+    caminho_json = os.path.join(diretorio, f"{nome}.json")
+    with open(caminho_json, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    caminho_csv = os.path.join(diretorio, f"{nome}.csv")
+    with open(caminho_csv, "w", encoding="utf-8", newline="") as arquivo:
+        escritor = csv.DictWriter(arquivo, fieldnames=list(relatorio["resultados"][0]) if relatorio["resultados"] else ["caso"])
+        escritor.writeheader()
+        escritor.writerows(relatorio["resultados"])
+    return caminho_json, caminho_csv
+
+
+def imprimir_relatorio(relatorio):
+    print(f"\n{'caso':<55} {'fase':<8} {'mediana':>10} {'p95':>10} {'consultas':>9}")
+    for r in relatorio["resultados"]:
+        if r["erro"]:
+            print(f"{r['caso']:<55} {r['fase']:<8} ERRO: {r['erro']}")
+            continue
+        print(f"{r['caso']:<55} {r['fase']:<8} {r['mediana_ms']:>8.1f}ms {r['p95_ms']:>8.1f}ms {r['consultas'] or 0:>9}")
+
+
+def comparar_relatorios(caminho_base, caminho_novo, limite_pct=10.0):
+    """Compara medianas por (caso, fase); variações acima de limite_pct são marcadas."""
+    with open(caminho_base, encoding="utf-8") as arquivo:
+        base = json.load(arquivo)
+    with open(caminho_novo, encoding="utf-8") as arquivo:
+        novo = json.load(arquivo)
+    if base["meta"]["tabelas"] != novo["meta"]["tabelas"]:
+        print("AVISO: os relatórios foram gerados com volumes de dados diferentes.")
+    anteriores = {(r["caso"], r["fase"]): r for r in base["resultados"]}
+    print(f"{base['meta']['commit']} -> {novo['meta']['commit']}")
+    print(f"\n{'caso':<55} {'fase':<8} {'antes':>10} {'depois':>10} {'variação':>9} {'consultas':>11}")
+    piorou = False
+    for r in novo["resultados"]:
+        anterior = anteriores.pop((r["caso"], r["fase"]), None)
+        if not anterior or anterior["mediana_ms"] is None or r["mediana_ms"] is None:
+            situacao = "novo" if not anterior else "erro"
+            print(f"{r['caso']:<55} {r['fase']:<8} {'-':>10} {r['mediana_ms'] or '-':>10} {situacao:>9}")
+            continue
+        variacao = (r["mediana_ms"] - anterior["mediana_ms"]) / anterior["mediana_ms"] * 100 if anterior["mediana_ms"] else 0.0
+        marca = " <<" if variacao > limite_pct else (" ok" if variacao < -limite_pct else "")
+        piorou = piorou or variacao > limite_pct
+        print(
+            f"{r['caso']:<55} {r['fase']:<8} {anterior['mediana_ms']:>8.1f}ms {r['mediana_ms']:>8.1f}ms "
+            f"{variacao:>+8.1f}% {anterior['consultas'] or 0:>5}->{r['consultas'] or 0:<5}{marca}"
+        )
+    for caso, fase in anteriores:
+        print(f"{caso:<55} {fase:<8} (removido)")
+    return piorou
+
+#endregion
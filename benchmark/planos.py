@@ -0,0 +1,110 @@
+"""
+Verificação dos planos de execução (EXPLAIN) das consultas do app.py.
+
+Cada plano chama, dentro do AppTest, a função do app que monta (query, params),
+roda EXPLAIN dessa consulta exata no banco do benchmark e confere o índice usado.
+É o teste que garante que um índice declarado em migracoes/ continua servindo à
+consulta que o motivou: python -m benchmark planos (sai com código 1 se algum falhar)
+ou, na suíte, tests/test_planos.py (pulado quando BENCHMARK_MYSQL_HOST não está definido).
+"""
+
+import runpy
+from datetime import date, datetime, timedelta
+
+from .gerador import conectar
+from .medicao import TIMEOUT_EXECUCAO_S, _secrets
+
+# (nome, função do app que devolve (query, params), argumentos, tabela no EXPLAIN,
+#  índice esperado, texto proibido na coluna Extra)
+PLANOS = [
+    (
+        "historico[ultimos 10]", "montar_consulta_historico",
+        lambda c: ((c["obra_id"],), {"limit": 10}),
+        "movimentacoes", "idx_mov_obra_estornado_data", "Using filesort",
+    ),
+    (
+        "historico[30 dias]", "montar_consulta_historico",
+        lambda c: ((c["obra_id"],), {"data_inicio": date.today() - timedelta(days=30), "data_fim": date.today()}),
+        "movimentacoes", "idx_mov_obra_estornado_data", "Using filesort",
+    ),
+    (
+        "historico[30 dias, por tipo]", "montar_consulta_historico",
+        lambda c: ((c["obra_id"],), {"data_inicio": date.today() - timedelta(days=30), "data_fim": date.today(), "tipos_transacao": ["Entrada"]}),
+        "movimentacoes", "idx_mov_obra_estornado_data", "Using filesort",
+    ),
+    (
+        "historico[pagina seguinte]", "montar_consulta_historico",
+        lambda c: ((c["obra_id"],), {"limit": 50, "apos": (datetime.now() - timedelta(days=30), 2**31 - 1)}),
+        "movimentacoes", "idx_mov_obra_estornado_data", "Using filesort",
+    ),
+    (
+        "historico[por material]", "montar_consulta_historico",
+        lambda c: ((c["obra_id"],), {"limit": 50, "material_id": c["material_id"]}),
+        "movimentacoes", "idx_mov_obra_material_data", "Using filesort",
+    ),
+    (
+        "estoque em data[obra]", "montar_consulta_estoque_em",
+        lambda c: ((c["obra_id"], datetime.now() - timedelta(days=30), datetime.now() - timedelta(days=60)), {}),
+        "movimentacoes", "idx_mov_obra_estornado_data", None,
+    ),
+    (
+        "estoque em data[material]", "montar_consulta_estoque_em",
+        lambda c: ((c["obra_id"], datetime.now() - timedelta(days=30), datetime.now() - timedelta(days=60)), {"material_id": c["material_id"]}),
+        "movimentacoes", "idx_mov_obra_material_data", None,
+    ),
+]
+
+
+def verificar_planos_no_app(caminho_app, contexto, parametros, banco):
+    """Roda DENTRO do AppTest (as funções do app precisam do contexto do Streamlit)."""
+    import streamlit as st
+
+    ns = runpy.run_path(caminho_app, run_name="__benchmark__")
+    conexao = conectar(parametros, banco)
+    resultados = []
+    try:
+        cursor = conexao.cursor(dictionary=True)
+        for nome, funcao, argumentos, tabela, indice, proibido in PLANOS:
+            args, kwargs = argumentos(contexto)
+            query, params = ns[funcao](*args, **kwargs)
+            cursor.execute(f"EXPLAIN {query}", tuple(params))
+            linha = next((l for l in cursor.fetchall() if l["table"] == tabela), None)
+            chave = linha["key"] if linha else None
+            extra = (linha or {}).get("Extra") or ""
+            resultados.append({
+                "plano": nome,
+                "tabela": tabela,
+                "indice_esperado": indice,
+                "indice_usado": chave,
+                "extra": extra,
+                "ok": chave == indice and not (proibido and proibido in extra),
+            })
+    finally:
+        conexao.close()
+    st.session_state["_benchmark_planos"] = resultados
+
+
+def _roteiro_planos(caminho_app, contexto, parametros, banco):
+    from benchmark.planos import verificar_planos_no_app
+    verificar_planos_no_app(caminho_app, contexto, parametros, banco)
+
+
+def verificar_planos(caminho_app, parametros, banco, contexto):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_function(
+        _roteiro_planos, default_timeout=TIMEOUT_EXECUCAO_S,
+        args=(caminho_app, contexto, parametros, banco),
+    )
+    at.secrets.update(_secrets(parametros, banco, None))
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"Falha ao verificar planos: {at.exception[0].value}")
+    return at.session_state["_benchmark_planos"]
+
+
+def imprimir_planos(resultados):
+    for r in resultados:
+        situacao = "OK  " if r["ok"] else "FALHOU"
+        print(f"{situacao} {r['plano']:<35} {r['tabela']}: esperado {r['indice_esperado']}, usado {r['indice_usado']} {r['extra']}")
+    return all(r["ok"] for r in resultados)
@@ -0,0 +1,138 @@
+"""Servidor MySQL descartável para o benchmark."""
+
+import os
+import shutil
+import subprocess
+import time
+
+import mysql.connector
+from mysql.connector import Error
+
+BANCO_PADRAO = "almoxarifado_benchmark"
+
+
+def aguardar_servidor(parametros, timeout=60):
+    """Tenta conectar até o servidor responder ou o tempo acabar."""
+    limite = time.monotonic() + timeout
+    while True:
+        try:
+            conexao = mysql.connector.connect(**parametros)
+            conexao.close()
+            return
+        except Error as e:
+            if time.monotonic() > limite:
+                raise RuntimeError(f"Servidor MySQL não respondeu em {timeout}s: {e}")
+            time.sleep(0.5)
+
+
+def _eh_mariadb(binario):
+    """Em muitas distribuições 'mysqld' é só um link para o mariadbd."""
+    try:
+        versao = subprocess.run([binario, "--version"], capture_output=True, text=True).stdout
+    except OSError:
+        return False
+    return "mariadb" in versao.lower()
+
+
+class ServidorLocal:
+    """
+    Sobe um mysqld próprio num diretório de dados local (inicializado na primeira
+    vez e reaproveitado depois) ou, sem binário no PATH, um contêiner Docker do
+    MySQL. Usuário root sem senha, apenas em 127.0.0.1.
+    O MariaDB é o último recurso: ele não tem o parser ngram do FULLTEXT usado na
+    busca de materiais (migracoes/002), então essa migração falha nele.
+    """
+
+    def __init__(self, diretorio, porta=3307):
+        self.diretorio = os.path.abspath(diretorio)
+        self.porta = porta
+        self._processo = None
+        self._conteiner = None
+
+    @property
+    def parametros(self):
+        return {"host": "127.0.0.1", "port": self.porta, "user": "root", "password": ""}
+
+    def iniciar(self):
+        mysqld = shutil.which("mysqld")
+        if mysqld and not _eh_mariadb(mysqld):
+            self._iniciar_binario(mysqld)
+        elif shutil.which("docker"):
+            self._iniciar_docker()
+        elif shutil.which("mariadbd") or mysqld:
+            print("AVISO: usando MariaDB; a busca FULLTEXT com ngram não estará disponível.")
+            self._iniciar_binario(shutil.which("mariadbd") or mysqld)
+        else:
+            raise RuntimeError(
+                "Nenhum mysqld ou docker encontrado. Instale o MySQL 8 ou informe um "
+                "servidor existente com --host/--porta/--usuario/--senha."
+            )
+        aguardar_servidor(self.parametros)
+        return self
+
+    def _iniciar_binario(self, binario):
+        dados = os.path.join(self.diretorio, "dados")
+        extras = ["--user=root"] if hasattr(os, "geteuid") and os.geteuid() == 0 else []
+        if not os.path.isdir(dados) or not os.listdir(dados):
+            os.makedirs(dados, exist_ok=True)
+            instalador = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+            if _eh_mariadb(binario) and instalador:
+                comando = [instalador, f"--datadir={dados}", "--auth-root-authentication-method=normal", *extras]
+            else:
+                comando = [binario, "--initialize-insecure", f"--datadir={dados}", *extras]
+            subprocess.run(comando, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        log = open(os.path.join(self.diretorio, "servidor.log"), "ab")
+        self._processo = subprocess.Popen(
+            [
+                binario,
+                f"--datadir={dados}",
+                f"--port={self.porta}",
+                "--bind-address=127.0.0.1",
+                f"--socket={os.path.join(self.diretorio, 'mysqld.sock')}",
+                f"--pid-file={os.path.join(self.diretorio, 'mysqld.pid')}",
+                "--innodb-buffer-pool-size=512M",
+                "--innodb-flush-log-at-trx-commit=2", # Carga rápida; o benchmark não precisa de durabilidade
+                "--max-connections=200",
+                *extras,
+            ],
+            stdout=log,
+            stderr=log,
+        )
+
+    def _iniciar_docker(self):
+        nome = f"almoxarifado-benchmark-{self.porta}"
+        subprocess.run(["docker", "rm", "-f", nome], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.makedirs(self.diretorio, exist_ok=True)
+        subprocess.run(
+            [
+                "docker", "run", "-d", "--rm", "--name", nome,
+                "-e", "MYSQL_ALLOW_EMPTY_PASSWORD=yes",
+                "-p", f"127.0.0.1:{self.porta}:3306",
+                "-v", f"{os.path.join(self.diretorio, 'docker')}:/var/lib/mysql",
+                "mysql:8.4",
+                "--innodb-buffer-pool-size=512M",
+                "--innodb-flush-log-at-trx-commit=2",
+                "--max-connections=200",
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        self._conteiner = nome
+
+    def parar(self):
+        if self._processo and self._processo.poll() is None:
+            self._processo.terminate()
+            try:
+                self._processo.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self._processo.kill()
+        if self._conteiner:
+            subprocess.run(["docker", "stop", self._conteiner], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._processo = None
+        self._conteiner = None
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
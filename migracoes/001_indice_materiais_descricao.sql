@@ -0,0 +1,3 @@
+-- Paginação por chave da lista de materiais: ORDER BY descricao, id e busca por
+-- (descricao, id) > último item visto. No InnoDB o índice secundário já carrega o id.
+CREATE INDEX idx_materiais_descricao ON materiais (descricao);
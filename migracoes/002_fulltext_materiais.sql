@@ -0,0 +1,4 @@
+-- Busca de materiais por descrição/código (buscar_materiais_paginados).
+-- O parser ngram (MySQL 5.7.6+) indexa pedaços de ngram_token_size caracteres (padrão 2),
+-- então um termo casa no início ou no meio das palavras, inclusive em códigos.
+ALTER TABLE materiais ADD FULLTEXT INDEX ft_materiais_busca (descricao, codigo) WITH PARSER ngram;
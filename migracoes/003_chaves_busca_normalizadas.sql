@@ -0,0 +1,15 @@
+-- Chaves de busca normalizadas (ver normalizar_busca no app.py): sem acentos, minúsculas,
+-- só letras/dígitos separados por um espaço. O app grava a chave em toda escrita do texto;
+-- o UPDATE abaixo preenche as linhas existentes com a expressão equivalente para o
+-- português (MySQL 8: REGEXP_REPLACE).
+ALTER TABLE materiais ADD COLUMN descricao_busca VARCHAR(255) NOT NULL DEFAULT '' AFTER descricao;
+UPDATE materiais SET descricao_busca = TRIM(REGEXP_REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(LOWER(descricao), 'á', 'a'), 'à', 'a'), 'â', 'a'), 'ã', 'a'), 'ä', 'a'), 'é', 'e'), 'è', 'e'), 'ê', 'e'), 'ë', 'e'), 'í', 'i'), 'ì', 'i'), 'î', 'i'), 'ï', 'i'), 'ó', 'o'), 'ò', 'o'), 'ô', 'o'), 'õ', 'o'), 'ö', 'o'), 'ú', 'u'), 'ù', 'u'), 'û', 'u'), 'ü', 'u'), 'ç', 'c'), 'ñ', 'n'), 'º', 'o'), 'ª', 'a'), '²', '2'), '³', '3'), '[^a-z0-9]+', ' '));
+CREATE INDEX idx_materiais_descricao_busca ON materiais (descricao_busca);
+
+-- A busca textual passa a usar a chave normalizada
+ALTER TABLE materiais DROP INDEX ft_materiais_busca;
+ALTER TABLE materiais ADD FULLTEXT INDEX ft_materiais_busca (descricao_busca, codigo) WITH PARSER ngram;
+
+ALTER TABLE planejamento_tarefas ADD COLUMN nome_tarefa_busca VARCHAR(255) NOT NULL DEFAULT '' AFTER nome_tarefa;
+UPDATE planejamento_tarefas SET nome_tarefa_busca = TRIM(REGEXP_REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(LOWER(nome_tarefa), 'á', 'a'), 'à', 'a'), 'â', 'a'), 'ã', 'a'), 'ä', 'a'), 'é', 'e'), 'è', 'e'), 'ê', 'e'), 'ë', 'e'), 'í', 'i'), 'ì', 'i'), 'î', 'i'), 'ï', 'i'), 'ó', 'o'), 'ò', 'o'), 'ô', 'o'), 'õ', 'o'), 'ö', 'o'), 'ú', 'u'), 'ù', 'u'), 'û', 'u'), 'ü', 'u'), 'ç', 'c'), 'ñ', 'n'), 'º', 'o'), 'ª', 'a'), '²', '2'), '³', '3'), '[^a-z0-9]+', ' '));
+CREATE INDEX idx_tarefas_obra_nome_busca ON planejamento_tarefas (obra_id, nome_tarefa_busca);
@@ -0,0 +1,3 @@
+-- Histórico de movimentações (montar_consulta_historico): igualdade em obra_id e estornado,
+-- intervalo e ORDER BY em data. Verificado por: python -m benchmark planos
+CREATE INDEX idx_mov_obra_estornado_data ON movimentacoes (obra_id, estornado, data);
@@ -0,0 +1,13 @@
+-- Movimentações passam a apontar para o material por id (antes só havia a descrição).
+-- O backfill só preenche as linhas cuja descrição identifica um único material; as
+-- ambíguas ficam com material_id NULL e o estorno delas volta a exigir descrição única.
+-- ON DELETE SET NULL: excluir um material não apaga nem bloqueia o histórico.
+ALTER TABLE movimentacoes ADD COLUMN material_id INT NULL AFTER obra_id;
+UPDATE movimentacoes mv
+JOIN (SELECT descricao, MIN(id) AS id FROM materiais GROUP BY descricao HAVING COUNT(*) = 1) m ON m.descricao = mv.descricao
+SET mv.material_id = m.id
+WHERE mv.material_id IS NULL;
+ALTER TABLE movimentacoes ADD CONSTRAINT fk_movimentacoes_material FOREIGN KEY (material_id) REFERENCES materiais(id) ON DELETE SET NULL;
+
+-- Histórico e análises por material dentro de uma obra. Verificado por: python -m benchmark planos
+CREATE INDEX idx_mov_obra_material_data ON movimentacoes (obra_id, material_id, data);
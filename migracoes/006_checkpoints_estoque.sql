@@ -0,0 +1,14 @@
+-- Saldos periódicos por (obra, material): quantidade = soma das movimentações com
+-- data < data_corte. Pares com saldo zero não são gravados (ausência = zero).
+-- O estoque numa data qualquer é o checkpoint mais próximo antes dela mais as
+-- movimentações desde então (calcular_estoque_em_db no app.py).
+CREATE TABLE IF NOT EXISTS estoque_checkpoints (
+    obra_id INT NOT NULL,
+    material_id INT NOT NULL,
+    data_corte DATETIME NOT NULL,
+    quantidade DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (obra_id, material_id, data_corte),
+    KEY idx_checkpoints_corte (data_corte),
+    FOREIGN KEY (obra_id) REFERENCES obras(id) ON DELETE CASCADE,
+    FOREIGN KEY (material_id) REFERENCES materiais(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,20 @@
+-- Área de preparo da importação de materiais em lote (cadastrar_materiais_em_lote_db).
+-- Cada importação grava suas linhas sob um 'lote' próprio, valida tudo com comandos
+-- de conjunto, copia as válidas para materiais e apaga o lote, na mesma transação:
+-- fora dela a tabela fica sempre vazia. As colunas são mais largas que as de materiais
+-- para que textos longos demais virem erro de validação da linha, não do lote inteiro.
+CREATE TABLE IF NOT EXISTS materiais_importacao (
+    lote CHAR(36) NOT NULL,
+    linha INT NOT NULL,
+    codigo VARCHAR(255),
+    descricao VARCHAR(1000),
+    descricao_busca VARCHAR(1000),
+    unidade VARCHAR(255),
+    categoria VARCHAR(255),
+    estoque_minimo DECIMAL(14,2),
+    estoque_maximo DECIMAL(14,2),
+    observacoes TEXT,
+    erro VARCHAR(255),
+    PRIMARY KEY (lote, linha),
+    KEY idx_importacao_lote_codigo (lote, codigo)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,24 @@
+-- Sincronização do planejamento importado do MS Project (sincronizar_tarefas_db no app.py).
+-- A tarefa é identificada pelo ID exclusivo do MS Project dentro da obra: a chave única
+-- sustenta o INSERT ... ON DUPLICATE KEY UPDATE e as junções com a área de preparo.
+-- Se o ALTER falhar, há tarefas repetidas; elas aparecem com:
+--   SELECT obra_id, unique_id_mpp, COUNT(*) FROM planejamento_tarefas GROUP BY 1, 2 HAVING COUNT(*) > 1
+ALTER TABLE planejamento_tarefas ADD UNIQUE KEY uk_tarefas_obra_unique_id (obra_id, unique_id_mpp);
+
+-- Área de preparo do plano: cada importação grava as tarefas do arquivo sob um 'lote'
+-- próprio e o apaga na mesma transação (fora dela a tabela fica sempre vazia).
+-- 'acao', 'tarefa_id' e 'nome_anterior' são preenchidos pela comparação com
+-- planejamento_tarefas e dão o relatório de adicionadas/modificadas.
+CREATE TABLE IF NOT EXISTS planejamento_importacao (
+    lote CHAR(36) NOT NULL,
+    unique_id_mpp INT NOT NULL,
+    linha INT NOT NULL,
+    nome_tarefa VARCHAR(255) NOT NULL,
+    nome_tarefa_busca VARCHAR(255) NOT NULL DEFAULT '',
+    data_inicio DATE NOT NULL,
+    data_fim DATE,
+    acao VARCHAR(20),
+    tarefa_id INT,
+    nome_anterior VARCHAR(255),
+    PRIMARY KEY (lote, unique_id_mpp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,10 @@
+-- Uma notificação de compra por vínculo kit-tarefa. verificar_e_gerar_notificacoes_compra
+-- gera as notificações com um único INSERT ... SELECT e conta com esta chave para não
+-- duplicar quando duas sessões rodam a verificação ao mesmo tempo.
+-- Duplicatas antigas (mesma corrida, antes da chave): fica a que já andou no fluxo (status
+-- diferente de 'Pendente'), para não perder o andamento da compra; no empate, a de menor id.
+DELETE n FROM notificacoes_compra n
+JOIN notificacoes_compra mantida ON mantida.kit_vinculado_id = n.kit_vinculado_id
+    AND ((mantida.status <> 'Pendente') > (n.status <> 'Pendente')
+        OR ((mantida.status <> 'Pendente') = (n.status <> 'Pendente') AND mantida.id < n.id));
+ALTER TABLE notificacoes_compra ADD UNIQUE KEY uk_notificacoes_vinculo (kit_vinculado_id);
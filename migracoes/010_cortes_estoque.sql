@@ -0,0 +1,8 @@
+-- Datas de corte já geradas para estoque_checkpoints. Os checkpoints só guardam pares
+-- com saldo diferente de zero, então as datas distintas da própria tabela não provam
+-- que um corte existe; ajustar_checkpoints_estoque e calcular_estoque_em_db leem os
+-- cortes daqui, e gerar_checkpoints_estoque_db grava cada corte junto com os saldos.
+CREATE TABLE IF NOT EXISTS estoque_cortes (
+    data_corte DATETIME NOT NULL PRIMARY KEY
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT IGNORE INTO estoque_cortes (data_corte) SELECT DISTINCT data_corte FROM estoque_checkpoints;
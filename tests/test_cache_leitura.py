@@ -0,0 +1,43 @@
+"""Invalidação por tags do cache_leitura (app.py), rodando o app dentro do AppTest."""
+
+import os
+
+from streamlit.testing.v1 import AppTest
+
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# O app para na tela de login; nenhum teste daqui precisa de um MySQL de verdade
+SECRETS_SEM_BANCO = {
+    "db": {"host": "127.0.0.1", "port": 1, "user": "teste", "password": "", "database": "teste"},
+    "instrumentacao": {"ativa": False, "admins": [], "log_jsonl": None},
+}
+
+
+def _roteiro_filtro_alterado_no_session_state(caminho_app):
+    import runpy
+
+    import streamlit as st
+
+    ns = runpy.run_path(caminho_app, run_name="__teste__")
+    banco = ["Cimento A", "Areia Fina"]
+
+    @ns["cache_leitura"](ttl=300, tags=[("materiais", None)])
+    def buscar(filtros):
+        return [nome for nome in banco if filtros["nome"].lower() in nome.lower()]
+
+    # Mesmo padrão da tela de materiais: o dicionário de filtros é alterado no lugar
+    filtros = {"nome": "cimento"}
+    buscar(filtros)
+    filtros["nome"] = "areia"
+    buscar(filtros)
+    banco.append("Cimento B")
+    ns["invalidar_cache"](("materiais", None))
+    filtros["nome"] = "cimento"
+    st.session_state["_resultado"] = buscar(filtros)
+
+
+def test_invalidacao_limpa_chamadas_com_filtro_alterado_depois():
+    at = AppTest.from_function(_roteiro_filtro_alterado_no_session_state, args=(CAMINHO_APP,), default_timeout=30)
+    at.secrets.update(SECRETS_SEM_BANCO)
+    at.run()
+    assert not at.exception
+    assert at.session_state["_resultado"] == ["Cimento A", "Cimento B"]
@@ -0,0 +1,42 @@
+"""
+Planos de execução das consultas do histórico (benchmark/planos.py) como teste.
+
+Precisa de um MySQL já carregado com 'python -m benchmark carregar'; sem a variável
+BENCHMARK_MYSQL_HOST o teste é pulado. Ex.:
+
+    BENCHMARK_MYSQL_HOST=127.0.0.1 BENCHMARK_MYSQL_PORTA=3307 python -m pytest tests/test_planos.py
+"""
+
+import os
+
+import pytest
+
+from benchmark.casos import carregar_contexto
+from benchmark.planos import PLANOS, verificar_planos
+from benchmark.servidor import BANCO_PADRAO
+
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("BENCHMARK_MYSQL_HOST"),
+    reason="BENCHMARK_MYSQL_HOST não definido (banco do benchmark indisponível)",
+)
+
+
+@pytest.fixture(scope="module")
+def resultados_planos():
+    parametros = {
+        "host": os.environ.get("BENCHMARK_MYSQL_HOST"),
+        "port": int(os.environ.get("BENCHMARK_MYSQL_PORTA", "3307")),
+        "user": os.environ.get("BENCHMARK_MYSQL_USUARIO", "root"),
+        "password": os.environ.get("BENCHMARK_MYSQL_SENHA", ""),
+    }
+    banco = os.environ.get("BENCHMARK_MYSQL_BANCO", BANCO_PADRAO)
+    contexto = carregar_contexto(parametros, banco)
+    return {r["plano"]: r for r in verificar_planos(CAMINHO_APP, parametros, banco, contexto)}
+
+
+@pytest.mark.parametrize("plano", [nome for nome, *_ in PLANOS])
+def test_consulta_usa_indice_declarado(resultados_planos, plano):
+    r = resultados_planos[plano]
+    assert r["ok"], f"{r['tabela']}: esperado {r['indice_esperado']}, usado {r['indice_usado']} ({r['extra']})"